@@ -1,4 +1,5 @@
 # -*- coding: utf-8 -*-
+import os
 import sys
 import webbrowser
 from threading import Timer, Lock
@@ -11,9 +12,10 @@ import gc  # 新增：垃圾回收
 # === 匯入核心與邏輯轉接器 ===
 try:
     import ziwei_core as engine
+    import ziwei_roster as roster
     import zh2_logic as logic_adapter
 except ImportError as e:
-    print(f"【嚴重錯誤】找不到模組！{e}。請確保 ziwei_core.py 與 zh2_logic.py 在同一目錄下。")
+    print(f"【嚴重錯誤】找不到模組！{e}。請確保 ziwei_core.py、ziwei_calendar.py、ziwei_ganzhi.py、ziwei_trace.py、ziwei_roster.py 與 zh2_logic.py 在同一目錄下。")
     sys.exit(1)
 
 # === Selenium 相關套件 ===
@@ -31,6 +33,9 @@ except ImportError:
 
 app = Flask(__name__)
 
+# 名冊資料庫（有設定才用）：已存的命盤不必再爬，夜間排程算好的結果直接回傳
+ROSTER_DB = os.environ.get("ZIWEI_ROSTER_DB", "")
+
 # 全域鎖：確保同一時間只有一個 Chrome 瀏覽器在執行，防止記憶體炸裂
 scrape_lock = Lock()
 
@@ -373,6 +378,24 @@ HTML_TEMPLATE = """
 </html>
 """
 
+# ================= 預先計算結果 (Roster) =================
+def lookup_roster(year, month, day, hour, sex, target_year):
+    """
+    從名冊找這組生辰：回傳 (命盤原文, 該年預先算好的輸出)，找不到的部分為空字串／None。
+    沒設定 ZIWEI_ROSTER_DB 或生辰不合法時一律回傳 ("", None)，交給原本的流程處理。
+    """
+    if not ROSTER_DB:
+        return "", None
+    try:
+        key = roster.chart_key(int(year), int(month), int(day), int(hour), sex)
+        conn = roster.open_roster(ROSTER_DB)
+    except Exception:
+        return "", None
+    try:
+        return roster.get_chart_raw(conn, key), roster.get_precomputed_output(conn, key, target_year)
+    finally:
+        conn.close()
+
 # ================= 路由控制 (Controller) =================
 
 @app.route("/", methods=["GET", "POST"])
@@ -405,16 +428,18 @@ def index():
             
             target_year = int(target_year_str) if target_year_str else default_target_year
 
-            # 1. 執行爬蟲
-            raw_data = scrape_and_format_raw_text(year, month, day, hour, sex)
+            # 1. 名冊裡有就不爬；沒有才執行爬蟲
+            raw_data, precomputed = lookup_roster(year, month, day, hour, sex, target_year)
+            if not raw_data:
+                raw_data = scrape_and_format_raw_text(year, month, day, hour, sex)
             
             if "錯誤" in raw_data and "【" not in raw_data:
                 context["error"] = raw_data
             else:
                 context["raw_data"] = raw_data
                 try:
-                    # 2. 核心分析
-                    final_res_text = engine.run_chart_from_text(raw_data, target_year=target_year)
+                    # 2. 核心分析（夜間排程已算好的直接用）
+                    final_res_text = precomputed or engine.run_chart_from_text(raw_data, target_year=target_year)
                     
                     # 3. 呼叫 zh2_logic 進行九區塊重組
                     blocks_data = logic_adapter.process_ziwei_data(final_res_text)
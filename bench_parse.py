@@ -0,0 +1,106 @@
+# -*- coding: utf-8 -*-
+"""
+parse_chart 效能比較：單趟掃描版 parse_chart vs 舊版 parse_chart_regex。
+
+用法：
+  python bench_parse.py                 # 以隨機產生的 20000 張命盤測試
+  python bench_parse.py -n 50000        # 指定張數
+  python bench_parse.py charts/*.txt    # 用已存的命盤原始文字檔（每檔一張）
+
+兩個版本的解析結果會逐張比對，不一致即中止。
+"""
+import argparse
+import random
+import sys
+import time
+
+import ziwei_core as engine
+
+PALACES = ["命宮", "兄弟宮", "夫妻宮", "子女宮", "財帛宮", "疾厄宮",
+           "遷移宮", "交友宮", "事業宮", "田宅宮", "福德宮", "父母宮"]
+OTHER_STARS = ["天刑", "天姚", "紅鸞", "天喜", "三台", "八座", "恩光", "天貴"]
+SUFFIXES = ["", "", "旺", "陷", "廟", "地", "平", "利", "祿", "權"]
+SEPARATORS = [",", "，", " ", "、"]
+
+
+def make_chart(rng: random.Random) -> str:
+    """產生一張格式與爬蟲輸出相同的隨機命盤文字（只求格式正確，不求命理正確）。"""
+    byear = rng.randint(1930, 2020)
+    year_stem = engine.STEMS[(byear - 1984) % 10]
+    year_branch = engine.ZODIAC[(byear - 1984) % 12]
+    ming = rng.randrange(12)
+    ju = rng.choice([2, 3, 4, 5, 6])
+
+    stars = {b: [] for b in engine.ZODIAC}
+    pool = (engine.MAIN_STARS + engine.AUX_STARS + engine.MINI_STARS + OTHER_STARS + ["陀羅"])
+    for s in pool:
+        if s == "陀螺":
+            continue
+        stars[rng.choice(engine.ZODIAC)].append(s + rng.choice(SUFFIXES))
+
+    lines = [
+        f"陽曆: {byear}年{rng.randint(1, 12)}月{rng.randint(1, 28)}日",
+        f"干支: {year_stem}{year_branch}年",
+        "",
+    ]
+    for k in range(12):
+        branch = engine.ZODIAC[(ming - k) % 12]
+        stem = engine.STEMS[(k * 3 + ming) % 10]
+        start = ju + 10 * k
+        star_line = rng.choice(SEPARATORS).join(stars[branch]) or "無"
+        lines += [
+            f"{stem}{branch}【{PALACES[k]}】",
+            f"大限:{start}-{start + 9}",
+            "小限:1 13 25 37",
+            star_line,
+            "",
+        ]
+    return "\n".join(lines)
+
+
+def load_charts(paths, count: int) -> list:
+    if paths:
+        charts = []
+        for p in paths:
+            with open(p, "r", encoding="utf-8") as f:
+                charts.append(f.read())
+        return charts
+    rng = random.Random(2024)
+    return [make_chart(rng) for _ in range(count)]
+
+
+def bench(fn, charts: list) -> float:
+    t0 = time.perf_counter()
+    for raw in charts:
+        fn(raw)
+    return time.perf_counter() - t0
+
+
+def main():
+    ap = argparse.ArgumentParser(description="parse_chart 效能比較")
+    ap.add_argument("files", nargs="*", help="命盤原始文字檔；不給則隨機產生")
+    ap.add_argument("-n", "--count", type=int, default=20000, help="隨機命盤張數（預設 20000）")
+    args = ap.parse_args()
+
+    charts = load_charts(args.files, args.count)
+    if not charts:
+        print("沒有命盤可測。")
+        return 1
+
+    for raw in charts:
+        if engine.parse_chart(raw) != engine.parse_chart_regex(raw):
+            print("解析結果不一致：\n" + raw[:500])
+            return 1
+
+    t_regex = bench(engine.parse_chart_regex, charts)
+    t_scan = bench(engine.parse_chart, charts)
+    n = len(charts)
+    print(f"命盤張數         : {n}")
+    print(f"parse_chart_regex: {t_regex:.3f}s（{n / t_regex:,.0f} 張/秒）")
+    print(f"parse_chart      : {t_scan:.3f}s（{n / t_scan:,.0f} 張/秒）")
+    print(f"加速             : {t_regex / t_scan:.2f}x")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,135 @@
+# -*- coding: utf-8 -*-
+"""
+農曆表（1900–2100）
+
+每個農曆年壓成一個整數（與常見的 lunarInfo 表同格式）：
+  bit 0-3  : 閏月月份（0 = 當年無閏月）
+  bit 4-15 : 正月~十二月大小（bit 15 = 正月；1 = 大月 30 天，0 = 小月 29 天）
+  bit 16   : 閏月大小
+各年正月初一的國曆日期，由 1900 年正月初一（1900-01-31）逐年累加，
+匯入模組時一次算好（201 筆整數），之後查詢都是查表。
+"""
+from datetime import date, timedelta
+from bisect import bisect_right
+from functools import lru_cache
+
+LUNAR_MIN_YEAR = 1900
+LUNAR_MAX_YEAR = 2100
+
+_LUNAR_INFO = (
+    0x04bd8, 0x04ae0, 0x0a570, 0x054d5, 0x0d260, 0x0d950, 0x16554, 0x056a0, 0x09ad0, 0x055d2,  # 1900-1909
+    0x04ae0, 0x0a5b6, 0x0a4d0, 0x0d250, 0x1d255, 0x0b540, 0x0d6a0, 0x0ada2, 0x095b0, 0x14977,  # 1910-1919
+    0x04970, 0x0a4b0, 0x0b4b5, 0x06a50, 0x06d40, 0x1ab54, 0x02b60, 0x09570, 0x052f2, 0x04970,  # 1920-1929
+    0x06566, 0x0d4a0, 0x0ea50, 0x16a95, 0x05ad0, 0x02b60, 0x186e3, 0x092e0, 0x1c8d7, 0x0c950,  # 1930-1939
+    0x0d4a0, 0x1d8a6, 0x0b550, 0x056a0, 0x1a5b4, 0x025d0, 0x092d0, 0x0d2b2, 0x0a950, 0x0b557,  # 1940-1949
+    0x06ca0, 0x0b550, 0x15355, 0x04da0, 0x0a5b0, 0x14573, 0x052b0, 0x0a9a8, 0x0e950, 0x06aa0,  # 1950-1959
+    0x0aea6, 0x0ab50, 0x04b60, 0x0aae4, 0x0a570, 0x05260, 0x0f263, 0x0d950, 0x05b57, 0x056a0,  # 1960-1969
+    0x096d0, 0x04dd5, 0x04ad0, 0x0a4d0, 0x0d4d4, 0x0d250, 0x0d558, 0x0b540, 0x0b6a0, 0x195a6,  # 1970-1979
+    0x095b0, 0x049b0, 0x0a974, 0x0a4b0, 0x0b27a, 0x06a50, 0x06d40, 0x0af46, 0x0ab60, 0x09570,  # 1980-1989
+    0x04af5, 0x04970, 0x064b0, 0x074a3, 0x0ea50, 0x06b58, 0x05ac0, 0x0ab60, 0x096d5, 0x092e0,  # 1990-1999
+    0x0c960, 0x0d954, 0x0d4a0, 0x0da50, 0x07552, 0x056a0, 0x0abb7, 0x025d0, 0x092d0, 0x0cab5,  # 2000-2009
+    0x0a950, 0x0b4a0, 0x0baa4, 0x0ad50, 0x055d9, 0x04ba0, 0x0a5b0, 0x15176, 0x052b0, 0x0a930,  # 2010-2019
+    0x07954, 0x06aa0, 0x0ad50, 0x05b52, 0x04b60, 0x0a6e6, 0x0a4e0, 0x0d260, 0x0ea65, 0x0d530,  # 2020-2029
+    0x05aa0, 0x076a3, 0x096d0, 0x04afb, 0x04ad0, 0x0a4d0, 0x1d0b6, 0x0d250, 0x0d520, 0x0dd45,  # 2030-2039
+    0x0b5a0, 0x056d0, 0x055b2, 0x049b0, 0x0a577, 0x0a4b0, 0x0aa50, 0x1b255, 0x06d20, 0x0ada0,  # 2040-2049
+    0x14b63, 0x09370, 0x049f8, 0x04970, 0x064b0, 0x168a6, 0x0ea50, 0x06b20, 0x1a6c4, 0x0aae0,  # 2050-2059
+    0x092e0, 0x0d2e3, 0x0c960, 0x0d557, 0x0d4a0, 0x0da50, 0x05d55, 0x056a0, 0x0a6d0, 0x055d4,  # 2060-2069
+    0x052d0, 0x0a9b8, 0x0a950, 0x0b4a0, 0x0b6a6, 0x0ad50, 0x055a0, 0x0aba4, 0x0a5b0, 0x052b0,  # 2070-2079
+    0x0b273, 0x06930, 0x07337, 0x06aa0, 0x0ad50, 0x14b55, 0x04b60, 0x0a570, 0x054e4, 0x0d160,  # 2080-2089
+    0x0e968, 0x0d520, 0x0daa0, 0x16aa6, 0x056d0, 0x04ae0, 0x0a9d4, 0x0a2d0, 0x0d150, 0x0f252,  # 2090-2099
+    0x0d520,  # 2100-2100
+)
+
+_BASE_NEW_YEAR = date(1900, 1, 31)  # 1900 年正月初一
+
+def _leap_month(info: int) -> int:
+    return info & 0xF
+
+def _month_days(info: int, month_no: int) -> int:
+    return 30 if info & (0x10000 >> month_no) else 29
+
+def _leap_days(info: int) -> int:
+    if not _leap_month(info):
+        return 0
+    return 30 if info & 0x10000 else 29
+
+def _year_days(info: int) -> int:
+    return 348 + bin((info >> 4) & 0xFFF).count("1") + _leap_days(info)
+
+def _build_new_year_ordinals():
+    out, ordinal = [], _BASE_NEW_YEAR.toordinal()
+    for info in _LUNAR_INFO:
+        out.append(ordinal)
+        ordinal += _year_days(info)
+    out.append(ordinal)  # LUNAR_MAX_YEAR + 1 的正月初一（作為上界）
+    return tuple(out)
+
+_NEW_YEAR_ORDINALS = _build_new_year_ordinals()
+
+# ==================== 查詢 ====================
+
+def lunar_year_supported(year: int) -> bool:
+    return LUNAR_MIN_YEAR <= year <= LUNAR_MAX_YEAR
+
+def _info(year: int) -> int:
+    if not lunar_year_supported(year):
+        raise ValueError(f"農曆表只涵蓋 {LUNAR_MIN_YEAR}~{LUNAR_MAX_YEAR} 年：{year}")
+    return _LUNAR_INFO[year - LUNAR_MIN_YEAR]
+
+def lunar_leap_month(year: int) -> int:
+    """該年閏幾月（0 = 無閏月）。"""
+    return _leap_month(_info(year))
+
+def lunar_new_year(year: int) -> date:
+    """農曆 year 年正月初一的國曆日期。"""
+    _info(year)
+    return date.fromordinal(_NEW_YEAR_ORDINALS[year - LUNAR_MIN_YEAR])
+
+@lru_cache(maxsize=None)
+def lunar_year_months(year: int) -> tuple:
+    """
+    一整年的農曆月份（依序，閏月緊接在同號月份之後）：
+      ((月, 是否閏月, 天數, 初一國曆 date), ...)
+    """
+    info = _info(year)
+    leap = _leap_month(info)
+    ordinal = _NEW_YEAR_ORDINALS[year - LUNAR_MIN_YEAR]
+    months = []
+    for m in range(1, 13):
+        days = _month_days(info, m)
+        months.append((m, False, days, date.fromordinal(ordinal)))
+        ordinal += days
+        if m == leap:
+            days = _leap_days(info)
+            months.append((m, True, days, date.fromordinal(ordinal)))
+            ordinal += days
+    return tuple(months)
+
+def lunar_month_days(year: int, month_no: int, leap: bool = False) -> int:
+    """農曆某月天數；沒有這個月（例如非閏月卻傳 leap=True）回傳 0。"""
+    for m, is_leap, days, _ in lunar_year_months(year):
+        if m == month_no and is_leap == leap:
+            return days
+    return 0
+
+def lunar_to_solar(year: int, month_no: int, day_no: int, leap: bool = False) -> date:
+    """農曆 → 國曆。"""
+    for m, is_leap, days, start in lunar_year_months(year):
+        if m == month_no and is_leap == leap:
+            if not 1 <= day_no <= days:
+                raise ValueError(f"農曆 {year} 年{'閏' if leap else ''}{month_no} 月沒有第 {day_no} 天")
+            return start + timedelta(days=day_no - 1)
+    raise ValueError(f"農曆 {year} 年沒有{'閏' if leap else ''}{month_no} 月")
+
+def solar_to_lunar(d: date):
+    """國曆 → 農曆：回傳 (年, 月, 日, 是否閏月)。"""
+    ordinal = d.toordinal()
+    idx = bisect_right(_NEW_YEAR_ORDINALS, ordinal) - 1
+    if idx < 0 or idx >= len(_LUNAR_INFO):
+        raise ValueError(f"日期超出農曆表範圍（{LUNAR_MIN_YEAR}~{LUNAR_MAX_YEAR}）：{d}")
+    year = LUNAR_MIN_YEAR + idx
+    for m, is_leap, days, start in lunar_year_months(year):
+        offset = ordinal - start.toordinal()
+        if offset < days:
+            return year, m, offset + 1, is_leap
+    raise ValueError(f"無法換算農曆日期：{d}")
@@ -0,0 +1,888 @@
+# -*- coding: utf-8 -*-
+"""
+紫微命盤批次命令列工具
+
+  # 目錄：每個 .txt 檔是一張命盤（id = 相對路徑），全部算 2026 年
+  python ziwei_cli.py run charts/ -o results.jsonl --years 2026
+
+  # JSONL：每行 {"id": "...", "raw": "命盤文字", "year": 2026}（或 "years": [2026, 2027]）
+  python ziwei_cli.py run clients.jsonl -o results.jsonl -j 8
+
+  # 中斷後接著跑：已成功的 (id, 年份) 直接跳過，失敗的重算
+  python ziwei_cli.py run clients.jsonl -o results.jsonl --resume
+
+  # 客戶名冊匯入：CSV 生辰 → 去重 → 限速抓取命盤 → 存進 roster.db（可中斷續跑）
+  python ziwei_cli.py ingest clients.csv --db roster.db --interval 8
+
+  # 名冊查詢（走特徵索引，不重新解析）：武曲在財帛、命宮空宮、庚年生
+  python ziwei_cli.py query --db roster.db --star 武曲@財帛 --empty 命 --year-stem 庚
+
+  # 運勢日期索引：先建（之後只補新客戶），再查某天流日好、且當月流月好的客戶
+  python ziwei_cli.py date-index --db roster.db --years 2026-2027
+  python ziwei_cli.py on-date 2026-03-01 --db roster.db --fortune 好 --month good
+
+  # 夜間排程（常駐行程）：每天 03:00 把名冊所有命盤今明兩年的結果先算好
+  python ziwei_cli.py schedule --db roster.db --at 03:00 -j 2
+
+  # 群組擇日：幾個人都不差的日子（成員可為命盤檔，或加 --db 用客戶編號）
+  python ziwei_cli.py group-days a.txt b.txt c.txt --from 2026-03-01 --to 2026-06-30
+  python ziwei_cli.py group-days --db roster.db c001 c002 c003 --from 2026-03-01 --to 2026-06-30 --max-bad 1
+
+  # 團隊交互矩陣：每個人的命財官遷宮干祿／忌落入其他人的命財官遷（--npz 另存陣列）
+  python ziwei_cli.py team-matrix --db roster.db c001 c002 c003 --detail
+
+  # 行事曆：流日好／差、忌時與流月運勢匯出成 .ics（邊算邊寫）
+  python ziwei_cli.py ics chart.txt --from 2026-01-01 --to 2028-12-31 -o fortune.ics
+
+  # v7 表格欄式匯出：每個期間 × 宮位一列，只算指定的層（.parquet 需要 pyarrow）
+  python ziwei_cli.py export charts/ --years 2026-2027 --layers 本命,流月 -o v7.csv
+  python ziwei_cli.py export --db roster.db --columns chart_id,year,solar_date,col,ji -o v7.parquet
+
+輸出為 JSONL，每個 (命盤, 年份) 一行、依完成順序寫出並立即 flush，
+輸出檔本身就是檢查點。進度與錯誤摘要寫到 stderr。
+"""
+import argparse
+import csv
+import importlib
+import json
+import os
+import sys
+import time
+from datetime import datetime, timedelta
+
+import ziwei_core as engine
+import ziwei_roster as roster
+
+
+# ==================== 共用工具 ====================
+
+def parse_years(text: str) -> list:
+    """『2026』、『2026,2028』、『2026-2030』 → [年份...]"""
+    years = []
+    for part in (text or "").split(","):
+        part = part.strip()
+        if not part:
+            continue
+        if "-" in part:
+            a, b = part.split("-", 1)
+            years.extend(range(int(a), int(b) + 1))
+        else:
+            years.append(int(part))
+    return years
+
+
+def read_jsonl(path: str):
+    """逐行讀 JSONL，回傳 (行號, dict)；壞行回傳 (行號, None)。"""
+    with open(path, "r", encoding="utf-8") as f:
+        for line_no, line in enumerate(f, 1):
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                yield line_no, json.loads(line)
+            except json.JSONDecodeError:
+                yield line_no, None
+
+
+def load_chart_inputs(source: str, default_years: list):
+    """
+    讀取命盤來源 → [{'id', 'raw', 'years'}, ...]
+      - 目錄：遞迴找 .txt，每檔一張
+      - .jsonl：每行 id / raw / year 或 years（沒給年份用 default_years）
+    壞資料不會中止整批，會以 {'id', 'error'} 回報。
+    """
+    items = []
+    if os.path.isdir(source):
+        for root, _, files in os.walk(source):
+            for name in sorted(files):
+                if not name.lower().endswith(".txt"):
+                    continue
+                path = os.path.join(root, name)
+                with open(path, "r", encoding="utf-8") as f:
+                    raw = f.read()
+                items.append({"id": os.path.relpath(path, source), "raw": raw, "years": list(default_years)})
+        items.sort(key=lambda x: x["id"])
+        return items
+
+    for line_no, obj in read_jsonl(source):
+        if not isinstance(obj, dict) or not obj.get("raw"):
+            items.append({"id": f"line{line_no}", "error": "無法解析的 JSONL 行（需要 raw 欄位）"})
+            continue
+        item_id = str(obj.get("id", f"line{line_no}"))
+        try:
+            if "years" in obj:
+                if not isinstance(obj["years"], list):
+                    raise TypeError(obj["years"])
+                years = [int(y) for y in obj["years"]]
+            elif "year" in obj:
+                years = [int(obj["year"])]
+            else:
+                years = list(default_years)
+        except (TypeError, ValueError):
+            items.append({"id": item_id, "error": f"第 {line_no} 行年份格式錯誤（year 為整數、years 為整數陣列）"})
+            continue
+        items.append({"id": item_id, "raw": obj["raw"], "years": years})
+    return items
+
+
+def load_done_keys(output_path: str) -> set:
+    """讀既有輸出檔，找出已成功的 (id, year)。"""
+    done = set()
+    if not os.path.exists(output_path):
+        return done
+    for _, rec in read_jsonl(output_path):
+        if isinstance(rec, dict) and rec.get("ok"):
+            done.add((str(rec.get("id")), int(rec.get("year", 0))))
+    return done
+
+
+def ensure_trailing_newline(path: str):
+    """續跑前：上次若在寫到一半時被中止，補上換行，新紀錄才不會黏在殘缺的那一行後面。"""
+    if not os.path.exists(path):
+        return
+    with open(path, "rb+") as f:
+        f.seek(0, os.SEEK_END)
+        if f.tell() == 0:
+            return
+        f.seek(-1, os.SEEK_END)
+        if f.read(1) != b"\n":
+            f.write(b"\n")
+
+
+class Progress:
+    """stderr 單行進度：[完成/總數] 成功 失敗 速率 預估剩餘。"""
+
+    def __init__(self, total: int, quiet: bool = False):
+        self.total, self.quiet = total, quiet
+        self.ok = self.err = 0
+        self.t0 = time.perf_counter()
+        self._last = 0.0
+
+    def update(self, ok: bool):
+        if ok:
+            self.ok += 1
+        else:
+            self.err += 1
+        now = time.perf_counter()
+        if not self.quiet and (now - self._last >= 0.5 or self.ok + self.err == self.total):
+            self._last = now
+            done = self.ok + self.err
+            rate = done / max(now - self.t0, 1e-9)
+            eta = (self.total - done) / rate if rate > 0 else 0
+            sys.stderr.write(f"\r[{done}/{self.total}] 成功 {self.ok} 失敗 {self.err}  {rate:.1f} 筆/秒  剩餘約 {eta:.0f} 秒 ")
+            sys.stderr.flush()
+
+    def finish(self):
+        if not self.quiet:
+            sys.stderr.write("\n")
+        elapsed = time.perf_counter() - self.t0
+        sys.stderr.write(f"完成：成功 {self.ok}、失敗 {self.err}，耗時 {elapsed:.1f} 秒\n")
+
+
+# ==================== run：批次計算 ====================
+
+def cmd_run(args) -> int:
+    default_years = parse_years(args.years) or [engine.current_year()]
+    items = load_chart_inputs(args.input, default_years)
+
+    done = load_done_keys(args.output) if args.resume else set()
+    jobs, bad = [], []
+    for item in items:
+        if "error" in item:
+            bad.append(item)
+            continue
+        years = [y for y in item["years"] if (item["id"], y) not in done]
+        if years:
+            jobs.append({"id": item["id"], "raw": item["raw"], "years": years})
+
+    total = sum(len(j["years"]) for j in jobs) + len(bad)
+    skipped = sum(len(i.get("years", [])) for i in items) - sum(len(j["years"]) for j in jobs)
+    if args.resume and skipped:
+        sys.stderr.write(f"續跑：略過已完成 {skipped} 筆\n")
+    if total == 0:
+        sys.stderr.write("沒有需要計算的命盤。\n")
+        return 0
+
+    workers = args.jobs or engine.default_worker_count()
+    sys.stderr.write(f"共 {total} 筆（{len(jobs)} 張命盤），{workers} 個行程\n")
+    progress = Progress(total, quiet=args.quiet)
+
+    mode = "a" if args.resume else "w"
+    if args.resume:
+        ensure_trailing_newline(args.output)
+    with open(args.output, mode, encoding="utf-8") as out:
+        def write(rec):
+            out.write(json.dumps(rec, ensure_ascii=False) + "\n")
+            out.flush()
+            progress.update(rec.get("ok", False))
+
+        for item in bad:
+            write({"id": item["id"], "year": None, "ok": False, "error": item["error"]})
+
+        try:
+            for records in engine.iter_chart_jobs(jobs, workers=workers):
+                for rec in records:
+                    if args.no_output_text:
+                        rec.pop("output", None)
+                    write(rec)
+        except KeyboardInterrupt:
+            progress.finish()
+            sys.stderr.write("已中斷；以 --resume 重新執行即可接續。\n")
+            return 130
+
+    progress.finish()
+    return 1 if progress.err else 0
+
+
+# ==================== ingest：客戶名冊匯入 ====================
+
+# CSV 欄位（可用英文或中文欄名）
+CSV_COLUMNS = {
+    "id": ("id", "client_id", "編號", "客戶編號"),
+    "name": ("name", "姓名"),
+    "year": ("year", "出生年"),
+    "month": ("month", "月", "出生月"),
+    "day": ("day", "日", "出生日"),
+    "hour": ("hour", "時", "出生時"),
+    "gender": ("gender", "sex", "性別"),
+}
+
+DEFAULT_SCRAPE_BACKEND = "app_ui:scrape_and_format_raw_text"
+
+
+def csv_field(row: dict, field: str) -> str:
+    for name in CSV_COLUMNS[field]:
+        if name in row and str(row[name]).strip():
+            return str(row[name]).strip()
+    return ""
+
+
+def read_client_csv(path: str):
+    """逐列回傳 (列號, 客戶 dict 或 None, 錯誤訊息)。"""
+    with open(path, "r", encoding="utf-8-sig", newline="") as f:
+        for line_no, row in enumerate(csv.DictReader(f), 2):
+            try:
+                year, month, day, hour = (int(csv_field(row, k)) for k in ("year", "month", "day", "hour"))
+                gender = roster.normalize_gender(csv_field(row, "gender"))
+                key = roster.chart_key(year, month, day, hour, gender)
+            except ValueError as e:
+                yield line_no, None, f"第 {line_no} 列資料錯誤：{e}"
+                continue
+            known = {n for names in CSV_COLUMNS.values() for n in names}
+            yield line_no, {
+                "client_id": csv_field(row, "id") or f"row{line_no}",
+                "name": csv_field(row, "name"),
+                "key": key,
+                "birth_date": key[:10],
+                "hour": hour,
+                "gender": gender,
+                "extra": {k: v for k, v in row.items() if k and k not in known and v},
+            }, ""
+
+
+def load_scrape_backend(spec: str):
+    """『模組:函式』 → 可呼叫物件 fn(year, month, day, hour, gender_val) -> 命盤文字。"""
+    module_name, _, func_name = spec.partition(":")
+    try:
+        module = importlib.import_module(module_name)
+    except (ImportError, SystemExit) as e:
+        raise RuntimeError(f"無法載入抓取後端 {module_name}：{e}")
+    fn = getattr(module, func_name or "scrape_and_format_raw_text", None)
+    if not callable(fn):
+        raise RuntimeError(f"{spec} 不是可呼叫的函式")
+    return fn
+
+
+def validate_scraped_chart(raw: str):
+    """抓回來的文字 → (已解析命盤, 錯誤訊息)；需有 12 宮與生年干。"""
+    if not raw or "【" not in raw:
+        lines = (raw or "").strip().splitlines()
+        return None, (lines[0][:200] if lines else "空白回應")
+    try:
+        return engine.require_complete_chart(engine.prepare_chart(raw)), ""
+    except ValueError as e:
+        return None, str(e)
+
+
+def cmd_ingest(args) -> int:
+    conn = roster.open_roster(args.db)
+
+    # 1. 讀 CSV：客戶寫入名冊，未抓過的命盤加入佇列（同一 chart_key 只抓一次）
+    n_rows = n_new = 0
+    for _, client, err in read_client_csv(args.csv):
+        if err:
+            sys.stderr.write(err + "\n")
+            continue
+        n_rows += 1
+        roster.upsert_client(conn, client["client_id"], client["name"], client["key"], client["extra"])
+        if roster.enqueue_chart(conn, client["key"], client["birth_date"], client["hour"], client["gender"]):
+            n_new += 1
+    conn.commit()
+    sys.stderr.write(f"讀入 {n_rows} 位客戶，新增待抓命盤 {n_new} 張\n")
+
+    items = roster.pending_items(conn, args.retries, args.max or None)
+    if not items:
+        sys.stderr.write(f"沒有待抓取的命盤。{roster.roster_stats(conn)}\n")
+        return 0
+    if args.dry_run:
+        sys.stderr.write(f"（dry-run）待抓取 {len(items)} 張\n")
+        return 0
+
+    try:
+        scrape = load_scrape_backend(args.backend)
+    except RuntimeError as e:
+        sys.stderr.write(f"{e}\n")
+        return 2
+
+    # 2. 限速抓取：兩次請求開始至少間隔 interval 秒，連續失敗則指數退避
+    progress = Progress(len(items), quiet=args.quiet)
+    last_start = 0.0
+    fails_in_row = 0
+    try:
+        for item in items:
+            delay = args.interval * (2 ** min(fails_in_row, 6))
+            wait_s = last_start + min(delay, args.max_backoff) - time.monotonic()
+            if wait_s > 0:
+                time.sleep(wait_s)
+            last_start = time.monotonic()
+
+            y, m, d = (int(x) for x in item["birth_date"].split("-"))
+            gender_val = "1" if item["gender"] == "M" else "0"
+            try:
+                raw = scrape(y, m, d, item["hour"], gender_val)
+                chart, err = validate_scraped_chart(raw)
+            except Exception as e:
+                chart, err = None, f"{type(e).__name__}: {e}"
+
+            if chart is not None:
+                roster.store_chart(conn, item["chart_key"], item["birth_date"], item["hour"], item["gender"],
+                                   raw, engine.chart_fingerprint(chart), args.backend,
+                                   parsed=(chart["data"], chart["col_order"], chart["year_stem"]))
+                roster.mark_done(conn, item["chart_key"])
+                fails_in_row = 0
+            else:
+                roster.mark_failed(conn, item["chart_key"], err)
+                fails_in_row += 1
+                if args.quiet:
+                    sys.stderr.write(f"{item['chart_key']} 失敗：{err}\n")
+            conn.commit()   # 每張都是檢查點
+            progress.update(chart is not None)
+    except KeyboardInterrupt:
+        progress.finish()
+        sys.stderr.write("已中斷；重新執行同一指令即可接續。\n")
+        return 130
+
+    progress.finish()
+    if progress.ok and roster.date_index_range(conn):
+        sys.stderr.write(f"日期索引補上 {roster.update_date_index(conn)} 張\n")
+    sys.stderr.write(f"{roster.roster_stats(conn)}\n")
+    return 1 if progress.err else 0
+
+
+# ==================== query / reindex：名冊查詢 ====================
+
+def split_at(spec: str):
+    """『武曲@財帛』 → ('武曲', '財帛')；沒有 @ 則宮位為 None。"""
+    name, _, palace = spec.partition("@")
+    return name.strip(), (palace.strip() or None)
+
+
+def build_query_filters(args) -> list:
+    filters = []
+    for spec in args.star or []:
+        filters.append(roster.star_filter(*split_at(spec)))
+    for palace in args.empty or []:
+        filters.append(roster.empty_palace_filter(palace))
+    for spec in args.palace_stem or []:
+        stem, palace = split_at(spec)
+        if not palace:
+            raise ValueError(f"--palace-stem 需寫成 干@宮，例如 甲@命：{spec}")
+        filters.append(roster.palace_stem_filter(palace, stem))
+    if args.year_stem:
+        filters.append(roster.year_stem_filter(args.year_stem))
+    for spec in args.daxian or []:
+        age, palace = split_at(spec)
+        filters.append(roster.daxian_filter(int(age), palace))
+    return filters
+
+
+def cmd_query(args) -> int:
+    conn = roster.open_roster(args.db)
+    try:
+        filters = build_query_filters(args)
+    except ValueError as e:
+        sys.stderr.write(f"{e}\n")
+        return 2
+
+    t0 = time.perf_counter()
+    if args.charts:
+        rows = [{"chart_key": k} for k in roster.query_charts(conn, filters, args.limit or None)]
+    else:
+        rows = roster.query_clients(conn, filters, args.limit or None)
+    elapsed = (time.perf_counter() - t0) * 1000
+
+    if not args.count:
+        for row in rows:
+            if args.json:
+                sys.stdout.write(json.dumps(row, ensure_ascii=False) + "\n")
+            else:
+                sys.stdout.write("\t".join(str(v) for v in row.values()) + "\n")
+    sys.stderr.write(f"{len(rows)} 筆（{elapsed:.1f} ms）\n")
+    return 0
+
+
+def cmd_reindex(args) -> int:
+    conn = roster.open_roster(args.db)
+    t0 = time.perf_counter()
+    n = roster.reindex_charts(conn, force=args.force)
+    sys.stderr.write(f"重建索引 {n} 張，耗時 {time.perf_counter() - t0:.1f} 秒；{roster.roster_stats(conn)}\n")
+    return 0
+
+
+# ==================== date-index / on-date：運勢日期反向索引 ====================
+
+def cmd_date_index(args) -> int:
+    conn = roster.open_roster(args.db)
+    if args.years:
+        years = parse_years(args.years)
+        if roster.configure_date_index(conn, min(years), max(years)):
+            sys.stderr.write(f"日期索引範圍設為農曆 {min(years)}~{max(years)} 年，全部重算\n")
+    t0 = time.perf_counter()
+
+    def on_progress(done, total):
+        if not args.quiet:
+            sys.stderr.write(f"\r[{done}/{total}] {done / max(time.perf_counter() - t0, 1e-9):.1f} 張/秒 ")
+            sys.stderr.flush()
+
+    try:
+        n = roster.update_date_index(conn, batch=args.batch, on_progress=on_progress)
+    except ValueError as e:
+        sys.stderr.write(f"{e}（請加 --years）\n")
+        return 2
+    except KeyboardInterrupt:
+        sys.stderr.write("\n已中斷；已完成的批次保留，重新執行即可接續。\n")
+        return 130
+    if n and not args.quiet:
+        sys.stderr.write("\n")
+    sys.stderr.write(f"日期索引新增／更新 {n} 張，耗時 {time.perf_counter() - t0:.1f} 秒；{roster.roster_stats(conn)}\n")
+    return 0
+
+
+def parse_month_patterns(text: str) -> tuple:
+    """『good』／『bad』／『祿,權』 → 流月型態名稱。"""
+    if text == "good":
+        return roster.MONTH_GOOD_PATTERNS
+    if text == "bad":
+        return roster.MONTH_BAD_PATTERNS
+    patterns = tuple(p.strip() for p in text.split(",") if p.strip())
+    unknown = [p for p in patterns if p not in engine.YUE_PATTERNS]
+    if unknown or not patterns:
+        raise ValueError(f"無法辨識的流月型態：{'、'.join(unknown) or text}")
+    return patterns
+
+
+def cmd_on_date(args) -> int:
+    conn = roster.open_roster(args.db)
+    try:
+        d = datetime.strptime(args.date, "%Y-%m-%d").date()
+        patterns = parse_month_patterns(args.month) if args.month else None
+    except ValueError as e:
+        sys.stderr.write(f"{e}\n")
+        return 2
+
+    t0 = time.perf_counter()
+    bitmap = None
+    if args.fortune or not patterns:
+        bitmap = roster.day_bitmap(conn, d, args.fortune or "好")
+    if patterns:
+        month = roster.month_bitmap_on(conn, d, patterns)
+        bitmap = month if bitmap is None else bitmap & month
+    n_charts = roster.bitmap_count(bitmap)
+    rows = [] if args.count else roster.bitmap_clients(conn, bitmap)
+    elapsed = (time.perf_counter() - t0) * 1000
+
+    for row in rows:
+        if args.json:
+            sys.stdout.write(json.dumps(row, ensure_ascii=False) + "\n")
+        else:
+            sys.stdout.write("\t".join(str(v) for v in row.values()) + "\n")
+    summary = f"{n_charts} 張命盤" + ("" if args.count else f"、{len(rows)} 位客戶")
+    sys.stderr.write(f"{summary}（{elapsed:.1f} ms）\n")
+    return 0
+
+
+# ==================== precompute / schedule：預先計算 ====================
+
+def precompute_period(years_ahead: int) -> tuple:
+    """今年起算 years_ahead 年（含今年）。"""
+    this_year = engine.current_year()
+    return this_year, this_year + max(years_ahead, 0)
+
+
+def log(msg: str):
+    sys.stderr.write(f"[{datetime.now().isoformat(timespec='seconds')}] {msg}\n")
+    sys.stderr.flush()
+
+
+def run_precompute(conn, args) -> dict:
+    start_year, end_year = precompute_period(args.years_ahead)
+    targets = len(roster.precompute_targets(conn, start_year, end_year))
+    log(f"預先計算 {start_year}~{end_year} 年：待算 {targets} 張（規則版本 {engine.ENGINE_RULES_VERSION}，{args.jobs or engine.default_worker_count()} 個行程）")
+
+    def on_result(result):
+        if not result["ok"]:
+            log(f"{result['id']} 失敗：{result['error']}")
+
+    stats = roster.precompute_roster(conn, start_year, end_year, args.jobs, args.max_pending, on_result=on_result)
+    pruned = roster.prune_precomputed(conn, start_year)
+    conn.commit()
+    if roster.date_index_range(conn):
+        stats["date_indexed"] = roster.update_date_index(conn)
+    log(f"完成：{stats}，清掉過期年度 {pruned} 筆")
+    return stats
+
+
+def cmd_precompute(args) -> int:
+    conn = roster.open_roster(args.db)
+    try:
+        stats = run_precompute(conn, args)
+    except KeyboardInterrupt:
+        log("已中斷；已算好的已存檔，重新執行即可接續。")
+        return 130
+    return 1 if stats["failed"] else 0
+
+
+def next_run_at(hhmm: str, now: datetime = None) -> datetime:
+    """『03:00』 → 下一次的執行時間（今天已過就排明天）。"""
+    hour, minute = (int(x) for x in hhmm.split(":"))
+    now = now or datetime.now()
+    run_at = now.replace(hour=hour, minute=minute, second=0, microsecond=0)
+    if run_at <= now:
+        run_at += timedelta(days=1)
+    return run_at
+
+
+def cmd_schedule(args) -> int:
+    try:
+        next_run_at(args.at)
+    except ValueError:
+        sys.stderr.write(f"--at 需為 HH:MM：{args.at}\n")
+        return 2
+    if args.nice and hasattr(os, "nice"):
+        os.nice(args.nice)   # 子行程會繼承，白天的網頁服務不受影響
+
+    run_now = args.run_now
+    try:
+        while True:
+            if not run_now:
+                run_at = next_run_at(args.at)
+                log(f"下次執行：{run_at.isoformat(timespec='minutes')}")
+                while datetime.now() < run_at:
+                    time.sleep(min(60.0, max((run_at - datetime.now()).total_seconds(), 0.1)))
+            run_now = False
+            conn = roster.open_roster(args.db)
+            try:
+                run_precompute(conn, args)
+            except Exception as e:   # 單次失敗不讓排程停掉，下一輪再試
+                log(f"本輪失敗：{type(e).__name__}: {e}")
+            finally:
+                conn.close()
+            if args.once:
+                return 0
+    except KeyboardInterrupt:
+        log("排程結束。")
+        return 0
+
+
+# ==================== group-days：群組擇日 ====================
+
+def load_group_members(args) -> list:
+    """成員 → [{'id', 'raw'}]；有 --db 時成員是客戶編號，否則是命盤檔路徑。"""
+    members = []
+    if args.db:
+        conn = roster.open_roster(args.db)
+        for client_id in args.members:
+            row = conn.execute("SELECT chart_key FROM clients WHERE client_id=?", (client_id,)).fetchone()
+            raw = roster.get_chart_raw(conn, row["chart_key"]) if row else ""
+            if not raw:
+                raise ValueError(f"名冊裡沒有 {client_id} 的命盤")
+            members.append({"id": client_id, "raw": raw})
+    else:
+        for path in args.members:
+            with open(path, "r", encoding="utf-8") as f:
+                members.append({"id": os.path.splitext(os.path.basename(path))[0], "raw": f.read()})
+    return members
+
+
+def cmd_group_days(args) -> int:
+    try:
+        d1 = datetime.strptime(args.date_from, "%Y-%m-%d").date()
+        d2 = datetime.strptime(args.date_to, "%Y-%m-%d").date()
+        members = load_group_members(args)
+        t0 = time.perf_counter()
+        result = engine.group_good_days(members, d1, d2, args.top, args.require_good, args.max_bad)
+    except (OSError, ValueError) as e:
+        sys.stderr.write(f"{e}\n")
+        return 2
+    elapsed = (time.perf_counter() - t0) * 1000
+
+    if args.json:
+        sys.stdout.write(json.dumps(result, ensure_ascii=False) + "\n")
+    else:
+        for day in result["dates"]:
+            line = f"{day['date']}（{day['lunar']}） 好 {day['good']}／平 {day['neutral']}／差 {day['bad']}"
+            line += f"  忌時：{'、'.join(day['ji_hours']) or '無'}"
+            if day["bad"]:
+                line += f"  差：{'、'.join(str(m) for m, v in day['verdicts'].items() if v == '差')}"
+            sys.stdout.write(line + "\n")
+    sys.stderr.write(f"{len(members)} 人、{(d2 - d1).days + 1} 天中符合 {result['candidates']} 天（{elapsed:.1f} ms）\n")
+    return 0
+
+
+# ==================== team-matrix：多人交互矩陣 ====================
+
+def parse_palace_list(text: str) -> tuple:
+    palaces = tuple(roster.normalize_palace(p) for p in text.replace("，", ",").split(",") if p.strip())
+    if not palaces:
+        raise ValueError("宮位清單不可為空")
+    return palaces
+
+
+def cmd_team_matrix(args) -> int:
+    try:
+        members = load_group_members(args)
+        src = parse_palace_list(args.src)
+        dst = parse_palace_list(args.dst)
+        t0 = time.perf_counter()
+        matrix = engine.cross_hua_matrix(members, src, dst, ("祿", "忌"))
+    except (OSError, ImportError, ValueError) as e:
+        sys.stderr.write(f"{e}\n")
+        return 2
+    elapsed = (time.perf_counter() - t0) * 1000
+
+    ids = [str(i) for i in matrix["ids"]]
+    counts = matrix["counts"]
+    sys.stdout.write("\t".join(["a→b"] + ids) + "\n")
+    for a, name in enumerate(ids):
+        cells = ["-" if a == b else f"祿{counts[a, b, 0]}忌{counts[a, b, 1]}" for b in range(len(ids))]
+        sys.stdout.write("\t".join([name] + cells) + "\n")
+    if args.detail:
+        for a in range(len(ids)):
+            for b in range(len(ids)):
+                for line in (engine.describe_cross_hits(matrix, a, b) if a != b else []):
+                    sys.stdout.write(f"{ids[a]} → {ids[b]}：{line}\n")
+    if args.npz:
+        engine.np.savez_compressed(args.npz, ids=engine.np.array(ids), counts=counts, masks=matrix["masks"],
+                                   stems=matrix["stems"], src_palaces=engine.np.array(src), dst_palaces=engine.np.array(dst))
+    sys.stderr.write(f"{len(ids)} 人交互矩陣（{elapsed:.1f} ms）\n")
+    return 0
+
+
+# ==================== ics：行事曆匯出 ====================
+
+def cmd_ics(args) -> int:
+    try:
+        d1 = datetime.strptime(args.date_from, "%Y-%m-%d").date()
+        d2 = datetime.strptime(args.date_to, "%Y-%m-%d").date()
+        (member,) = load_group_members(argparse.Namespace(db=args.db, members=[args.chart]))
+        fortunes = tuple(f.strip() for f in args.fortunes.split(",") if f.strip())
+        events = engine.iter_fortune_ics(member["raw"], d1, d2, fortunes, not args.no_ji_hours,
+                                         not args.no_months, args.name or f"紫微運勢 {member['id']}")
+        first = next(events)
+    except (OSError, ValueError) as e:
+        sys.stderr.write(f"{e}\n")
+        return 2
+
+    out = open(args.output, "w", encoding="utf-8", newline="") if args.output else sys.stdout
+    n = 0
+    try:
+        out.write(first)
+        for chunk in events:
+            out.write(chunk)
+            n += chunk.count("BEGIN:VEVENT")
+    finally:
+        if args.output:
+            out.close()
+    sys.stderr.write(f"寫出 {n} 個事件\n")
+    return 0
+
+
+# ==================== export：v7 表格欄式匯出 ====================
+
+def cmd_export(args) -> int:
+    years = parse_years(args.years) or [engine.current_year()]
+    layers = tuple(x.strip() for x in args.layers.split(",") if x.strip()) if args.layers else engine.V7_LAYERS
+    columns = tuple(x.strip() for x in args.columns.split(",") if x.strip()) if args.columns else None
+    fmt = args.format or ("parquet" if (args.output or "").lower().endswith(".parquet") else "csv")
+    with_hua = not args.no_hua and (columns is None or any(c in engine.V7_HUA_COLUMNS for c in columns))
+    unknown = [x for x in layers if x not in engine.V7_LAYERS] + [x for x in columns or () if x not in engine.V7_COLUMNS]
+    if unknown:
+        sys.stderr.write(f"未知的層或欄位：{'、'.join(unknown)}\n")
+        return 2
+
+    if args.db:
+        conn = roster.open_roster(args.db)
+        items = ({"id": key, "raw": raw, "years": years} for key, raw in roster.iter_charts(conn))
+    elif args.input:
+        items = load_chart_inputs(args.input, years)
+        for item in items:
+            if "error" in item:
+                sys.stderr.write(f"{item['id']}: {item['error']}\n")
+        items = [item for item in items if "error" not in item]
+    else:
+        sys.stderr.write("需要命盤來源或 --db\n")
+        return 2
+
+    rows = engine.iter_v7_export_rows(items, layers, with_hua)
+    t0 = time.perf_counter()
+    try:
+        if fmt == "parquet":
+            if not args.output:
+                sys.stderr.write("Parquet 需要 -o 輸出檔\n")
+                return 2
+            n = engine.write_v7_parquet(rows, args.output, columns)
+        elif args.output:
+            with open(args.output, "w", encoding="utf-8", newline="") as out:
+                n = engine.write_v7_csv(rows, out, columns)
+        else:
+            n = engine.write_v7_csv(rows, sys.stdout, columns)
+    except (ImportError, ValueError) as e:
+        sys.stderr.write(f"{e}\n")
+        return 2
+    sys.stderr.write(f"寫出 {n} 列（{time.perf_counter() - t0:.1f}s）\n")
+    return 0
+
+
+# ==================== 入口 ====================
+
+def build_parser() -> argparse.ArgumentParser:
+    ap = argparse.ArgumentParser(prog="ziwei_cli", description="紫微命盤批次工具")
+    sub = ap.add_subparsers(dest="command", required=True)
+
+    p = sub.add_parser("run", help="批次計算命盤，結果以 JSONL 輸出")
+    p.add_argument("input", help="命盤目錄（*.txt）或 JSONL 檔（id / raw / year|years）")
+    p.add_argument("-o", "--output", required=True, help="輸出 JSONL 檔（同時作為續跑的檢查點）")
+    p.add_argument("--years", default="", help="預設目標年，例如 2026、2026,2028、2026-2030（預設今年）")
+    p.add_argument("-j", "--jobs", type=int, default=0, help="行程數（預設 CPU 核心數）")
+    p.add_argument("--resume", action="store_true", help="接續既有輸出檔，已成功的略過")
+    p.add_argument("--no-output-text", action="store_true", help="只記錄成功與否與耗時，不寫入整段輸出")
+    p.add_argument("-q", "--quiet", action="store_true", help="不顯示即時進度")
+    p.set_defaults(func=cmd_run)
+
+    p = sub.add_parser("ingest", help="匯入客戶 CSV，限速抓取命盤存入名冊資料庫（可續跑）")
+    p.add_argument("csv", help="客戶 CSV（id,name,year,month,day,hour,gender；可用中文欄名）")
+    p.add_argument("--db", required=True, help="名冊 SQLite 檔")
+    p.add_argument("--backend", default=DEFAULT_SCRAPE_BACKEND, help=f"抓取函式『模組:函式』（預設 {DEFAULT_SCRAPE_BACKEND}）")
+    p.add_argument("--interval", type=float, default=5.0, help="兩次抓取的最短間隔秒數（預設 5）")
+    p.add_argument("--max-backoff", type=float, default=300.0, help="連續失敗時的最長等待秒數（預設 300）")
+    p.add_argument("--retries", type=int, default=3, help="每張命盤最多嘗試次數（預設 3）")
+    p.add_argument("--max", type=int, default=0, help="本次最多抓幾張（預設全部）")
+    p.add_argument("--dry-run", action="store_true", help="只匯入名冊與排入佇列，不抓取")
+    p.add_argument("-q", "--quiet", action="store_true", help="不顯示即時進度，失敗逐筆列出")
+    p.set_defaults(func=cmd_ingest)
+
+    p = sub.add_parser("query", help="依命盤特徵查詢名冊（條件之間為 AND）")
+    p.add_argument("--db", required=True, help="名冊 SQLite 檔")
+    p.add_argument("--star", action="append", metavar="星[@宮]", help="含某星曜，可指定宮位，例如 武曲@財帛（可重複）")
+    p.add_argument("--empty", action="append", metavar="宮", help="某宮為空宮（無主星），例如 命（可重複）")
+    p.add_argument("--palace-stem", action="append", metavar="干@宮", help="某宮宮干，例如 甲@命（可重複）")
+    p.add_argument("--year-stem", metavar="干", help="生年天干")
+    p.add_argument("--daxian", action="append", metavar="歲[@宮]", help="該虛歲所走大限（在某宮），例如 35@命（可重複）")
+    p.add_argument("--charts", action="store_true", help="只列 chart_key，不展開成客戶")
+    p.add_argument("--limit", type=int, default=0, help="最多列出幾筆")
+    p.add_argument("--count", action="store_true", help="只顯示筆數")
+    p.add_argument("--json", action="store_true", help="每筆輸出一行 JSON（預設 TSV）")
+    p.set_defaults(func=cmd_query)
+
+    p = sub.add_parser("reindex", help="補建（或 --force 全部重建）命盤特徵索引")
+    p.add_argument("--db", required=True, help="名冊 SQLite 檔")
+    p.add_argument("--force", action="store_true", help="全部重建")
+    p.set_defaults(func=cmd_reindex)
+
+    p = sub.add_parser("date-index", help="建立／增量更新運勢日期反向索引（每天、每個流月 → 客戶點陣圖）")
+    p.add_argument("--db", required=True, help="名冊 SQLite 檔")
+    p.add_argument("--years", help="涵蓋的農曆年份，例如 2026-2027（改變範圍會整批重算；之後可省略）")
+    p.add_argument("--batch", type=int, default=1000, help="每批幾張命盤（每批 commit 一次，預設 1000）")
+    p.add_argument("-q", "--quiet", action="store_true", help="不顯示即時進度")
+    p.set_defaults(func=cmd_date_index)
+
+    p = sub.add_parser("on-date", help="查國曆某天流日運勢（及當月流月）符合的客戶")
+    p.add_argument("date", help="國曆日期 YYYY-MM-DD")
+    p.add_argument("--db", required=True, help="名冊 SQLite 檔")
+    p.add_argument("--fortune", choices=["好", "平", "差"], help="流日運勢（只給 --month 時不看流日）")
+    p.add_argument("--month", help="當月流月：good、bad 或型態清單（例如 祿,權）")
+    p.add_argument("--count", action="store_true", help="只顯示張數")
+    p.add_argument("--json", action="store_true", help="每筆輸出一行 JSON（預設 TSV）")
+    p.set_defaults(func=cmd_on_date)
+
+    def add_precompute_args(p):
+        p.add_argument("--db", required=True, help="名冊 SQLite 檔")
+        p.add_argument("--years-ahead", type=int, default=1, help="今年之外再多算幾年（預設 1：今年與明年）")
+        p.add_argument("-j", "--jobs", type=int, default=1, help="平行行程數上限（預設 1）")
+        p.add_argument("--max-pending", type=int, default=None, help="同時送進行程池的命盤上限（預設 jobs*4）")
+
+    p = sub.add_parser("precompute", help="把名冊所有過期的命盤結果與運勢時間軸先算好（只跑一次）")
+    add_precompute_args(p)
+    p.set_defaults(func=cmd_precompute)
+
+    p = sub.add_parser("schedule", help="常駐排程：每天固定時間執行 precompute")
+    add_precompute_args(p)
+    p.add_argument("--at", default="03:00", help="每天執行時間 HH:MM（預設 03:00）")
+    p.add_argument("--run-now", action="store_true", help="啟動時先跑一輪")
+    p.add_argument("--once", action="store_true", help="跑完一輪就結束（搭配 --run-now 或系統 cron）")
+    p.add_argument("--nice", type=int, default=10, help="降低排程行程優先權（預設 10，0 表示不調整）")
+    p.set_defaults(func=cmd_schedule)
+
+    p = sub.add_parser("group-days", help="找多人運勢都不差的日子，依好的人數與忌時重疊排序")
+    p.add_argument("members", nargs="+", help="命盤檔；有 --db 時為客戶編號")
+    p.add_argument("--db", help="名冊 SQLite 檔（成員改用客戶編號）")
+    p.add_argument("--from", dest="date_from", required=True, help="開始日期 YYYY-MM-DD（國曆）")
+    p.add_argument("--to", dest="date_to", required=True, help="結束日期 YYYY-MM-DD（含）")
+    p.add_argument("--top", type=int, default=20, help="列出前幾名（預設 20）")
+    p.add_argument("--max-bad", type=int, default=0, help="容許幾個人運勢差（預設 0）")
+    p.add_argument("--require-good", action="store_true", help="其餘的人都要是好")
+    p.add_argument("--json", action="store_true", help="輸出完整 JSON")
+    p.set_defaults(func=cmd_group_days)
+
+    p = sub.add_parser("team-matrix", help="多人命盤兩兩之間的宮干祿／忌交互矩陣")
+    p.add_argument("members", nargs="+", help="命盤檔；有 --db 時為客戶編號")
+    p.add_argument("--db", help="名冊 SQLite 檔（成員改用客戶編號）")
+    p.add_argument("--src", default=",".join(engine.CROSS_KEY_PALACES), help="來源宮（a 的宮干），逗號分隔")
+    p.add_argument("--dst", default=",".join(engine.CROSS_KEY_PALACES), help="落入宮（b 的宮位），逗號分隔")
+    p.add_argument("--detail", action="store_true", help="逐條列出每個命中")
+    p.add_argument("--npz", help="另存 NumPy 陣列（counts / masks / stems）")
+    p.set_defaults(func=cmd_team_matrix)
+
+    p = sub.add_parser("ics", help="流日／流月運勢匯出成 iCalendar（.ics）")
+    p.add_argument("chart", help="命盤檔；有 --db 時為客戶編號")
+    p.add_argument("--db", help="名冊 SQLite 檔（chart 改用客戶編號）")
+    p.add_argument("--from", dest="date_from", required=True, help="開始日期 YYYY-MM-DD（國曆）")
+    p.add_argument("--to", dest="date_to", required=True, help="結束日期 YYYY-MM-DD（含）")
+    p.add_argument("--fortunes", default="好,差", help="建整天事件的流日運勢（預設 好,差）")
+    p.add_argument("--no-ji-hours", action="store_true", help="不建忌時時段事件")
+    p.add_argument("--no-months", action="store_true", help="不建流月事件")
+    p.add_argument("--name", help="行事曆名稱")
+    p.add_argument("-o", "--output", help="輸出檔（預設 stdout）")
+    p.set_defaults(func=cmd_ics)
+
+    p = sub.add_parser("export", help="v7 表格匯出成 CSV／Parquet（每個期間 × 宮位一列，不產生 Markdown）")
+    p.add_argument("input", nargs="?", help="命盤目錄（*.txt）或 JSONL 檔（id / raw / year|years）")
+    p.add_argument("--db", help="改為匯出名冊所有命盤（chart_id 為 chart_key）")
+    p.add_argument("--years", default="", help="目標年，例如 2026、2026-2030（預設今年；JSONL 自帶年份優先）")
+    p.add_argument("--layers", help=f"只算這些層，逗號分隔（預設 {','.join(engine.V7_LAYERS)}）")
+    p.add_argument("--columns", help=f"只輸出這些欄，逗號分隔（預設全部：{','.join(engine.V7_COLUMNS)}）")
+    p.add_argument("--format", choices=["csv", "parquet"], help="輸出格式（預設依 -o 副檔名，否則 csv）")
+    p.add_argument("--no-hua", action="store_true", help="不定位四化（lu/quan/ke/ji 留空，較快）")
+    p.add_argument("-o", "--output", help="輸出檔（CSV 預設 stdout）")
+    p.set_defaults(func=cmd_export)
+
+    return ap
+
+
+def main(argv=None) -> int:
+    args = build_parser().parse_args(argv)
+    return args.func(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,14 +1,45 @@
 # -*- coding: utf-8 -*-
 import re
 import io
-import copy
+import os
+import time
+import mmap
+import struct
+import json
+import hashlib
+import threading
+import logging
 import contextlib
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+from concurrent.futures.process import BrokenProcessPool
+from array import array
+from collections import namedtuple, OrderedDict
 from datetime import datetime, timedelta
-from flask import Flask, request, render_template_string
+from flask import Flask, Response, request, render_template_string, stream_with_context
+
+try:
+    import numpy as np  # 只有四化張量／批次矩陣需要
+except ImportError:
+    np = None
+
+try:
+    import pyarrow as pa  # 只有 v7 表格匯出 Parquet 需要
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = pq = None
+
+import ziwei_trace as trace
+from ziwei_calendar import (
+    LUNAR_MIN_YEAR, LUNAR_MAX_YEAR, lunar_year_supported, lunar_year_months, lunar_to_solar, solar_to_lunar,
+)
+from ziwei_ganzhi import (
+    year_ganzhi_index, lunar_month_stems, day_ganzhi_index, ganzhi_range,
+)
 
 # ======================= 全域設定 =======================
-DEBUG = False          # 預設關閉除錯
+DEBUG = False          # 預設關閉除錯；True 時 render_chart_year 期間會掛上 trace.PrintSink（舊版行為）
 CYEAR = None           # ← 統一年份來源（由 run_chart_from_text 設定）
+ENGINE_RULES_VERSION = 1   # 運勢規則有改動就 +1，已存檔的運勢時間軸會自動重算
 
 # ===== 白名單（原版保留） =====
 MAIN_STARS = ["紫微","天府","天相","天梁","武曲","七殺","破軍","廉貞","天機","太陽","太陰","巨門","天同","貪狼"]
@@ -87,8 +118,9 @@ def parse_year_stem(raw_text: str) -> str:
 
 # ==================== 解析命盤 ====================
 
-def parse_chart(raw_text: str):
+def parse_chart_regex(raw_text: str):
     """
+    （舊版，保留對照用；bench_parse.py 以它驗證 parse_chart 結果一致）
     回傳 data, col_order, year_stem
     data = { col: {'palace','main','aux','mini','daxian','abbr'} }
     """
@@ -119,6 +151,63 @@ def parse_chart(raw_text: str):
     year_stem = parse_year_stem(raw_text)
     return data, col_order, year_stem
 
+# ---- 單趟掃描版（大量匯入用） ----
+# 宮位區塊：預先編譯好的 _BLOCK_PAT 一次 finditer 掃完整份文字（規則與 parse_chart_regex 相同）。
+# 星曜行：分隔符號一次 translate 成空白再 split；白名單＋尾綴改查預先建好的表：
+#   別名整個 token 比對 → rstrip 掉尾綴字元（旺陷廟地平權科祿忌利）→ 一次 dict 查到主／輔／小星。
+# 宮名→縮寫也查表（同一批命盤的宮名只有十幾種）。
+
+_BLOCK_PAT = re.compile(
+    r"([甲乙丙丁戊己庚辛壬癸][子丑寅卯辰巳午未申酉戌亥])【([^】]+)】\s*"
+    r"大限:([0-9]+)-([0-9]+)\s*"
+    r"小限:[^\n]*\n"
+    r"([^\n]+)"
+)
+_STAR_SEP_TABLE = str.maketrans({",": " ", "，": " ", "、": " "})
+_STAR_SUFFIX_CHARS = "旺陷廟地平權科祿忌利"
+_STAR_KIND = {
+    **{s: 0 for s in MAIN_STARS},
+    **{s: 1 for s in AUX_STARS},
+    **{s: 2 for s in MINI_STARS},
+}
+_PALACE_ABBR_CACHE = {}
+
+def scan_star_line(star_line: str):
+    """pick_whitelist 的查表版：回傳 (main, aux, mini)，去重保序，結果與 pick_whitelist 相同。"""
+    found = ([], [], [])
+    for tok in star_line.translate(_STAR_SEP_TABLE).split():
+        norm = ALIASES.get(tok, tok).rstrip(_STAR_SUFFIX_CHARS)
+        kind = _STAR_KIND.get(norm)
+        if kind is not None and norm not in found[kind]:
+            found[kind].append(norm)
+    return found
+
+def parse_chart(raw_text: str):
+    """
+    回傳 data, col_order, year_stem
+    data = { col: {'palace','main','aux','mini','daxian','abbr'} }
+    （查表版，輸出與 parse_chart_regex 相同）
+    """
+    data, col_order = {}, []
+    for col, palace, dx_a, dx_b, star_line in _BLOCK_PAT.findall(raw_text):
+        main, aux, mini = scan_star_line(star_line)
+        abbr = _PALACE_ABBR_CACHE.get(palace)
+        if abbr is None:
+            abbr = _PALACE_ABBR_CACHE.setdefault(palace, palace_to_abbr(palace)) if len(_PALACE_ABBR_CACHE) < 4096 else palace_to_abbr(palace)
+        data[col] = {
+            "palace": palace,
+            "main": main,
+            "aux": aux,
+            "mini": [ALIASES.get(x, x) for x in mini],
+            "daxian": f"{dx_a}~{dx_b}",
+            "abbr": abbr,
+        }
+        if col not in col_order:
+            col_order.append(col)
+
+    year_stem = parse_year_stem(raw_text)
+    return data, col_order, year_stem
+
 # ==================== 舊版簡單表格（保留） ====================
 
 def render_markdown_table(data: dict, col_order: list, year_stem: str = "") -> str:
@@ -276,6 +365,40 @@ def parse_birth_year(raw_text: str) -> int:
 def current_year() -> int:
     return datetime.now().year
 
+# ==================== 每盤快取（同一次請求內各區段共用） ====================
+
+_CHART_MEMO = {}
+
+def chart_memo(data: dict, key, builder, per_year: bool = True):
+    """
+    以 (命盤, 目標年 CYEAR, key) 快取 builder() 的結果。
+      - per_year=False：與流年無關的結構（欄位重排、各天干四化落點…），跨年份共用
+      - 同一個 data 物件才算命中；run_chart_from_text 開始與結束時會清空
+    快取內容由各區段共用，呼叫端請勿就地修改。
+    """
+    memo_key = (id(data), CYEAR if per_year else None, key)
+    hit = _CHART_MEMO.get(memo_key)
+    if hit is not None and hit[0] is data:
+        if trace.enabled:
+            trace.emit("MEMO.hit", "{key}", key=key[0] if isinstance(key, tuple) else key)
+        return hit[1]
+    if trace.enabled:
+        trace.emit("MEMO.miss", "{key}", key=key[0] if isinstance(key, tuple) else key)
+    value = builder()
+    _CHART_MEMO[memo_key] = (data, value)
+    return value
+
+def clear_chart_memo():
+    _CHART_MEMO.clear()
+
+def chart_cols(data: dict, col_order: list) -> list:
+    """reorder_cols_by_palace 的快取版。"""
+    return chart_memo(data, ("cols", tuple(col_order)), lambda: reorder_cols_by_palace(data, col_order), per_year=False)
+
+def chart_birth_year(data: dict, raw_text: str) -> int:
+    """parse_birth_year 的快取版。"""
+    return chart_memo(data, ("birth_year", raw_text), lambda: parse_birth_year(raw_text), per_year=False)
+
 def reorder_cols_by_palace(data: dict, col_order: list) -> list:
     """依『本命宮位』順序重排欄位。"""
     buckets = {abbr: None for abbr in PALACE_ORDER_CANONICAL}
@@ -304,8 +427,8 @@ def find_daxian_anchor_col(data: dict, cols: list, age: int) -> str:
 def safe_find_anchor_by_age(data: dict, cols: list, age: int) -> str:
     found = find_daxian_anchor_col(data, cols, age)
     if found:
-        if DEBUG:
-            print(f"DEBUG[DAXIAN] 歲數 {age} 命中：{found}（區間 {data[found]['daxian']}）")
+        if trace.enabled:
+            trace.emit("DAXIAN.hit", "歲數 {age} 命中：{col}（區間 {rng}）", age=age, col=found, rng=data[found]["daxian"])
         return found
     best_col, best_gap = "", 10**9
     for c in cols:
@@ -316,8 +439,9 @@ def safe_find_anchor_by_age(data: dict, cols: list, age: int) -> str:
         gap = min(abs(age-a), abs(age-b)) if (age < a or age > b) else 0
         if gap < best_gap:
             best_gap, best_col = gap, c
-    if DEBUG and best_col:
-        print(f"DEBUG[DAXIAN] 歲數 {age} 未命中任何區間，改用最近：{best_col}（{data[best_col]['daxian']}，距離={best_gap}）")
+    if trace.enabled and best_col:
+        trace.emit("DAXIAN.nearest", "歲數 {age} 未命中任何區間，改用最近：{col}（{rng}，距離={gap}）",
+                   age=age, col=best_col, rng=data[best_col]["daxian"], gap=best_gap)
     return best_col
 
 def build_daxian_ming_row(cols: list, data: dict, anchor_col: str) -> list:
@@ -359,23 +483,36 @@ def find_col_for_label(cols: list, ming_line: list, target_label: str) -> str:
     return ""
 
 def debug_report_order(col_order: list, cols_reordered: list, data: dict):
-    if not DEBUG:
+    if not trace.enabled:
         return
     pairs  = [f"{i+1}.{c}({data.get(c,{}).get('abbr','?')})" for i,c in enumerate(col_order)]
     pairs2 = [f"{i+1}.{c}({data.get(c,{}).get('abbr','?')})" for i,c in enumerate(cols_reordered)]
-    print("DEBUG[ORDER] 原始欄序：", " | ".join(pairs))
-    print("DEBUG[ORDER] 重排欄序：", " | ".join(pairs2))
+    trace.emit("ORDER.original", "原始欄序： {cols}", cols=" | ".join(pairs))
+    trace.emit("ORDER.reordered", "重排欄序： {cols}", cols=" | ".join(pairs2))
     tail = [c for c in cols_reordered if not data.get(c,{}).get('abbr')]
     if tail:
-        print("DEBUG[ORDER] 無縮寫（置於隊尾）：", "、".join(tail))
+        trace.emit("ORDER.no_abbr", "無縮寫（置於隊尾）： {cols}", cols="、".join(tail))
+
+def locate_four_hua(stem: str, cols: list, data: dict):
+    """
+    某天干四化在各欄的落點（每盤每天干只算一次）。
+    回傳 (cells, det)：cells={col:[HuaToken('太陽','祿'),...]}（唯讀），det=除錯用描述。
+    """
+    return chart_memo(data, ("hua_cells", stem, tuple(cols)), lambda: _locate_four_hua(stem, cols, data), per_year=False)
 
 def debug_four_hua_locate(tag: str, stem: str, cols: list, data: dict) -> dict:
-    """取得某天干四化落點，同時列印 debug。"""
-    cells = {c: [] for c in cols}
+    """取得某天干四化落點（唯讀，勿就地修改），同時送出 HUA 追蹤事件。"""
     if not stem or stem not in YEAR_HUA:
-        if DEBUG:
-            print(f"DEBUG[HUA] {tag}：無有效天干（{stem}）")
-        return cells
+        if trace.enabled:
+            trace.emit("HUA.no_stem", "{tag}：無有效天干（{stem}）", tag=tag, stem=stem)
+        return {c: [] for c in cols}
+    cells, det = locate_four_hua(stem, cols, data)
+    if trace.enabled:
+        trace.emit("HUA.locate", "{tag}（{stem}）｜{detail}", tag=tag, stem=stem, detail="； ".join(det))
+    return cells
+
+def _locate_four_hua(stem: str, cols: list, data: dict):
+    cells = {c: [] for c in cols}
     det = []
     for typ in ["祿","權","科","忌"]:
         star = YEAR_HUA[stem].get(typ,"")
@@ -388,18 +525,57 @@ def debug_four_hua_locate(tag: str, stem: str, cols: list, data: dict) -> dict:
         else:
             det.append(f"{typ}:{star}->" + ",".join(located))
             for c in located:
-                cells[c].append(f"{star}{typ}")
-    if DEBUG:
-        print(f"DEBUG[HUA] {tag}（{stem}）｜" + "； ".join(det))
-    return cells
+                cells[c].append(HuaToken(star, typ))
+    return cells, det
 
 # === 四化 token 工具 ===
+# 引擎內部一律傳 HuaToken / PalaceRef / HuaPlacement，只有輸出時才 str() 成文字。
 
-def extract_hua_type(token: str) -> str:
+STAR_INDEX = {s: i for i, s in enumerate(MAIN_STARS + AUX_STARS + MINI_STARS)}
+
+class HuaToken(namedtuple("HuaToken", ["star", "hua"])):
+    """一顆星的四化：HuaToken('太陽', '祿') → 『太陽祿』。"""
+    __slots__ = ()
+
+    def __str__(self):
+        return self.star + self.hua
+
+    @property
+    def star_idx(self) -> int:
+        """白名單（主星、輔星、兇星）中的索引；不在白名單回傳 -1。"""
+        return STAR_INDEX.get(self.star, -1)
+
+class PalaceRef(namedtuple("PalaceRef", ["layer", "palace"])):
+    """某一層的宮位：PalaceRef('流', '夫') → 『流夫』（layer 為 大／流／月…）。"""
+    __slots__ = ()
+
+    def __str__(self):
+        return self.layer + self.palace
+
+class HuaPlacement(namedtuple("HuaPlacement", ["layer", "palace", "code", "token", "big"])):
+    """
+    化忌化解落點（resolve_ji_for_stem_chart）：
+      HuaPlacement('流', '田', '', '天梁科', '大財') → 『流田宮/天梁科/大財』
+      找不到宮位時 palace 為空，以地支代碼輸出『午宮位/天梁科』。
+    """
+    __slots__ = ()
+
+    def __str__(self):
+        place = f"{self.layer}{self.palace}宮" if self.palace else f"{self.code}宮位"
+        return f"{place}/{self.token}/{self.big}" if self.big else f"{place}/{self.token}"
+
+def format_hua_tokens(tokens, sep: str = "/") -> str:
+    return sep.join(str(t) for t in tokens)
+
+def extract_hua_type(token) -> str:
+    if isinstance(token, HuaToken):
+        return token.hua
     m = re.search(r"(祿|權|科|忌)", token)
     return m.group(1) if m else ""
 
-def extract_star_name(token: str) -> str:
+def extract_star_name(token) -> str:
+    if isinstance(token, HuaToken):
+        return token.star
     return re.sub(r"(祿|權|科|忌)", "", token)
 
 # ---------------- 流年／流月 工具 ----------------
@@ -414,12 +590,10 @@ HOUR_RANGE_TEXT = {
 }
 
 def zodiac_of_year(year: int) -> str:
-    base = 1984  # 甲子年
-    return ZODIAC[(year - base) % 12]
+    return ZODIAC[year_ganzhi_index(year) % 12]
 
 def year_stem_of_year(year: int) -> str:
-    base = 1984  # 甲子年
-    return STEMS[(year - base) % 10]
+    return STEMS[year_ganzhi_index(year) % 10]
 
 def get_col_with_branch(cols: list, branch: str) -> str:
     for c in cols:
@@ -447,27 +621,24 @@ def build_liunian_row(cols: list, year: int) -> list:
         out[pos] = labels[offset % len(labels)]
     return out
 
-# 指定年份每月天干
-LIUYUE_MONTH_STEMS = {
-    2025: ["戊","己","庚","辛","壬","癸","甲","乙","丙","丁","戊","己"],
-    2026: ["庚","辛","壬","癸","甲","乙","丙","丁","戊","己","庚","辛"],
-    2027: ["壬","癸","甲","乙","丙","丁","戊","己","庚","辛","庚","辛"],
-}
+def liuyue_month_stems(year: int) -> list:
+    """流月 1~12 月天干（年干五虎遁起正月，見 ziwei_ganzhi）。"""
+    return lunar_month_stems(year)
 
 def liuyue_base_index(cols: list, data: dict, liunian_row: list) -> int:
     """找出流月 1 月命 的基準位置。"""
     col_yin = get_col_with_branch(cols, "寅")
     base_pal = data.get(col_yin, {}).get("abbr", "")
-    if DEBUG:
-        print(f"DEBUG[LIUYUE] 本命『寅』在欄 {col_yin}，本命宮位＝{base_pal}")
+    if trace.enabled:
+        trace.emit("LIUYUE.yin", "本命『寅』在欄 {col}，本命宮位＝{pal}", col=col_yin, pal=base_pal)
     try:
         idx = liunian_row.index(base_pal)
-        if DEBUG:
-            print(f"DEBUG[LIUYUE] 流年行中對應宮位索引 = {idx}")
+        if trace.enabled:
+            trace.emit("LIUYUE.base", "流年行中對應宮位索引 = {idx}", idx=idx)
         return idx
     except ValueError:
-        if DEBUG:
-            print("DEBUG[LIUYUE] 在流年行找不到對應宮位，流月將輸出空白。")
+        if trace.enabled:
+            trace.emit("LIUYUE.missing", "在流年行找不到對應宮位，流月將輸出空白。")
         return -1
 
 def build_liuyue_row_by_month(cols: list, base_idx: int, month_no: int) -> list:
@@ -484,40 +655,17 @@ def build_liuyue_row_by_month(cols: list, base_idx: int, month_no: int) -> list:
 
 # ---------------- 流日設定 ＆ 工具 ----------------
 
-LIURI_CONFIG = {
-    2025: {m: {"days": 0, "first_day_stem": ""} for m in range(1,13)},
-    2026: {
-        1: {"days": 30, "first_day_stem": "壬"},
-        2: {"days": 29, "first_day_stem": "壬"},
-        3: {"days": 30, "first_day_stem": "辛"},
-        4: {"days": 29, "first_day_stem": "辛"},
-        5: {"days": 29, "first_day_stem": "庚"},
-        6: {"days": 30, "first_day_stem": "己"},
-        7: {"days": 29, "first_day_stem": "己"},
-        8: {"days": 29, "first_day_stem": "戊"},
-        9: {"days": 30, "first_day_stem": "丁"},
-        10: {"days": 30, "first_day_stem": "丁"},
-        11: {"days": 30, "first_day_stem": "丁"},
-        12: {"days": 29, "first_day_stem": "丁"},
-    },
-}
-
-# 農曆 1 月 1 日 對應國曆日期
-LIURI_LUNAR_YEAR_START_SOLAR = {
-    2026: datetime(2026, 2, 17),
-}
+# 農曆月份大小、閏月與正月初一國曆日期，一律查 ziwei_calendar 農曆表（1900–2100）
 
-def day_stem_for(year: int, month_no: int, day_no: int) -> str:
-    """給定農曆年月日，回傳該日天干。"""
-    year_cfg = LIURI_CONFIG.get(year, {})
-    cfg = year_cfg.get(month_no)
-    if not cfg:
+def day_stem_for(year: int, month_no: int, day_no: int, leap: bool = False) -> str:
+    """給定農曆年月日（leap=閏月），回傳該日天干；超出農曆表範圍回傳空字串。"""
+    if not lunar_year_supported(year):
         return ""
-    first = cfg.get("first_day_stem", "")
-    if first not in STEMS:
+    try:
+        solar = lunar_to_solar(year, month_no, day_no, leap)
+    except ValueError:
         return ""
-    idx0 = STEMS.index(first)
-    return STEMS[(idx0 + (day_no - 1)) % 10]
+    return STEMS[day_ganzhi_index(solar) % 10]
 
 def build_liuri_palace_row_for_day(cols: list, liuyue_palace_row: list, day_no: int) -> list:
     """
@@ -547,13 +695,7 @@ def build_liuri_palace_row_for_day(cols: list, liuyue_palace_row: list, day_no:
     if not anchor_col:
         return [""] * len(cols)
 
-    labels = PALACE_ORDER_CANONICAL[:]
-    out = [""] * len(cols)
-    start_idx = cols.index(anchor_col)
-    for offset in range(len(cols)):
-        pos = (start_idx + offset) % len(cols)
-        out[pos] = labels[offset % len(labels)]
-    return out
+    return palace_row_from_anchor(cols, anchor_col)
 
 # ==================== 流日命/遷 運勢（舊版函式，供摘要用） ====================
 
@@ -572,18 +714,14 @@ def find_day_ji_branch(day_stem: str, cols: list, data: dict) -> str:
             return branch_of_col(c)
     return ""
 
-def compute_ri_fortune_for_day(
-    year: int, month_no: int, day_no: int,
-    cols: list, liuri_row: list,
-    day_stem: str, day_cells_map: dict,
-    data: dict
-) -> str:
+def ri_fortune_verdict(cols: list, liuri_row: list, day_cells_map: dict, day_stem: str, data: dict):
     """
     只看「日命／日遷」：
       - 有忌 → 差（整日不適合決策）
       - 無忌但有祿/權/科 → 好
       - 其餘 → 平
       - 若非差，再算忌時（以化忌落點 + 日命地支推算）
+    回傳 (運勢, 忌時地支)；沒有忌時則地支為空字串。
     """
     col_ming = col_qian = None
     for idx, lab in enumerate(liuri_row):
@@ -596,14 +734,14 @@ def compute_ri_fortune_for_day(
     tokens_qian = day_cells_map.get(col_qian, []) if col_qian else []
 
     def types_of(tokens):
-        return [extract_hua_type(t) for t in tokens if extract_hua_type(t)]
+        return [t.hua for t in tokens]
 
     types_ming = types_of(tokens_ming)
     types_qian = types_of(tokens_qian)
 
     # 有忌 → 差
     if "忌" in types_ming or "忌" in types_qian:
-        return f"{year}年{month_no}月{day_no}日 : 運勢 差，整日不適合決策"
+        return "差", ""
 
     POS_TYPES = {"祿","權","科"}
     all_pos = POS_TYPES.intersection(set(types_ming + types_qian))
@@ -611,25 +749,80 @@ def compute_ri_fortune_for_day(
 
     # 算忌時
     if not col_ming:
-        return f"{year}年{month_no}月{day_no}日 : 運勢 {fortune}"
+        return fortune, ""
 
     ming_branch = branch_of_col(col_ming)
     if ming_branch not in ZODIAC:
-        return f"{year}年{month_no}月{day_no}日 : 運勢 {fortune}"
+        return fortune, ""
 
     ji_branch = find_day_ji_branch(day_stem, cols, data)
     if ji_branch not in ZODIAC:
-        return f"{year}年{month_no}月{day_no}日 : 運勢 {fortune}"
+        return fortune, ""
 
     start_idx = ZODIAC.index(ming_branch)
     ji_idx = ZODIAC.index(ji_branch)
     pos = (ji_idx - start_idx) % 12 + 1
-    hour_branch = ZODIAC[pos - 1]
-    hour_range = HOUR_RANGE_TEXT.get(hour_branch, "")
+    return fortune, ZODIAC[pos - 1]
 
+def format_ri_fortune_line(year: int, month_no: int, day_no: int, fortune: str, hour_branch: str, leap: bool = False) -> str:
+    """(運勢, 忌時地支) → 『2026年1月1日 : 運勢 平，忌時 : 亥時(21:00~23:00)』（閏月寫成『閏6月』）"""
+    month_txt = f"閏{month_no}" if leap else f"{month_no}"
+    if fortune == "差":
+        return f"{year}年{month_txt}月{day_no}日 : 運勢 差，整日不適合決策"
+    hour_range = HOUR_RANGE_TEXT.get(hour_branch, "")
     if hour_range:
-        return f"{year}年{month_no}月{day_no}日 : 運勢 {fortune}，忌時 : {hour_branch}時({hour_range})"
-    return f"{year}年{month_no}月{day_no}日 : 運勢 {fortune}"
+        return f"{year}年{month_txt}月{day_no}日 : 運勢 {fortune}，忌時 : {hour_branch}時({hour_range})"
+    return f"{year}年{month_txt}月{day_no}日 : 運勢 {fortune}"
+
+def compute_ri_fortune_for_day(
+    year: int, month_no: int, day_no: int,
+    cols: list, liuri_row: list,
+    day_stem: str, day_cells_map: dict,
+    data: dict
+) -> str:
+    """單日運勢一行字（規則見 ri_fortune_verdict）。"""
+    fortune, hour_branch = ri_fortune_verdict(cols, liuri_row, day_cells_map, day_stem, data)
+    return format_ri_fortune_line(year, month_no, day_no, fortune, hour_branch)
+
+def palace_row_from_anchor(cols: list, anchor_col: str) -> list:
+    """anchor_col 標命，右側依 PALACE_ORDER_CANONICAL 排滿；找不到 anchor 回傳空白列。"""
+    if not anchor_col or anchor_col not in cols:
+        return [""] * len(cols)
+    labels = PALACE_ORDER_CANONICAL
+    out = [""] * len(cols)
+    start_idx = cols.index(anchor_col)
+    for offset in range(len(cols)):
+        pos = (start_idx + offset) % len(cols)
+        out[pos] = labels[offset % len(labels)]
+    return out
+
+def get_ri_fortune_table(data: dict, cols: list) -> dict:
+    """
+    流日運勢只取決於「日干」與「流日命地支」，每盤預先算好全部組合（與年份無關）：
+      {(日干, 流日命地支): (運勢, 忌時地支)}
+    地支為空字串代表當月找不到流月命（流日宮位整列空白）。
+    """
+    def build():
+        table = {}
+        for stem in STEMS:
+            cells_map = debug_four_hua_locate(f"流日四化({stem})", stem, cols, data)
+            for branch in ZODIAC + [""]:
+                row = palace_row_from_anchor(cols, get_col_with_branch(cols, branch) if branch else "")
+                table[(stem, branch)] = ri_fortune_verdict(cols, row, cells_map, stem, data)
+        return table
+    return chart_memo(data, ("ri_fortune_table", tuple(cols)), build, per_year=False)
+
+def liuyue_ming_branch_index(cols: list, liuyue_row: list) -> int:
+    """流月命所在欄的地支索引（流日 1 號由此起算）；找不到回傳 -1。"""
+    for i, lab in enumerate(liuyue_row):
+        if lab == "命":
+            br = branch_of_col(cols[i])
+            return ZODIAC.index(br) if br in ZODIAC else -1
+    return -1
+
+def liuri_ming_branch(ming_idx: int, day_no: int) -> str:
+    """流日命地支：流月命地支為 1 號，依子丑寅卯…順數。"""
+    return ZODIAC[(ming_idx + (day_no - 1)) % 12] if ming_idx >= 0 else ""
 
 # ====================== 流月命／流月遷 運勢計算 ======================
 
@@ -674,18 +867,21 @@ def format_yue_palace_tokens(tokens: list, palace_label: str) -> str:
     """將某一宮的四化列表格式化成『星星祿、星星忌/月命』形式。"""
     if not tokens:
         return ""
-    filtered = [t for t in tokens if extract_hua_type(t) in ("祿","權","科","忌")]
+    filtered = [t for t in tokens if t.hua in HUA_TYPES]
     if not filtered:
         return ""
-    txt = "、".join(filtered)
+    txt = format_hua_tokens(filtered, "、")
     return f"{txt}/月{palace_label}"
 
-def compute_yue_fortune_for_month(
-    year: int, month_no: int,
-    cols: list, liuyue_row: list,
-    m_stem: str, month_cells_map: dict
-) -> str:
-    """只看月命／月遷，依你定義的分數規則輸出一句話月運勢。"""
+# 月運勢型態代碼（時間軸檔案存的是索引）："" = 本月運勢平穩
+YUE_PATTERNS = ("", "科", "祿", "權", "忌", "科+忌", "權+忌", "祿+忌")
+
+def yue_fortune_verdict(cols: list, liuyue_row: list, month_cells_map: dict):
+    """
+    只看月命／月遷，依分數規則判定月運勢：
+      回傳 (型態, 分數, 宮位(命/遷), 四化描述, 一句話)；
+      平穩月回傳 ("", 0, "", "", "")。
+    """
     col_ming = col_qian = None
     for idx, lab in enumerate(liuyue_row):
         if lab == "命":
@@ -697,7 +893,7 @@ def compute_yue_fortune_for_month(
     tokens_qian = month_cells_map.get(col_qian, []) if col_qian else []
 
     def types_of(tokens):
-        return [extract_hua_type(t) for t in tokens if extract_hua_type(t)]
+        return [t.hua for t in tokens]
 
     types_ming = types_of(tokens_ming)
     types_qian = types_of(tokens_qian)
@@ -736,7 +932,7 @@ def compute_yue_fortune_for_month(
 
         palace_label, palace_tokens, pattern, score, msg = chosen
         token_desc = format_yue_palace_tokens(palace_tokens, palace_label)
-        return f"{year}年{month_no}月 : {token_desc}｜{msg}，好運指數{score}分"
+        return pattern, score, palace_label, token_desc, msg
 
     # B. 沒有忌 → 看祿/權/科
     POS_SCORE = {"祿": 80, "權": 100, "科": 60}
@@ -748,7 +944,7 @@ def compute_yue_fortune_for_month(
 
     all_types = [t for t in (types_ming + types_qian) if t in POS_SCORE]
     if not all_types:
-        return f"{year}年{month_no}月 : 本月運勢平穩"
+        return "", 0, "", "", ""
 
     best_type = max(set(all_types), key=lambda t: POS_SCORE[t])
     score, msg = POS_SCORE[best_type], POS_MSG[best_type]
@@ -759,9 +955,25 @@ def compute_yue_fortune_for_month(
     if tokens_qian:
         parts.append(format_yue_palace_tokens(tokens_qian, "遷"))
     token_desc = "，".join(parts) if parts else "本月有好星啟動"
+    palace_label = "命" if set(types_of(tokens_ming)) & set(all_types) else "遷"
+
+    return best_type, score, palace_label, token_desc, msg
 
+def format_yue_fortune_line(year: int, month_no: int, verdict) -> str:
+    """yue_fortune_verdict 的結果 → 『2026年2月 : 太陽祿/月命｜把握機會，順勢而為，好運指數80分』"""
+    pattern, score, _, token_desc, msg = verdict
+    if not pattern:
+        return f"{year}年{month_no}月 : 本月運勢平穩"
     return f"{year}年{month_no}月 : {token_desc}｜{msg}，好運指數{score}分"
 
+def compute_yue_fortune_for_month(
+    year: int, month_no: int,
+    cols: list, liuyue_row: list,
+    m_stem: str, month_cells_map: dict
+) -> str:
+    """只看月命／月遷，依你定義的分數規則輸出一句話月運勢。"""
+    return format_yue_fortune_line(year, month_no, yue_fortune_verdict(cols, liuyue_row, month_cells_map))
+
 # ======================== 流日運勢（新版：好／平／差 + 忌時） ========================
 
 def calc_ji_time(cols:list, liuri_row:list, day_cells_map:dict, day_stem:str):
@@ -769,7 +981,7 @@ def calc_ji_time(cols:list, liuri_row:list, day_cells_map:dict, day_stem:str):
     target_col = None
     for c in cols:
         for t in day_cells_map.get(c, []):
-            if extract_hua_type(t) == "忌":
+            if t.hua == "忌":
                 target_col = c
                 break
         if target_col:
@@ -826,7 +1038,7 @@ def compute_yue_ri_fortune(
     tokens_qian = day_cells_map.get(col_qian, []) if col_qian else []
 
     def types(tokens):
-        return [extract_hua_type(t) for t in tokens if extract_hua_type(t)]
+        return [t.hua for t in tokens]
 
     types_ming = types(tokens_ming)
     types_qian = types(tokens_qian)
@@ -841,53 +1053,148 @@ def compute_yue_ri_fortune(
     ji_time = calc_ji_time(cols, liuri_row, day_cells_map, day_stem)
     return f"{year}年{month_no}月{day_no}日 : 運勢 {fortune}，忌時 : {ji_time}"
 
-# ====================== 共用：摘要計算工具 ======================
+# ====================== 共用：四化飛星圖 ======================
 
-def compute_in_out_for_palace(four_map: dict, palace_star: dict, target_pal: str, label_prefix: str):
+HUA_TYPES = ("祿","權","科","忌")
+
+# 一條飛化邊：hua=四化類別、src=飛出宮、dst=被飛入宮、token=HuaToken（如「太陽祿」）
+HuaEdge = namedtuple("HuaEdge", ["hua", "src", "dst", "token"])
+
+def build_hua_graph(four_map: dict) -> dict:
     """
-    針對某宮計算：
+    由大限/流年的 four_map 建立飛化圖（每一層只建一次）：
+      nodes: 宮位（PALACE_ORDER_CANONICAL 順序，其後補上其它出現過的宮位）
+      edges: [HuaEdge, ...]
+      out:   {宮位: [HuaEdge...]}  該宮飛出
+      in:    {宮位: [HuaEdge...]}  飛入該宮
+    邊的順序與逐宮掃描 four_map 時完全相同，入/出 查詢改為直接讀鄰接表。
+    token 可為 HuaToken 或文字（『太陽祿』），文字會轉成 HuaToken。
+    """
+    nodes = list(PALACE_ORDER_CANONICAL)
+    for src, info in four_map.items():
+        for pal in [src] + list(info.get("by_big", {}).keys()):
+            if pal not in nodes:
+                nodes.append(pal)
+
+    out_edges = {pal: [] for pal in nodes}
+    in_edges = {pal: [] for pal in nodes}
+    edges = []
+    for src, info in four_map.items():
+        for dst, tokens in info.get("by_big", {}).items():
+            for tok in tokens:
+                if not isinstance(tok, HuaToken):   # 舊呼叫端傳來的文字 token（如「太陽祿」）
+                    tok = HuaToken(extract_star_name(tok), extract_hua_type(tok))
+                if tok.hua not in HUA_TYPES:
+                    continue
+                edge = HuaEdge(tok.hua, src, dst, tok)
+                edges.append(edge)
+                out_edges[src].append(edge)
+                in_edges[dst].append(edge)
+
+    return {"nodes": nodes, "edges": edges, "out": out_edges, "in": in_edges}
+
+def compute_in_out_from_graph(graph: dict, palace_star: dict, target_pal: str, label_prefix: str):
+    """
+    以飛化圖計算某宮：
       - 祿/權/科/忌 入：來源宮的星系 / label_prefix+宮位
       - 祿/權/科/忌 出：優先用「目的宮」星系，找不到才退回本宮星系或 token
     """
-    res = {
-        "祿入": [], "祿出": [],
-        "權入": [], "權出": [],
-        "科入": [], "科出": [],
-        "忌入": [], "忌出": [],
-    }
+    res = {f"{hua}{way}": [] for hua in HUA_TYPES for way in ("入", "出")}
 
-    # 該宮飛出
-    info = four_map.get(target_pal)
-    if info:
-        by_big = info.get("by_big", {})
-        stars_str_self = palace_star.get(target_pal, "")
-        for dest_pal, tokens in by_big.items():
-            for tok in tokens:
-                hua = extract_hua_type(tok)
-                if hua not in ("祿","權","科","忌"):
-                    continue
-                key = f"{hua}出"
-                stars_dest = palace_star.get(dest_pal, "")
-                star_repr = stars_dest or stars_str_self or tok
-                res[key].append((star_repr, f"{label_prefix}{dest_pal}"))
-
-    # 該宮飛入
-    for src_pal, info2 in four_map.items():
-        by_big2 = info2.get("by_big", {})
-        tokens2 = by_big2.get(target_pal, [])
-        if not tokens2:
-            continue
-        stars_str_src = palace_star.get(src_pal, "")
-        for tok2 in tokens2:
-            hua = extract_hua_type(tok2)
-            if hua not in ("祿","權","科","忌"):
-                continue
-            key = f"{hua}入"
-            star_repr = stars_str_src or tok2
-            res[key].append((star_repr, f"{label_prefix}{src_pal}"))
+    stars_str_self = palace_star.get(target_pal, "")
+    for edge in graph["out"].get(target_pal, []):
+        star_repr = palace_star.get(edge.dst, "") or stars_str_self or edge.token
+        res[f"{edge.hua}出"].append((star_repr, PalaceRef(label_prefix, edge.dst)))
+
+    for edge in graph["in"].get(target_pal, []):
+        star_repr = palace_star.get(edge.src, "") or edge.token
+        res[f"{edge.hua}入"].append((star_repr, PalaceRef(label_prefix, edge.src)))
 
     return res
 
+def compute_in_out_all_palaces(graph: dict, palace_star: dict, label_prefix: str) -> dict:
+    """一次算出整層 12 宮的入/出：{宮位: compute_in_out_from_graph(...)}。"""
+    return {
+        pal: compute_in_out_from_graph(graph, palace_star, pal, label_prefix)
+        for pal in graph["nodes"]
+    }
+
+def compute_sub_ji_from_graph(graph: dict, palace_star: dict, target_pal: str, label_prefix: str):
+    """子忌（飛化圖版）：target_pal 第一個忌出的宮位，再取該宮的全部忌出。"""
+    first_dest_pal = next((e.dst for e in graph["out"].get(target_pal, []) if e.hua == "忌"), None)
+    if not first_dest_pal:
+        return []
+    result = []
+    for edge in graph["out"].get(first_dest_pal, []):
+        if edge.hua == "忌":
+            star_repr = palace_star.get(edge.dst, "") or edge.token
+            result.append((star_repr, PalaceRef(label_prefix, edge.dst)))
+    return result
+
+def trace_hua_chain(graph: dict, start_pal: str, hua: str = "忌", max_depth: int = 12) -> list:
+    """
+    沿飛化圖追某一類四化（預設忌，亦可傳祿/權/科）的連續飛出鏈：
+      命 →忌→ 財 →忌→ 官 → ...
+    一宮若同時有多條同類飛出，會分岔成多條鏈。
+    回傳 [{'path':[宮位...], 'edges':[HuaEdge...], 'cycle':宮位或'', 'truncated':bool}, ...]
+      - cycle：下一步飛回鏈上已出現的宮位即停止，並記錄該宮位
+      - truncated：走滿 max_depth 步仍可再飛
+    結果以 (起點, 類別, 深度) 記在 graph 上（同一命盤同一層只算一次），呼叫端請勿修改。
+    """
+    if hua not in HUA_TYPES:
+        return []
+    memo = graph.setdefault("chain_memo", {})
+    key = (start_pal, hua, max_depth)
+    if key in memo:
+        return memo[key]
+
+    chains = []
+
+    def walk(pal, path, edges):
+        outs = [e for e in graph["out"].get(pal, []) if e.hua == hua]
+        if not outs:
+            chains.append({"path": path, "edges": edges, "cycle": "", "truncated": False})
+            return
+        if len(edges) >= max_depth:
+            chains.append({"path": path, "edges": edges, "cycle": "", "truncated": True})
+            return
+        for e in outs:
+            if e.dst in path:
+                chains.append({"path": path, "edges": edges + [e], "cycle": e.dst, "truncated": False})
+            else:
+                walk(e.dst, path + [e.dst], edges + [e])
+
+    walk(start_pal, [start_pal], [])
+    memo[key] = chains
+    return chains
+
+def trace_hua_chains_all(graph: dict, hua: str = "忌", max_depth: int = 12) -> dict:
+    """整層 12 宮一次查：{宮位: trace_hua_chain(...)}。"""
+    return {pal: trace_hua_chain(graph, pal, hua, max_depth) for pal in graph["nodes"]}
+
+def format_hua_chain(chain: dict, label_prefix: str) -> str:
+    """
+    鏈 → 文字，例如：大命 → 大財 → 大官 ↺大財
+    （↺ 表示飛回鏈上宮位形成循環；… 表示超過深度被截斷）
+    """
+    txt = " → ".join(f"{label_prefix}{pal}" for pal in chain["path"])
+    if chain["cycle"]:
+        txt += f" ↺{label_prefix}{chain['cycle']}"
+    elif chain["truncated"]:
+        txt += " …"
+    return txt
+
+# ====================== 共用：摘要計算工具 ======================
+
+def compute_in_out_for_palace(four_map: dict, palace_star: dict, target_pal: str, label_prefix: str):
+    """
+    針對某宮計算：
+      - 祿/權/科/忌 入：來源宮的星系 / label_prefix+宮位
+      - 祿/權/科/忌 出：優先用「目的宮」星系，找不到才退回本宮星系或 token
+    （相容舊呼叫；同一層要查多宮時請先 build_hua_graph 再用 compute_in_out_from_graph）
+    """
+    return compute_in_out_from_graph(build_hua_graph(four_map), palace_star, target_pal, label_prefix)
+
 
 def compute_sub_ji_for_palace(
     four_map: dict,
@@ -902,36 +1209,7 @@ def compute_sub_ji_for_palace(
       3. 輸出時，star_repr 使用「被飛到宮位的完整星系」，而不是單一忌星 token
           → 例如：武曲，貪狼/大夫
     """
-    info = four_map.get(target_pal)
-    if not info:
-        return []
-
-    # 1) 找第一個忌飛到的宮位
-    first_dest_pal = None
-    for dest_pal, tokens in info.get("by_big", {}).items():
-        for tok in tokens:
-            if extract_hua_type(tok) == "忌":
-                first_dest_pal = dest_pal
-                break
-        if first_dest_pal:
-            break
-    if not first_dest_pal:
-        return []
-
-    # 2) 看該宮再飛出的忌（子忌）
-    info2 = four_map.get(first_dest_pal)
-    if not info2:
-        return []
-
-    result = []
-    for dest_pal2, tokens2 in info2.get("by_big", {}).items():
-        for tok2 in tokens2:
-            if extract_hua_type(tok2) == "忌":
-                # ⭐ 關鍵：這裡改成使用「該宮的完整星系」
-                stars_dest = palace_star.get(dest_pal2, "")
-                star_repr = stars_dest or tok2
-                result.append((star_repr, f"{label_prefix}{dest_pal2}"))
-    return result
+    return compute_sub_ji_from_graph(build_hua_graph(four_map), palace_star, target_pal, label_prefix)
 
 
 def format_entry_list(pairs, empty_as_wu=False) -> str:
@@ -953,14 +1231,17 @@ def build_flow_to_big_map(flow_label_by_col: dict, big_label_by_col: dict, cols:
 
 def format_flow_entry_list(pairs, flow_to_big: dict, empty_as_wu: bool = False) -> str:
     """
-    [( '貪狼祿','流夫' ), ...] → '貪狼祿/流夫/大財； ...'
+    [( '貪狼祿', PalaceRef('流','夫') ), ...] → '貪狼祿/流夫/大財； ...'
     """
     if not pairs:
         return "無" if empty_as_wu else ""
     items = []
     for star_tok, flow_label in pairs:
-        m = re.match(r"^流(.+)$", flow_label)
-        big = flow_to_big.get(m.group(1), "") if m else ""
+        if isinstance(flow_label, PalaceRef):
+            big = flow_to_big.get(flow_label.palace, "") if flow_label.layer == "流" else ""
+        else:
+            m = re.match(r"^流(.+)$", flow_label)
+            big = flow_to_big.get(m.group(1), "") if m else ""
         if big:
             items.append(f"{star_tok}/{flow_label}/{big}")
         else:
@@ -969,10 +1250,14 @@ def format_flow_entry_list(pairs, flow_to_big: dict, empty_as_wu: bool = False)
 
 def enhance_ji_with_big(hua_list, flow_to_big: dict) -> list:
     """
-    '流田宮/天梁科' → '流田宮/天梁科/大財'
+    HuaPlacement 流田宮/天梁科 → 流田宮/天梁科/大財（舊的字串輸入也照樣處理）
     """
     out = []
     for s in hua_list:
+        if isinstance(s, HuaPlacement):
+            big = flow_to_big.get(s.palace, "") if (s.layer == "流" and s.palace) else ""
+            out.append(s._replace(big=big) if big else s)
+            continue
         m = re.match(r"^(流(.+?)宮)/(.*)$", s)
         if not m:
             out.append(s)
@@ -984,80 +1269,154 @@ def enhance_ji_with_big(hua_list, flow_to_big: dict) -> list:
 
 # === 化忌 → 宮位/科 轉換 ===
 
-def _palace_name_from_code(code: str, cols: list, label_by_col: dict, label_prefix: str) -> str:
+def _palace_from_code(code: str, cols: list, label_by_col: dict) -> str:
     for c in cols:
         if code in c:
             pal = label_by_col.get(c, "")
             if pal:
-                return f"{label_prefix}{pal}宮"
-    return f"{code}宮位"
+                return pal
+    return ""
+
+def _palace_name_from_code(code: str, cols: list, label_by_col: dict, label_prefix: str) -> str:
+    pal = _palace_from_code(code, cols, label_by_col)
+    return f"{label_prefix}{pal}宮" if pal else f"{code}宮位"
 
 def resolve_ji_for_stem_chart(stem: str, cols: list, label_by_col: dict, label_prefix: str):
     """
-    HUA_JI_RESOLVE → ['prefix命宮/紫微科', ...]
+    HUA_JI_RESOLVE → [HuaPlacement（輸出為『prefix命宮/紫微科』）, ...]
     """
     if not stem or stem not in HUA_JI_RESOLVE:
         return []
     mapping = HUA_JI_RESOLVE[stem]
-    out = []
-    if stem == "壬":
-        pals, star_k = mapping
-        for code in pals:
-            pal_name = _palace_name_from_code(code, cols, label_by_col, label_prefix)
-            out.append(f"{pal_name}/{star_k}")
-    else:
-        code, star_k = mapping
-        pal_name = _palace_name_from_code(code, cols, label_by_col, label_prefix)
-        out.append(f"{pal_name}/{star_k}")
-    return out
+    codes, star_k = mapping if stem == "壬" else ([mapping[0]], mapping[1])
+    return [
+        HuaPlacement(label_prefix, _palace_from_code(code, cols, label_by_col), code, star_k, "")
+        for code in codes
+    ]
+
+def format_hua_placements(parts) -> str:
+    return "；".join(str(p) for p in parts)
 
 # ======================= 大限命/財/官/友 共用建構 =======================
 
-def build_da_four_hua_and_palace_stars(data: dict, col_order: list, raw_text: str):
+def build_layer_four_hua(data: dict, cols: list, label_row: list, tag_prefix: str) -> dict:
     """
-    回傳：
-      da_four: {'命'~'父': {'stem':干,'by_big':{宮位:[四化]}}}
-      palace_star: {'命'~'父': '主星，輔星，兇星...'}
-      big_label_by_col: {col: '命'~'父'}
-      cols: 重新排序後欄位
+    依某一層（大限/流年）的宮位列，建立該層 12 宮四化與星系：
+      four:         {'命'~'父': {'stem':干,'by_big':{宮位:[四化]}}}
+      palace_star:  {'命'~'父': '主星，輔星，兇星...'}
+      label_by_col: {col: '命'~'父'}
+      graph:        build_hua_graph(four)
     """
-    cols = reorder_cols_by_palace(data, col_order)
-    byear = parse_birth_year(raw_text)
-    age = (CYEAR - byear) if byear else None
-    anchor_col = safe_find_anchor_by_age(data, cols, age) if age is not None else ""
-    ming_line = build_daxian_ming_row(cols, data, anchor_col)
-
-    big_label_by_col = {c: (ming_line[i] if i < len(ming_line) else "") for i,c in enumerate(cols)}
-    da_four = {}
+    label_by_col = {c: (label_row[i] if i < len(label_row) else "") for i,c in enumerate(cols)}
+    four = {}
 
-    # 每一大限宮位的大限四化
+    # 每一宮位的四化
     for label in PALACE_ORDER_CANONICAL:
-        target_col = find_col_for_label(cols, ming_line, label)
+        target_col = find_col_for_label(cols, label_row, label)
         if not target_col:
             continue
         stem = get_stem_from_col(target_col)
         if not stem:
             continue
-        cells_map = debug_four_hua_locate(f"大{label}四化(摘要用)", stem, cols, data)
+        cells_map = debug_four_hua_locate(f"{tag_prefix}{label}四化(摘要用)", stem, cols, data)
         by_big = {}
         for c in cols:
-            big_pal = big_label_by_col.get(c, "")
+            pal = label_by_col.get(c, "")
             tokens = cells_map.get(c, [])
-            if big_pal and tokens:
-                by_big[big_pal] = list(tokens)
-        da_four[label] = {"stem": stem, "by_big": by_big}
+            if pal and tokens:
+                by_big[pal] = list(tokens)
+        four[label] = {"stem": stem, "by_big": by_big}
 
-    # 每一大限宮位的星系
+    # 每一宮位的星系
     palace_star = {}
     for label in PALACE_ORDER_CANONICAL:
-        idx = next((i for i,lab in enumerate(ming_line) if lab == label), None)
+        idx = next((i for i,lab in enumerate(label_row) if lab == label), None)
         if idx is None:
             continue
         col = cols[idx]
         bucket = data.get(col, {})
         parts = bucket.get("main", []) + bucket.get("aux", []) + bucket.get("mini", [])
         palace_star[label] = "，".join(parts) if parts else ""
-    return da_four, palace_star, big_label_by_col, cols
+
+    return {
+        "four": four,
+        "palace_star": palace_star,
+        "label_by_col": label_by_col,
+        "graph": build_hua_graph(four),
+    }
+
+def get_da_decade_layer(data: dict, cols: list, anchor_col: str) -> dict:
+    """
+    某一個大限（以大限命所在欄 anchor_col 表示）的大限層，與目標年無關：
+      build_layer_four_hua 的內容，再加上 cols / row（大限命宮位列）/ anchor_col
+    同一個大限內的各目標年共用同一份。
+    """
+    def build():
+        ming_line = build_daxian_ming_row(cols, data, anchor_col)
+        layer = build_layer_four_hua(data, cols, ming_line, "大")
+        layer.update({"cols": cols, "row": ming_line, "anchor_col": anchor_col})
+        return layer
+    return chart_memo(data, ("da_decade_layer", tuple(cols), anchor_col), build, per_year=False)
+
+def get_da_layer(data: dict, col_order: list, raw_text: str) -> dict:
+    """
+    目標年所在的大限層：get_da_decade_layer 的內容，再加上 age（目標年年紀）。
+    """
+    def build():
+        cols = chart_cols(data, col_order)
+        byear = chart_birth_year(data, raw_text)
+        age = (CYEAR - byear) if byear else None
+        anchor_col = safe_find_anchor_by_age(data, cols, age) if age is not None else ""
+        return {**get_da_decade_layer(data, cols, anchor_col), "age": age}
+    return chart_memo(data, ("da_layer", tuple(col_order), raw_text), build)
+
+def get_liu_layer(data: dict, col_order: list) -> dict:
+    """流年層（每盤每目標年只算一次）：build_layer_four_hua 的內容，再加上 cols / row（流年命宮位列）。"""
+    def build():
+        cols = chart_cols(data, col_order)
+        liu_row = build_liunian_row(cols, CYEAR)
+        layer = build_layer_four_hua(data, cols, liu_row, "流")
+        layer.update({"cols": cols, "row": liu_row})
+        return layer
+    return chart_memo(data, ("liu_layer", tuple(col_order)), build)
+
+def get_liu_year_stem_layer(data: dict, col_order: list) -> dict:
+    """
+    流年「流年干」版：流年層的 four 以淺層覆蓋（overlay）把『命』換成流年干四化，
+    其餘宮位直接共用流年層的結構，不做深拷貝。
+    回傳 {'stem': 流年干, 'four': 覆蓋後的 four, 'graph': 對應飛化圖}
+    """
+    def build():
+        liu = get_liu_layer(data, col_order)
+        cols, label_by_col = liu["cols"], liu["label_by_col"]
+        stem_year = year_stem_of_year(CYEAR)
+        four = liu["four"]
+
+        # 找出流命所在的欄位，並用流年干重新計算該宮的四化分佈
+        if find_col_for_label(cols, liu["row"], "命"):
+            cells_map_year = debug_four_hua_locate(f"流命YearStem({stem_year})", stem_year, cols, data)
+            by_flow_year = {}
+            for c in cols:
+                pal = label_by_col.get(c, "")
+                tokens = cells_map_year.get(c, [])
+                if pal and tokens:
+                    by_flow_year[pal] = list(tokens)
+            # 覆蓋『命』宮的定義為流年干
+            four = {**four, "命": {"stem": stem_year, "by_big": by_flow_year}}
+
+        return {"stem": stem_year, "four": four, "graph": build_hua_graph(four)}
+    return chart_memo(data, ("liu_year_stem_layer", tuple(col_order)), build)
+
+def build_da_four_hua_and_palace_stars(data: dict, col_order: list, raw_text: str):
+    """
+    回傳：
+      da_four: {'命'~'父': {'stem':干,'by_big':{宮位:[四化]}}}
+      palace_star: {'命'~'父': '主星，輔星，兇星...'}
+      big_label_by_col: {col: '命'~'父'}
+      cols: 重新排序後欄位
+    """
+    layer = get_da_layer(data, col_order, raw_text)
+    return layer["four"], layer["palace_star"], layer["label_by_col"], layer["cols"]
 
 def build_liu_four_hua_and_palace_stars(data: dict, col_order: list):
     """
@@ -1066,45 +1425,14 @@ def build_liu_four_hua_and_palace_stars(data: dict, col_order: list):
       palace_star: 流年星系
       flow_label_by_col: {col:'命'~'父'}
     """
-    cols = reorder_cols_by_palace(data, col_order)
-    liu_row = build_liunian_row(cols, CYEAR)
-
-    flow_label_by_col = {c: (liu_row[i] if i < len(liu_row) else "") for i,c in enumerate(cols)}
-    liu_four = {}
-
-    for label in PALACE_ORDER_CANONICAL:
-        target_col = find_col_for_label(cols, liu_row, label)
-        if not target_col:
-            continue
-        stem = get_stem_from_col(target_col)
-        if not stem:
-            continue
-        cells_map = debug_four_hua_locate(f"流{label}四化(摘要用)", stem, cols, data)
-        by_flow = {}
-        for c in cols:
-            pal = flow_label_by_col.get(c, "")
-            tokens = cells_map.get(c, [])
-            if pal and tokens:
-                by_flow[pal] = list(tokens)
-        liu_four[label] = {"stem": stem, "by_big": by_flow}
-
-    palace_star = {}
-    for label in PALACE_ORDER_CANONICAL:
-        idx = next((i for i,lab in enumerate(liu_row) if lab == label), None)
-        if idx is None:
-            continue
-        col = cols[idx]
-        bucket = data.get(col, {})
-        parts = bucket.get("main", []) + bucket.get("aux", []) + bucket.get("mini", [])
-        palace_star[label] = "，".join(parts) if parts else ""
-    return liu_four, palace_star, flow_label_by_col, cols
+    layer = get_liu_layer(data, col_order)
+    return layer["four"], layer["palace_star"], layer["label_by_col"], layer["cols"]
 
 # ========================== v6：主表格（保留） ==========================
 
 def render_markdown_table_v6(data: dict, col_order: list, year_stem: str, raw_text: str) -> str:
     cols = reorder_cols_by_palace(data, col_order)
-    if DEBUG:
-        debug_report_order(col_order, cols, data)
+    debug_report_order(col_order, cols, data)
 
     header = ["原始資料", "宮干支"] + cols
     lines = [
@@ -1120,7 +1448,7 @@ def render_markdown_table_v6(data: dict, col_order: list, year_stem: str, raw_te
 
     if year_stem and year_stem in YEAR_HUA:
         cell_map = debug_four_hua_locate("生年四化", year_stem, cols, data)
-        row = ["", f"生年四化（{year_stem}）"]; [row.append("/".join(cell_map[c]) if cell_map[c] else "") for c in cols]; lines.append("| " + " | ".join(row) + " |")
+        row = ["", f"生年四化（{year_stem}）"]; [row.append(format_hua_tokens(cell_map[c]) if cell_map[c] else "") for c in cols]; lines.append("| " + " | ".join(row) + " |")
 
     byear = parse_birth_year(raw_text)
     age = (CYEAR - byear) if byear else None
@@ -1133,9 +1461,8 @@ def render_markdown_table_v6(data: dict, col_order: list, year_stem: str, raw_te
 # ========================== v7：主表格（完整版） ==========================
 
 def render_markdown_table_v7(data: dict, col_order: list, year_stem: str, raw_text: str) -> str:
-    cols = reorder_cols_by_palace(data, col_order)
-    if DEBUG:
-        debug_report_order(col_order, cols, data)
+    cols = chart_cols(data, col_order)
+    debug_report_order(col_order, cols, data)
 
     header = ["原始資料", "宮干支"] + cols
     lines = [
@@ -1155,13 +1482,10 @@ def render_markdown_table_v7(data: dict, col_order: list, year_stem: str, raw_te
     # 生年四化
     if year_stem and year_stem in YEAR_HUA:
         cell_map = debug_four_hua_locate("生年四化", year_stem, cols, data)
-        row = ["", f"生年四化（{year_stem}）"]; [row.append("/".join(cell_map[c]) if cell_map[c] else "") for c in cols]; lines.append("| " + " | ".join(row) + " |")
+        row = ["", f"生年四化（{year_stem}）"]; [row.append(format_hua_tokens(cell_map[c]) if cell_map[c] else "") for c in cols]; lines.append("| " + " | ".join(row) + " |")
 
     # 大限命｜宮位
-    byear = parse_birth_year(raw_text)
-    age = (CYEAR - byear) if byear else None
-    anchor_col = safe_find_anchor_by_age(data, cols, age) if age is not None else ""
-    ming_line = build_daxian_ming_row(cols, data, anchor_col)
+    ming_line = get_da_layer(data, col_order, raw_text)["row"]
     row = ["大限命","宮位"]; [row.append(v) for v in ming_line]; lines.append("| " + " | ".join(row) + " |")
 
     # 大限 12 宮四化
@@ -1173,11 +1497,11 @@ def render_markdown_table_v7(data: dict, col_order: list, year_stem: str, raw_te
         cells_map = debug_four_hua_locate(f"大{label}四化", stem, cols, data)
         row = ["", f"大{label}四化（{stem}）"]
         for c in cols:
-            row.append("/".join(cells_map[c]) if cells_map[c] else "")
+            row.append(format_hua_tokens(cells_map[c]) if cells_map[c] else "")
         lines.append("| " + " | ".join(row) + " |")
 
     # 流年命
-    liu_row = build_liunian_row(cols, CYEAR)
+    liu_row = get_liu_layer(data, col_order)["row"]
     row = [f"流年命（{CYEAR}）","宮位"]; [row.append(v) for v in liu_row]; lines.append("| " + " | ".join(row) + " |")
 
     stem_year = year_stem_of_year(CYEAR)
@@ -1188,17 +1512,17 @@ def render_markdown_table_v7(data: dict, col_order: list, year_stem: str, raw_te
     year_cells_map = debug_four_hua_locate("流命四化(天干)", stem_year, cols, data)
     if stem_branch and stem_branch != stem_year:
         if 'OUTPUT_SWITCH' not in globals() or OUTPUT_SWITCH["LIU_MING_FOUR_HUA"].get("YEAR_STEM_LINE", True):
-            row = ["", f"流命四化（{stem_year}）"]; [row.append("/".join(year_cells_map[c]) if year_cells_map[c] else "") for c in cols]; lines.append("| " + " | ".join(row) + " |")
+            row = ["", f"流命四化（{stem_year}）"]; [row.append(format_hua_tokens(year_cells_map[c]) if year_cells_map[c] else "") for c in cols]; lines.append("| " + " | ".join(row) + " |")
         br_cells_map = debug_four_hua_locate("流命四化(地支欄天干)", stem_branch, cols, data)
         if 'OUTPUT_SWITCH' not in globals() or OUTPUT_SWITCH["LIU_MING_FOUR_HUA"].get("BRANCH_STEM_LINE", True):
-            row = ["", f"流命四化（{stem_branch}）"]; [row.append("/".join(br_cells_map[c]) if br_cells_map[c] else "") for c in cols]; lines.append("| " + " | ".join(row) + " |")
-        if DEBUG:
-            print(f"DEBUG[LIUNIAN] 兩行輸出：天干={stem_year}；地支欄天干={stem_branch}")
+            row = ["", f"流命四化（{stem_branch}）"]; [row.append(format_hua_tokens(br_cells_map[c]) if br_cells_map[c] else "") for c in cols]; lines.append("| " + " | ".join(row) + " |")
+        if trace.enabled:
+            trace.emit("LIUNIAN.two_lines", "兩行輸出：天干={stem}；地支欄天干={branch_stem}", stem=stem_year, branch_stem=stem_branch)
     else:
         if 'OUTPUT_SWITCH' not in globals() or OUTPUT_SWITCH["LIU_MING_FOUR_HUA"].get("YEAR_STEM_LINE", True):
-            row = ["", f"流命四化（{stem_year}）"]; [row.append("/".join(year_cells_map[c]) if year_cells_map[c] else "") for c in cols]; lines.append("| " + " | ".join(row) + " |")
-        if DEBUG:
-            print(f"DEBUG[LIUNIAN] 合併輸出：天干={stem_year}")
+            row = ["", f"流命四化（{stem_year}）"]; [row.append(format_hua_tokens(year_cells_map[c]) if year_cells_map[c] else "") for c in cols]; lines.append("| " + " | ".join(row) + " |")
+        if trace.enabled:
+            trace.emit("LIUNIAN.merged", "合併輸出：天干={stem}", stem=stem_year)
 
     # 流年 12 宮四化
     for label in PALACE_ORDER_CANONICAL:
@@ -1209,18 +1533,12 @@ def render_markdown_table_v7(data: dict, col_order: list, year_stem: str, raw_te
         cells_map = debug_four_hua_locate(f"流{label}四化", stem, cols, data)
         row = ["", f"流{label}四化（{stem}）"]
         for c in cols:
-            row.append("/".join(cells_map[c]) if cells_map[c] else "")
+            row.append(format_hua_tokens(cells_map[c]) if cells_map[c] else "")
         lines.append("| " + " | ".join(row) + " |")
 
     # 流月 + 流日
     base_idx = liuyue_base_index(cols, data, liu_row)
-    month_stems = LIUYUE_MONTH_STEMS.get(CYEAR)
-    if not month_stems:
-        ystem = year_stem_of_year(CYEAR)
-        start = STEMS.index(ystem) if ystem in STEMS else 0
-        month_stems = [STEMS[(start+i)%10] for i in range(12)]
-        if DEBUG:
-            print(f"DEBUG[LIUYUE] 未提供 {CYEAR} 月干表，改用年干推算：{month_stems}")
+    month_stems = liuyue_month_stems(CYEAR)
 
     for i in range(12):
         m_no = i + 1
@@ -1236,29 +1554,28 @@ def render_markdown_table_v7(data: dict, col_order: list, year_stem: str, raw_te
         if 'OUTPUT_SWITCH' not in globals() or OUTPUT_SWITCH["LIU_YUE"].get("SHOW_HUA_ROW", True):
             m_stem = month_stems[i]
             m_cells_map = debug_four_hua_locate(f"流月{m_no:02d}四化", m_stem, cols, data)
-            row = ["", f"流月四化（{m_stem}）"]; [row.append("/".join(m_cells_map[c]) if m_cells_map[c] else "") for c in cols]; lines.append("| " + " | ".join(row) + " |")
-
-        # 流日（表格模式）
-        if 'OUTPUT_SWITCH' in globals() and OUTPUT_SWITCH.get("LIU_RI", {}).get("ENABLE", False):
-            year_cfg = LIURI_CONFIG.get(CYEAR, {})
-            ri_cfg = year_cfg.get(m_no)
-            if ri_cfg:
-                total_days = ri_cfg.get("days", 0) or 0
-                if total_days > 0:
-                    max_days = OUTPUT_SWITCH["LIU_RI"].get("MAX_DAYS", 0) or total_days
-                    max_days = min(max_days, total_days)
-                    for d in range(1, max_days + 1):
-                        if OUTPUT_SWITCH["LIU_RI"].get("SHOW_PALACE_ROW", True):
-                            day_labels = build_liuri_palace_row_for_day(cols, row_labels, d)
-                            row = [f"流日命（{CYEAR}-{m_no:02d}-{d:02d}）", "宮位"]; [row.append(v) for v in day_labels]; lines.append("| " + " | ".join(row) + " |")
-                        if OUTPUT_SWITCH["LIU_RI"].get("SHOW_HUA_ROW", True):
-                            d_stem = day_stem_for(CYEAR, m_no, d)
-                            if d_stem:
-                                d_cells_map = debug_four_hua_locate(f"流日{m_no:02d}-{d:02d}四化", d_stem, cols, data)
-                                row = ["", f"流日四化（{d_stem}）"]
-                                for c in cols:
-                                    row.append("/".join(d_cells_map[c]) if d_cells_map[c] else "")
-                                lines.append("| " + " | ".join(row) + " |")
+            row = ["", f"流月四化（{m_stem}）"]; [row.append(format_hua_tokens(m_cells_map[c]) if m_cells_map[c] else "") for c in cols]; lines.append("| " + " | ".join(row) + " |")
+
+        # 流日（表格模式；閏月沿用同號月份的流月命，緊接在該月之後）
+        if 'OUTPUT_SWITCH' in globals() and OUTPUT_SWITCH.get("LIU_RI", {}).get("ENABLE", False) and lunar_year_supported(CYEAR):
+            for cal_month, is_leap, total_days, _ in lunar_year_months(CYEAR):
+                if cal_month != m_no:
+                    continue
+                month_tag = f"閏{m_no:02d}" if is_leap else f"{m_no:02d}"
+                max_days = OUTPUT_SWITCH["LIU_RI"].get("MAX_DAYS", 0) or total_days
+                max_days = min(max_days, total_days)
+                for d in range(1, max_days + 1):
+                    if OUTPUT_SWITCH["LIU_RI"].get("SHOW_PALACE_ROW", True):
+                        day_labels = build_liuri_palace_row_for_day(cols, row_labels, d)
+                        row = [f"流日命（{CYEAR}-{month_tag}-{d:02d}）", "宮位"]; [row.append(v) for v in day_labels]; lines.append("| " + " | ".join(row) + " |")
+                    if OUTPUT_SWITCH["LIU_RI"].get("SHOW_HUA_ROW", True):
+                        d_stem = day_stem_for(CYEAR, m_no, d, is_leap)
+                        if d_stem:
+                            d_cells_map = debug_four_hua_locate(f"流日{month_tag}-{d:02d}四化", d_stem, cols, data)
+                            row = ["", f"流日四化（{d_stem}）"]
+                            for c in cols:
+                                row.append(format_hua_tokens(d_cells_map[c]) if d_cells_map[c] else "")
+                            lines.append("| " + " | ".join(row) + " |")
 
     return "\n".join(lines)
 
@@ -1302,18 +1619,17 @@ def helper_format_in_line(
 # ======================= 大限命/財/官/友 摘要 =======================
 
 def render_da_summary(data: dict, col_order: list, year_stem: str, raw_text: str) -> str:
-    da_four, palace_star, big_label_by_col, cols = build_da_four_hua_and_palace_stars(data, col_order, raw_text)
+    da = get_da_layer(data, col_order, raw_text)
+    da_four, palace_star, big_label_by_col, cols = da["four"], da["palace_star"], da["label_by_col"], da["cols"]
+    da_graph = da["graph"]
+    da_io = compute_in_out_all_palaces(da_graph, palace_star, label_prefix="大")
 
-    # === 計算目前所在大限區間與年紀 ===
-    byear = parse_birth_year(raw_text)
-    age = (CYEAR - byear) if byear else "未知"
+    # === 目前所在大限區間與年紀（大限層已算好） ===
+    age = da["age"] if da["age"] is not None else "未知"
     
     daxian_range = ""
-    if isinstance(age, int):
-        # 利用前面已經重排過的 cols，找出 age 所在的大限欄位
-        anchor_col = safe_find_anchor_by_age(data, cols, age)
-        if anchor_col:
-            daxian_range = data.get(anchor_col, {}).get("daxian", "")  # 例如 "0~9"
+    if da["anchor_col"]:
+        daxian_range = data.get(da["anchor_col"], {}).get("daxian", "")  # 例如 "0~9"
 
     lines = []
 
@@ -1325,8 +1641,8 @@ def render_da_summary(data: dict, col_order: list, year_stem: str, raw_text: str
     lines.append(header_age)
     lines.append(header_range)
     
-    res_ming = compute_in_out_for_palace(da_four, palace_star, "命", label_prefix="大")
-    sub_ji_ming = compute_sub_ji_for_palace(da_four, palace_star, "命", label_prefix="大")
+    res_ming = da_io["命"]
+    sub_ji_ming = compute_sub_ji_from_graph(da_graph, palace_star, "命", label_prefix="大")
     stem_ming = da_four.get("命", {}).get("stem", "")
 
     lines.append(f"大命星系 : {palace_star.get('命', '')}")
@@ -1334,7 +1650,7 @@ def render_da_summary(data: dict, col_order: list, year_stem: str, raw_text: str
     lines.append(f"該宮忌出 : {format_entry_list(sub_ji_ming)}")
     if stem_ming:
         hua_ming_parts = resolve_ji_for_stem_chart(stem_ming, cols, big_label_by_col, label_prefix="大")
-        lines.append("化大命忌 : " + "；".join(hua_ming_parts))
+        lines.append("化大命忌 : " + format_hua_placements(hua_ming_parts))
     else:
         lines.append("化大命忌 : ")
     lines.append("")
@@ -1347,14 +1663,14 @@ def render_da_summary(data: dict, col_order: list, year_stem: str, raw_text: str
     da_cai_stars = palace_star.get("財", "")
     is_cai_empty = not has_main_star(da_cai_stars)
     
-    cai_io = compute_in_out_for_palace(da_four, palace_star, "財", label_prefix="大")
+    cai_io = da_io["財"]
     
     # 若為空宮，預先計算對宮(福德)的 IO
     cai_opp_io = None
     if is_cai_empty:
         opp_pal = OPPOSITE_PALACE.get("財") # 福
         if opp_pal:
-            cai_opp_io = compute_in_out_for_palace(da_four, palace_star, opp_pal, label_prefix="大")
+            cai_opp_io = da_io.get(opp_pal)
 
     cai_info = da_four.get("財")
     cai_stem = cai_info["stem"] if cai_info else ""
@@ -1371,7 +1687,7 @@ def render_da_summary(data: dict, col_order: list, year_stem: str, raw_text: str
     
     if cai_stem:
         hua_cai_parts = resolve_ji_for_stem_chart(cai_stem, cols, big_label_by_col, label_prefix="大")
-        lines.append("化大財忌 : " + "；".join(hua_cai_parts))
+        lines.append("化大財忌 : " + format_hua_placements(hua_cai_parts))
     else:
         lines.append("化大財忌 : ")
     lines.append("")
@@ -1384,14 +1700,14 @@ def render_da_summary(data: dict, col_order: list, year_stem: str, raw_text: str
     da_guan_stars = palace_star.get("官", "")
     is_guan_empty = not has_main_star(da_guan_stars)
 
-    guan_io = compute_in_out_for_palace(da_four, palace_star, "官", label_prefix="大")
+    guan_io = da_io["官"]
     
     # 若為空宮，預先計算對宮(夫妻)的 IO
     guan_opp_io = None
     if is_guan_empty:
         opp_pal = OPPOSITE_PALACE.get("官") # 夫
         if opp_pal:
-            guan_opp_io = compute_in_out_for_palace(da_four, palace_star, opp_pal, label_prefix="大")
+            guan_opp_io = da_io.get(opp_pal)
 
     guan_info = da_four.get("官")
     guan_stem = guan_info["stem"] if guan_info else ""
@@ -1408,7 +1724,7 @@ def render_da_summary(data: dict, col_order: list, year_stem: str, raw_text: str
 
     if guan_stem:
         hua_guan_parts = resolve_ji_for_stem_chart(guan_stem, cols, big_label_by_col, label_prefix="大")
-        lines.append("化大官忌 : " + "；".join(hua_guan_parts))
+        lines.append("化大官忌 : " + format_hua_placements(hua_guan_parts))
     else:
         lines.append("化大官忌 : ")
     lines.append("")
@@ -1420,18 +1736,89 @@ def render_da_summary(data: dict, col_order: list, year_stem: str, raw_text: str
     return "\n".join(lines)
 
 
+# ======================= 大限全程（12 個大限一次算完） =======================
+
+DA_TIMELINE_PALACES = ("命", "財", "官", "僕")
+
+def parse_daxian_range(rng: str):
+    """'5~14' → (5, 14)；格式不符回傳 None。"""
+    m = re.match(r"^\s*(\d+)\s*~\s*(\d+)\s*$", rng or "")
+    return (int(m.group(1)), int(m.group(2))) if m else None
+
+def compute_da_timeline(data: dict, col_order: list, raw_text: str, target_year: int = None) -> list:
+    """
+    一生大限全程：命盤上每一個大限欄位都算一次命/財/官/友的入出摘要，依起始歲數排序。
+    每個大限共用 get_da_decade_layer（與 render_da_summary 同一份快取）。
+    回傳 [
+      {'col':大限命所在欄, 'range':'5~14', 'start':5, 'end':14, 'stem':大命宮干,
+       'is_current': target_year 的年紀是否落在此大限（未給 target_year 時為 False）,
+       'palaces': {'命'/'財'/'官'/'僕': {
+            'stars': 星系, 'empty': 是否空宮,
+            'io': 入/出（compute_in_out_from_graph 格式）,
+            'opp_io': 空宮時對宮的入/出，否則 None,
+            'sub_ji': 該宮忌出的子忌,
+            'hua_ji': 化忌（HUA_JI_RESOLVE）落點文字 }}},
+      ...]
+    """
+    cols = chart_cols(data, col_order)
+    byear = chart_birth_year(data, raw_text)
+    age = (target_year - byear) if (byear and target_year) else None
+
+    decades = []
+    for col in cols:
+        bounds = parse_daxian_range(data.get(col, {}).get("daxian", ""))
+        if bounds:
+            decades.append((bounds, col))
+    decades.sort()
+
+    timeline = []
+    for (start, end), col in decades:
+        layer = get_da_decade_layer(data, cols, col)
+        graph, palace_star = layer["graph"], layer["palace_star"]
+        io_all = compute_in_out_all_palaces(graph, palace_star, label_prefix="大")
+
+        palaces = {}
+        for pal in DA_TIMELINE_PALACES:
+            stars = palace_star.get(pal, "")
+            empty = not has_main_star(stars)
+            opp = OPPOSITE_PALACE.get(pal)
+            stem = layer["four"].get(pal, {}).get("stem", "")
+            palaces[pal] = {
+                "stars": stars,
+                "empty": empty,
+                "io": io_all.get(pal, {}),
+                "opp_io": io_all.get(opp) if (empty and opp) else None,
+                "sub_ji": compute_sub_ji_from_graph(graph, palace_star, pal, label_prefix="大"),
+                "hua_ji": resolve_ji_for_stem_chart(stem, cols, layer["label_by_col"], label_prefix="大") if stem else [],
+            }
+
+        timeline.append({
+            "col": col,
+            "range": data[col]["daxian"],
+            "start": start,
+            "end": end,
+            "stem": get_stem_from_col(col),
+            "is_current": age is not None and start <= age <= end,
+            "palaces": palaces,
+        })
+    return timeline
+
 # ======================= 流年命/財/官/友 摘要 =======================
 
 def render_liu_summary(data: dict, col_order: list, year_stem: str, raw_text: str) -> str:
     # 1. 取得標準的宮干資料 (地支干)
-    liu_four_palace, palace_star, flow_label_by_col, cols = build_liu_four_hua_and_palace_stars(data, col_order)
-    da_four, palace_star_big, big_label_by_col, cols2 = build_da_four_hua_and_palace_stars(data, col_order, raw_text)
+    liu = get_liu_layer(data, col_order)
+    liu_four_palace, palace_star, flow_label_by_col, cols = liu["four"], liu["palace_star"], liu["label_by_col"], liu["cols"]
+    # 大限層與大限摘要共用同一份（不重算）
+    da = get_da_layer(data, col_order, raw_text)
+    big_label_by_col = da["label_by_col"]
     
     flow_to_big = build_flow_to_big_map(flow_label_by_col, big_label_by_col, cols)
+    liu_graph = liu["graph"]
+    liu_io = compute_in_out_all_palaces(liu_graph, palace_star, label_prefix="流")
 
-    # === 計算目前所在年紀與流年 ===
-    byear = parse_birth_year(raw_text)
-    age = (CYEAR - byear) if byear else "未知"
+    # === 目前所在年紀與流年 ===
+    age = da["age"] if da["age"] is not None else "未知"
     
     # 定義通用的標頭字串
     header_age = f"目前年紀 : {age}"
@@ -1443,32 +1830,16 @@ def render_liu_summary(data: dict, col_order: list, year_stem: str, raw_text: st
     lines.append(header_age)
     lines.append(header_year)
     
-    # --- 準備「流年干」專用的混合映射表 ---
-    stem_year = year_stem_of_year(CYEAR)
-    liu_four_year_mixed = copy.deepcopy(liu_four_palace)
-    
-    # 找出流命所在的欄位，並用流年干重新計算該宮的四化分佈
-    liu_row = build_liunian_row(cols, CYEAR)
-    target_col_ming = find_col_for_label(cols, liu_row, "命")
-    
-    if target_col_ming:
-         # 計算流年干的四化落點
-         cells_map_year = debug_four_hua_locate(f"流命YearStem({stem_year})", stem_year, cols, data)
-         by_flow_year = {}
-         for c in cols:
-             pal = flow_label_by_col.get(c, "")
-             tokens = cells_map_year.get(c, [])
-             if pal and tokens:
-                 by_flow_year[pal] = list(tokens)
-         
-         # 覆蓋『命』宮的定義為流年干
-         liu_four_year_mixed['命'] = {"stem": stem_year, "by_big": by_flow_year}
+    # --- 「流年干」專用的混合映射表（流命換成流年干，其餘共用流年層） ---
+    year_layer = get_liu_year_stem_layer(data, col_order)
+    stem_year = year_layer["stem"]
 
     # --- 區塊 A：流年干 ---
     lines.append(f"流年干 ({stem_year}) :")
     
-    res_ming_y = compute_in_out_for_palace(liu_four_year_mixed, palace_star, "命", label_prefix="流")
-    sub_ji_ming_y = compute_sub_ji_for_palace(liu_four_year_mixed, palace_star, "命", label_prefix="流")
+    year_mixed_graph = year_layer["graph"]
+    res_ming_y = compute_in_out_from_graph(year_mixed_graph, palace_star, "命", label_prefix="流")
+    sub_ji_ming_y = compute_sub_ji_from_graph(year_mixed_graph, palace_star, "命", label_prefix="流")
     
     lines.append(f"流命星系 : {palace_star.get('命', '')}")
     lines.append(f"流命忌出 : {format_flow_entry_list(res_ming_y.get('忌出', []), flow_to_big)}")
@@ -1477,7 +1848,7 @@ def render_liu_summary(data: dict, col_order: list, year_stem: str, raw_text: st
     # 化流命忌 (流年干版)
     hua_ming_parts_y = resolve_ji_for_stem_chart(stem_year, cols, flow_label_by_col, label_prefix="流")
     hua_ming_parts_y = enhance_ji_with_big(hua_ming_parts_y, flow_to_big)
-    lines.append("化流命忌 : " + ("；".join(hua_ming_parts_y) if hua_ming_parts_y else ""))
+    lines.append("化流命忌 : " + format_hua_placements(hua_ming_parts_y))
     
     lines.append("") # 空行分隔
 
@@ -1485,8 +1856,8 @@ def render_liu_summary(data: dict, col_order: list, year_stem: str, raw_text: st
     stem_ming_palace = liu_four_palace.get("命", {}).get("stem", "")
     lines.append(f"地支干 ({stem_ming_palace}) :")
     
-    res_ming_p = compute_in_out_for_palace(liu_four_palace, palace_star, "命", label_prefix="流")
-    sub_ji_ming_p = compute_sub_ji_for_palace(liu_four_palace, palace_star, "命", label_prefix="流")
+    res_ming_p = liu_io["命"]
+    sub_ji_ming_p = compute_sub_ji_from_graph(liu_graph, palace_star, "命", label_prefix="流")
     
     lines.append(f"流命星系 : {palace_star.get('命', '')}")
     lines.append(f"流命忌出 : {format_flow_entry_list(res_ming_p.get('忌出', []), flow_to_big)}")
@@ -1496,7 +1867,7 @@ def render_liu_summary(data: dict, col_order: list, year_stem: str, raw_text: st
     if stem_ming_palace:
         hua_ming_parts_p = resolve_ji_for_stem_chart(stem_ming_palace, cols, flow_label_by_col, label_prefix="流")
         hua_ming_parts_p = enhance_ji_with_big(hua_ming_parts_p, flow_to_big)
-    lines.append("化流命忌 : " + ("；".join(hua_ming_parts_p) if hua_ming_parts_p else ""))
+    lines.append("化流命忌 : " + format_hua_placements(hua_ming_parts_p))
     
     lines.append("")
     
@@ -1508,14 +1879,14 @@ def render_liu_summary(data: dict, col_order: list, year_stem: str, raw_text: st
     liu_cai_stars = palace_star.get("財", "")
     is_cai_empty = not has_main_star(liu_cai_stars)
 
-    cai_io = compute_in_out_for_palace(liu_four_palace, palace_star, "財", label_prefix="流")
+    cai_io = liu_io["財"]
     
     # 若為空宮，預先計算對宮(流福)的 IO
     cai_opp_io = None
     if is_cai_empty:
         opp_pal = OPPOSITE_PALACE.get("財") # 福
         if opp_pal:
-            cai_opp_io = compute_in_out_for_palace(liu_four_palace, palace_star, opp_pal, label_prefix="流")
+            cai_opp_io = liu_io.get(opp_pal)
 
     cai_info = liu_four_palace.get("財")
     cai_stem = cai_info["stem"] if cai_info else ""
@@ -1533,7 +1904,7 @@ def render_liu_summary(data: dict, col_order: list, year_stem: str, raw_text: st
     if cai_stem:
         hua_cai_parts = resolve_ji_for_stem_chart(cai_stem, cols, flow_label_by_col, label_prefix="流")
         hua_cai_parts = enhance_ji_with_big(hua_cai_parts, flow_to_big)
-        lines.append("化流財忌 : " + "；".join(hua_cai_parts))
+        lines.append("化流財忌 : " + format_hua_placements(hua_cai_parts))
     else:
         lines.append("化流財忌 : ")
     lines.append("")
@@ -1546,14 +1917,14 @@ def render_liu_summary(data: dict, col_order: list, year_stem: str, raw_text: st
     liu_guan_stars = palace_star.get("官", "")
     is_guan_empty = not has_main_star(liu_guan_stars)
 
-    guan_io = compute_in_out_for_palace(liu_four_palace, palace_star, "官", label_prefix="流")
+    guan_io = liu_io["官"]
 
     # 若為空宮，預先計算對宮(流夫)的 IO
     guan_opp_io = None
     if is_guan_empty:
         opp_pal = OPPOSITE_PALACE.get("官") # 夫
         if opp_pal:
-            guan_opp_io = compute_in_out_for_palace(liu_four_palace, palace_star, opp_pal, label_prefix="流")
+            guan_opp_io = liu_io.get(opp_pal)
 
     guan_info = liu_four_palace.get("官")
     guan_stem = guan_info["stem"] if guan_info else ""
@@ -1571,7 +1942,7 @@ def render_liu_summary(data: dict, col_order: list, year_stem: str, raw_text: st
     if guan_stem:
         hua_guan_parts = resolve_ji_for_stem_chart(guan_stem, cols, flow_label_by_col, label_prefix="流")
         hua_guan_parts = enhance_ji_with_big(hua_guan_parts, flow_to_big)
-        lines.append("化流官忌 : " + "；".join(hua_guan_parts))
+        lines.append("化流官忌 : " + format_hua_placements(hua_guan_parts))
     else:
         lines.append("化流官忌 : ")
     lines.append("")
@@ -1590,15 +1961,11 @@ def render_liuyue_ming_qian_fortunes(data: dict, col_order: list, raw_text: str)
       2026年1月 : 本月運勢平穩
       2026年2月 : 太陽祿/月命｜把握機會，順勢而為，好運指數80分
     """
-    cols = reorder_cols_by_palace(data, col_order)
-    liunian_row = build_liunian_row(cols, CYEAR)
+    cols = chart_cols(data, col_order)
+    liunian_row = get_liu_layer(data, col_order)["row"]
     base_idx = liuyue_base_index(cols, data, liunian_row)
 
-    month_stems = LIUYUE_MONTH_STEMS.get(CYEAR)
-    if not month_stems:
-        ystem = year_stem_of_year(CYEAR)
-        start = STEMS.index(ystem) if ystem in STEMS else 0
-        month_stems = [STEMS[(start + i) % 10] for i in range(12)]
+    month_stems = liuyue_month_stems(CYEAR)
 
     lines = []
     for month_no in range(1, 13):
@@ -1616,126 +1983,1261 @@ def render_liuri_ming_qian_fortunes(data: dict, col_order: list, raw_text: str)
     整年流日運勢（每天一行），格式：
       國曆｜農曆 :
       2026.2.17｜2026年1月1日 : 運勢 平，忌時 : 亥時(21:00~23:00)
+    閏月逐日列出，寫成『2025年閏6月1日』；農曆表範圍外的年份回傳空字串。
     """
-    if CYEAR not in LIURI_CONFIG:
+    if not lunar_year_supported(CYEAR):
         return ""
 
-    cols = reorder_cols_by_palace(data, col_order)
-    liunian_row = build_liunian_row(cols, CYEAR)
-    base_idx = liuyue_base_index(cols, data, liunian_row)
-    year_cfg = LIURI_CONFIG[CYEAR]
-    solar_start = LIURI_LUNAR_YEAR_START_SOLAR.get(CYEAR)
+    cols = chart_cols(data, col_order)
+    codes = ri_fortune_year_codes(data, cols, CYEAR)
 
-    lines = []
-    if solar_start is not None:
-        lines.append("國曆｜農曆 :")
+    lines = ["國曆｜農曆 :"]
 
-    day_offset_from_lunar_0101 = 0
     max_days_global = 0
     if 'OUTPUT_SWITCH' in globals():
         max_days_global = OUTPUT_SWITCH.get("LIU_RI", {}).get("MAX_DAYS", 0) or 0
 
-    for month_no in sorted(year_cfg.keys()):
-        cfg = year_cfg[month_no]
-        total_days = cfg.get("days", 0) or 0
-        if total_days <= 0:
-            continue
-
-        liuyue_row = build_liuyue_row_by_month(cols, base_idx, month_no)
+    offset = 0
+    for month_no, is_leap, total_days, solar_start in lunar_year_months(CYEAR):
         days_this_month = total_days
         if max_days_global > 0:
             days_this_month = min(days_this_month, max_days_global)
 
         for day_no in range(1, days_this_month + 1):
-            d_stem = day_stem_for(CYEAR, month_no, day_no)
-            if not d_stem:
-                continue
-            liuri_row = build_liuri_palace_row_for_day(cols, liuyue_row, day_no)
-            day_cells_map = debug_four_hua_locate(f"流日{month_no:02d}-{day_no:02d}四化(運勢)", d_stem, cols, data)
-
-            lunar_line = compute_ri_fortune_for_day(
-                CYEAR, month_no, day_no,
-                cols, liuri_row,
-                d_stem, day_cells_map,
-                data,
-            )
+            g_date = solar_start + timedelta(days=day_no - 1)
+            fortune, hour_branch = decode_ri_fortune(codes[offset + day_no - 1])
+            lunar_line = format_ri_fortune_line(CYEAR, month_no, day_no, fortune, hour_branch, is_leap)
+            lines.append(f"{g_date.year}.{g_date.month}.{g_date.day}｜{lunar_line}")
+        offset += total_days
+
+    return "\n".join(lines)
+
+# ======================= 流日運勢國曆索引（日期查詢） =======================
+# 每天一個 byte：bit0-1 運勢（1 好／2 平／3 差），bit2-5 忌時地支索引（0~11，15 = 無忌時）。
+# 索引以國曆日期連續排列，查某天 O(1)、查區間只掃一段 bytes。
+
+RI_FORTUNE_CODES = ("", "好", "平", "差")
+RI_NO_HOUR = 15
+
+def encode_ri_fortune(fortune: str, hour_branch: str) -> int:
+    hour = ZODIAC.index(hour_branch) if hour_branch in ZODIAC else RI_NO_HOUR
+    return RI_FORTUNE_CODES.index(fortune) | (hour << 2)
+
+def decode_ri_fortune(code: int):
+    """byte → (運勢, 忌時地支)；沒有忌時則地支為空字串。"""
+    hour = code >> 2
+    return RI_FORTUNE_CODES[code & 3], (ZODIAC[hour] if hour < 12 else "")
+
+# byte → 只留運勢位元，供 bytes.translate 後直接 find
+_RI_VERDICT_ONLY = bytes(c & 3 for c in range(256))
+
+def ri_fortune_verdicts(codes) -> bytes:
+    """逐日運勢碼（bytes / bytearray / memoryview）→ 只留運勢位元的 bytes（1 好／2 平／3 差，忌時去掉）。"""
+    return bytes(codes).translate(_RI_VERDICT_ONLY)
+
+def ri_fortune_year_codes(data: dict, cols: list, year: int) -> bytearray:
+    """
+    單一農曆年逐日運勢碼（正月初一起，含閏月），與 CYEAR 無關：
+    流年列直接以 year 推，流月命、日干、查表規則同 render_liuri_ming_qian_fortunes。
+    """
+    def build():
+        base_idx = liuyue_base_index(cols, data, build_liunian_row(cols, year))
+        fortune_table = get_ri_fortune_table(data, cols)
+        months = lunar_year_months(year)
+        year_start = months[0][3]
+        year_end = months[-1][3] + timedelta(days=months[-1][2] - 1)
+        day_ganzhi = ganzhi_range(year_start, year_end)["day"]
+
+        # 閏月沿用同號月份的流月命
+        codes = bytearray()
+        for month_no, is_leap, total_days, solar_start in months:
+            ming_idx = liuyue_ming_branch_index(cols, build_liuyue_row_by_month(cols, base_idx, month_no))
+            offset = (solar_start - year_start).days
+            for day_no in range(1, total_days + 1):
+                d_stem = STEMS[day_ganzhi[offset + day_no - 1] % 10]
+                codes.append(encode_ri_fortune(*fortune_table[(d_stem, liuri_ming_branch(ming_idx, day_no))]))
+        return codes
+    return chart_memo(data, ("ri_fortune_year_codes", tuple(cols), year), build, per_year=False)
+
+def build_ri_fortune_index(data: dict, col_order: list, start_year: int, end_year: int = None) -> dict:
+    """
+    建立農曆 start_year ~ end_year（含）的流日運勢國曆索引：
+      {'start': 第一天國曆 date, 'codes': bytearray（每天一碼）,
+       'lunar': array('L')（每天的農曆日，見 decode_lunar_day）, 'years': (起, 迄)}
+    年份須在農曆表範圍（1900–2100）內。
+    """
+    end_year = start_year if end_year is None else end_year
+    if end_year < start_year or not (lunar_year_supported(start_year) and lunar_year_supported(end_year)):
+        raise ValueError(f"農曆年份 {start_year}~{end_year} 不在支援範圍內")
+
+    cols = chart_cols(data, col_order)
+    codes = bytearray()
+    lunar = array("L")
+    for year in range(start_year, end_year + 1):
+        codes += ri_fortune_year_codes(data, cols, year)
+        y_bits = (year - LUNAR_MIN_YEAR) << 10
+        for month_no, is_leap, total_days, _ in lunar_year_months(year):
+            m_bits = y_bits | (month_no << 6) | (int(is_leap) << 5)
+            lunar.extend(m_bits | day_no for day_no in range(1, total_days + 1))
+
+    return {
+        "start": lunar_year_months(start_year)[0][3],
+        "codes": codes,
+        "lunar": lunar,
+        "years": (start_year, end_year),
+    }
+
+def decode_lunar_day(packed: int):
+    """索引裡的農曆日 → (農曆年, 月, 日, 是否閏月)。"""
+    return (LUNAR_MIN_YEAR + (packed >> 10), (packed >> 6) & 0xF, packed & 0x1F, bool(packed & 0x20))
+
+def _index_offset(index: dict, d) -> int:
+    if isinstance(d, datetime):
+        d = d.date()
+    return (d - index["start"]).days
+
+def fortune_on(index: dict, d):
+    """
+    查國曆某天：回傳 {'date', 'lunar': (年, 月, 日, 閏), 'fortune', 'hour_branch', 'line'}；
+    超出索引範圍回傳 None。
+    """
+    i = _index_offset(index, d)
+    if i < 0 or i >= len(index["codes"]):
+        return None
+    g_date = index["start"] + timedelta(days=i)
+    lunar = decode_lunar_day(index["lunar"][i]) if "lunar" in index else solar_to_lunar(g_date)
+    fortune, hour_branch = decode_ri_fortune(index["codes"][i])
+    lunar_line = format_ri_fortune_line(lunar[0], lunar[1], lunar[2], fortune, hour_branch, lunar[3])
+    return {
+        "date": g_date,
+        "lunar": lunar,
+        "fortune": fortune,
+        "hour_branch": hour_branch,
+        "line": f"{g_date.year}.{g_date.month}.{g_date.day}｜{lunar_line}",
+    }
+
+def fortune_days_between(index: dict, d1, d2, fortune: str = "好") -> list:
+    """國曆 d1 ~ d2（含）之間運勢為 fortune 的所有日期（超出索引的部分自動截掉）。"""
+    n = len(index["codes"])
+    lo = max(_index_offset(index, d1), 0)
+    hi = min(_index_offset(index, d2) + 1, n)
+    if lo >= hi:
+        return []
+    target = bytes([RI_FORTUNE_CODES.index(fortune)])
+    verdicts = ri_fortune_verdicts(index["codes"][lo:hi])   # 只複製查詢區間（mmap 時不整檔讀入）
+    first = index["start"] + timedelta(days=lo)
+    out = []
+    i = verdicts.find(target)
+    while i >= 0:
+        out.append(first + timedelta(days=i))
+        i = verdicts.find(target, i + 1)
+    return out
+
+
+# ======================= 運勢時間軸存檔（多年份、可 mmap） =======================
+# 檔案放在命盤檔旁邊（命盤檔名 + ".zwtl"），格式（little-endian）：
+#   檔頭：magic "ZWTL"、格式版本、ENGINE_RULES_VERSION、起訖農曆年、
+#         第一天國曆序數、天數、月數、命盤文字 SHA-1
+#   日區：每天 1 byte（同流日運勢國曆索引的編碼）
+#   月區：每個流月 2 bytes —— 分數(int8)、型態碼(bit0-3 = YUE_PATTERNS 索引，bit4 = 落在遷)
+# 規則版本或命盤內容不同就視為過期，由 load_fortune_timeline 重算並覆寫。
+
+TIMELINE_MAGIC = b"ZWTL"
+TIMELINE_FORMAT_VERSION = 1
+TIMELINE_SUFFIX = ".zwtl"
+_TIMELINE_HEADER = struct.Struct("<4sHHHHIII20s")
+
+def timeline_path_for(chart_path: str) -> str:
+    return chart_path + TIMELINE_SUFFIX
+
+def chart_text_digest(raw_text: str) -> bytes:
+    return hashlib.sha1(raw_text.strip().encode("utf-8")).digest()
+
+def yue_fortune_year_verdicts(data: dict, cols: list, year: int) -> list:
+    """單一年 12 個流月的 yue_fortune_verdict 結果；與 CYEAR 無關。"""
+    def build():
+        base_idx = liuyue_base_index(cols, data, build_liunian_row(cols, year))
+        out = []
+        for month_no, m_stem in enumerate(liuyue_month_stems(year), 1):
+            liuyue_row = build_liuyue_row_by_month(cols, base_idx, month_no)
+            month_cells_map = debug_four_hua_locate(f"流月{month_no:02d}四化(運勢)", m_stem, cols, data)
+            out.append(yue_fortune_verdict(cols, liuyue_row, month_cells_map))
+        return out
+    return chart_memo(data, ("yue_fortune_year_verdicts", tuple(cols), year), build, per_year=False)
+
+def yue_fortune_year_codes(data: dict, cols: list, year: int) -> bytes:
+    """單一年 12 個流月的 (分數, 型態碼)，共 24 bytes；與 CYEAR 無關。"""
+    def build():
+        out = bytearray()
+        for pattern, score, palace_label, _, _ in yue_fortune_year_verdicts(data, cols, year):
+            out += struct.pack("<bB", score, YUE_PATTERNS.index(pattern) | (0x10 if palace_label == "遷" else 0))
+        return bytes(out)
+    return chart_memo(data, ("yue_fortune_year_codes", tuple(cols), year), build, per_year=False)
+
+def build_fortune_timeline_bytes(data: dict, col_order: list, raw_text: str, start_year: int, end_year: int) -> bytes:
+    """農曆 start_year ~ end_year 的日／月運勢 → 時間軸檔案內容。"""
+    index = build_ri_fortune_index(data, col_order, start_year, end_year)
+    cols = chart_cols(data, col_order)
+    months = b"".join(yue_fortune_year_codes(data, cols, y) for y in range(start_year, end_year + 1))
+    header = _TIMELINE_HEADER.pack(
+        TIMELINE_MAGIC, TIMELINE_FORMAT_VERSION, ENGINE_RULES_VERSION,
+        start_year, end_year, index["start"].toordinal(),
+        len(index["codes"]), len(months) // 2, chart_text_digest(raw_text),
+    )
+    return header + bytes(index["codes"]) + months
+
+def write_fortune_timeline(path: str, input_text: str, start_year: int, end_year: int) -> str:
+    """計算並寫出時間軸（先寫暫存檔再換名，讀取端不會看到半個檔）。"""
+    clear_chart_memo()
+    try:
+        chart = prepare_chart(input_text)
+        blob = build_fortune_timeline_bytes(chart["data"], chart["col_order"], chart["raw"], start_year, end_year)
+    finally:
+        clear_chart_memo()
+    tmp_path = f"{path}.tmp{os.getpid()}"
+    with open(tmp_path, "wb") as f:
+        f.write(blob)
+    os.replace(tmp_path, path)
+    return path
+
+def parse_fortune_timeline(buf, input_text: str = None):
+    """
+    時間軸內容（bytes / mmap）→ {'start', 'codes', 'months', 'years', 'rules_version'}，
+    'codes' / 'months' 是 buf 上的 memoryview（可直接給 fortune_on / fortune_days_between）。
+    格式或規則版本不符、或命盤內容（input_text）已改變 → 回傳 None。
+    """
+    if len(buf) < _TIMELINE_HEADER.size:
+        return None
+    magic, fmt, rules, y0, y1, start_ord, n_days, n_months, digest = _TIMELINE_HEADER.unpack_from(buf, 0)
+    stale = (
+        magic != TIMELINE_MAGIC
+        or fmt != TIMELINE_FORMAT_VERSION
+        or rules != ENGINE_RULES_VERSION
+        or len(buf) != _TIMELINE_HEADER.size + n_days + 2 * n_months
+        or (input_text is not None and digest != chart_text_digest(input_text))
+    )
+    if stale:
+        return None
+
+    view = memoryview(buf)
+    day_off = _TIMELINE_HEADER.size
+    return {
+        "start": datetime.fromordinal(start_ord).date(),
+        "codes": view[day_off:day_off + n_days],
+        "months": view[day_off + n_days:],
+        "years": (y0, y1),
+        "rules_version": rules,
+    }
 
-            if solar_start is not None:
-                g_date = solar_start + timedelta(days=day_offset_from_lunar_0101)
-                solar_str = f"{g_date.year}.{g_date.month}.{g_date.day}"
-                full_line = f"{solar_str}｜{lunar_line}"
+def open_fortune_timeline(path: str, input_text: str = None):
+    """
+    以 mmap 開啟時間軸檔：回傳 parse_fortune_timeline 的結果再加上 'mmap'。
+    檔案不存在、格式或規則版本不符、或命盤內容（input_text）已改變 → 回傳 None。
+    """
+    try:
+        with open(path, "rb") as f:
+            mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    except (OSError, ValueError):
+        return None
+
+    timeline = parse_fortune_timeline(mm, input_text)
+    if timeline is None:
+        mm.close()
+        return None
+    timeline["mmap"] = mm
+    return timeline
+
+def close_fortune_timeline(timeline: dict):
+    for key in ("codes", "months"):
+        timeline[key].release()
+    if "mmap" in timeline:
+        timeline["mmap"].close()
+
+def load_fortune_timeline(chart_path: str, start_year: int, end_year: int) -> dict:
+    """讀命盤檔旁的時間軸；沒有、過期或年份不夠涵蓋就重算後再開啟。"""
+    with open(chart_path, "r", encoding="utf-8") as f:
+        input_text = f.read()
+    path = timeline_path_for(chart_path)
+    timeline = open_fortune_timeline(path, input_text)
+    if timeline is not None:
+        y0, y1 = timeline["years"]
+        if y0 <= start_year and end_year <= y1:
+            return timeline
+        start_year, end_year = min(y0, start_year), max(y1, end_year)
+        close_fortune_timeline(timeline)
+    write_fortune_timeline(path, input_text, start_year, end_year)
+    return open_fortune_timeline(path, input_text)
+
+def timeline_month_fortune(timeline: dict, year: int, month_no: int):
+    """時間軸裡某年某流月 → (型態, 分數, 宮位)；超出範圍回傳 None。"""
+    y0, y1 = timeline["years"]
+    if not (y0 <= year <= y1 and 1 <= month_no <= 12):
+        return None
+    i = ((year - y0) * 12 + month_no - 1) * 2
+    score, code = struct.unpack_from("<bB", timeline["months"], i)
+    pattern = YUE_PATTERNS[code & 0xF]
+    return pattern, score, ("遷" if code & 0x10 else "命") if pattern else ""
+
+# ======================= 各層四化張量（NumPy） =======================
+# tensor[layer, period, palace, hua]：
+#   layer  : FOUR_HUA_LAYERS（本命/大限/流年/流月/流日）
+#   period : 該層第幾期（本命 1 期、大限依起始歲數、流年 1 期、流月 12 期、流日整個農曆年逐日）
+#   palace : 以該期「命」為起點的 12 宮（PALACE_ORDER_CANONICAL：命=0、兄=1…父=11）
+#   hua    : HUA_TYPES（祿=0、權=1、科=2、忌=3）
+# 各期只需要「天干」與「命所在欄」兩個數字，四化落點直接對每天干落點表做 broadcasting。
+
+FOUR_HUA_LAYERS = ("本命", "大限", "流年", "流月", "流日")
+
+def _require_numpy():
+    if np is None:
+        raise ImportError("四化張量需要 numpy，請執行 pip install numpy")
+
+def get_stem_placement_array(data: dict, cols: list):
+    """每天干四化落點表：bool [10 天干, 欄位, 4 四化]（每盤只算一次）。"""
+    _require_numpy()
+    def build():
+        arr = np.zeros((len(STEMS), len(cols), len(HUA_TYPES)), dtype=bool)
+        for si, stem in enumerate(STEMS):
+            cells, _ = locate_four_hua(stem, cols, data)
+            for ci, c in enumerate(cols):
+                for tok in cells.get(c, []):
+                    arr[si, ci, HUA_TYPES.index(tok.hua)] = True
+        return arr
+    return chart_memo(data, ("stem_placement_array", tuple(cols)), build, per_year=False)
+
+def build_four_hua_tensor(data: dict, col_order: list, year_stem: str, raw_text: str, year: int = None) -> dict:
+    """
+    建立某命盤、某目標年（預設今年；不讀全域 CYEAR，可在 render_chart_year 之外呼叫）的各層四化張量。
+    回傳 {
+      'tensor': bool [5, 期數上限, 12, 4]（不足的期補 False）,
+      'layers': FOUR_HUA_LAYERS, 'periods': [[各層各期標籤]], 'counts': [各層期數],
+      'stems': int [5, 期數上限]（天干索引，-1 = 無）, 'anchors': int [5, 期數上限]（命所在欄索引，-1 = 無）,
+      'cols': 欄位, 'year': 目標年, 'day_dates': [流日各期國曆 date] }
+    """
+    _require_numpy()
+    year = year if year is not None else resolve_target_year(current_year())
+    cols = chart_cols(data, col_order)
+    n = len(cols)
+    if n != 12:
+        raise ValueError(f"命盤需有 12 宮才能建立四化張量（目前 {n} 欄）")
+
+    col_index = {c: i for i, c in enumerate(cols)}
+    branch_to_col = np.array([col_index.get(get_col_with_branch(cols, br), -1) for br in ZODIAC])
+
+    def stem_idx(stem):
+        return STEMS.index(stem) if stem in STEMS else -1
+
+    # 本命：生年干、本命命宮
+    natal_col = next((c for c in cols if data.get(c, {}).get("abbr") == "命"), "")
+    natal = ([stem_idx(year_stem)], [col_index.get(natal_col, -1)], ["本命"])
+
+    # 大限：每一個大限欄位（依起始歲數），宮干即大限命干
+    decades = sorted((parse_daxian_range(data[c]["daxian"]), c) for c in cols if parse_daxian_range(data[c]["daxian"]))
+    da = ([stem_idx(get_stem_from_col(c)) for _, c in decades],
+          [col_index[c] for _, c in decades],
+          [data[c]["daxian"] for _, c in decades])
+
+    # 流年：流年干、流年地支所在欄
+    liu_col = get_col_with_branch(cols, zodiac_of_year(year))
+    liu = ([stem_idx(year_stem_of_year(year))], [col_index.get(liu_col, -1)], [str(year)])
+
+    # 流月：12 個月月干、流月命所在欄
+    base_idx = liuyue_base_index(cols, data, build_liunian_row(cols, year))
+    month_stems = liuyue_month_stems(year)
+    yue = ([stem_idx(st) for st in month_stems],
+           [((base_idx - m) % n) if base_idx >= 0 else -1 for m in range(12)],
+           [f"{year}-{m:02d}" for m in range(1, 13)])
+
+    # 流日：整個農曆年逐日（閏月沿用同號月份的流月命）
+    day_stems, day_anchors, day_labels, day_dates = [], [], [], []
+    if lunar_year_supported(year):
+        months = lunar_year_months(year)
+        year_start = months[0][3]
+        year_end = months[-1][3] + timedelta(days=months[-1][2] - 1)
+        day_gz = np.frombuffer(ganzhi_range(year_start, year_end)["day"].tobytes(), dtype=np.uint8)
+        day_stems = list((day_gz % 10).astype(int))
+        for month_no, is_leap, total_days, solar_start in months:
+            ming_idx = liuyue_ming_branch_index(cols, build_liuyue_row_by_month(cols, base_idx, month_no))
+            if ming_idx >= 0:
+                day_anchors.extend(branch_to_col[(ming_idx + np.arange(total_days)) % 12].tolist())
             else:
-                full_line = lunar_line
+                day_anchors.extend([-1] * total_days)
+            tag = f"閏{month_no:02d}" if is_leap else f"{month_no:02d}"
+            day_labels.extend(f"{year}-{tag}-{d:02d}" for d in range(1, total_days + 1))
+            day_dates.extend(solar_start + timedelta(days=d) for d in range(total_days))
+    ri = (day_stems, day_anchors, day_labels)
+
+    per_layer = [natal, da, liu, yue, ri]
+    counts = [len(x[0]) for x in per_layer]
+    p_max = max(counts)
+    stems = np.full((len(per_layer), p_max), -1, dtype=np.int16)
+    anchors = np.full((len(per_layer), p_max), -1, dtype=np.int16)
+    for li, (st, an, _) in enumerate(per_layer):
+        stems[li, :len(st)] = st
+        anchors[li, :len(an)] = an
+
+    placement = get_stem_placement_array(data, cols)                      # [10, 12, 4]
+    col_of = (np.maximum(anchors, 0)[:, :, None] + np.arange(12)) % n     # [L, P, 12]
+    tensor = placement[np.maximum(stems, 0)[:, :, None], col_of, :]       # [L, P, 12, 4]
+    tensor &= ((stems >= 0) & (anchors >= 0))[:, :, None, None]
+
+    return {
+        "tensor": tensor,
+        "layers": FOUR_HUA_LAYERS,
+        "periods": [x[2] for x in per_layer],
+        "counts": counts,
+        "stems": stems,
+        "anchors": anchors,
+        "cols": cols,
+        "year": year,
+        "day_dates": day_dates,
+    }
 
-            lines.append(full_line)
-            day_offset_from_lunar_0101 += 1
+def tensor_hits(ft: dict, hua: str = "忌", palaces=("命", "遷"), layers=None) -> list:
+    """
+    找出「某四化打到指定宮位」的所有期，例如 忌 入 命 或 遷：
+      回傳 [(層名, 期標籤), ...]（依層、期順序）
+    layers 不給則查全部層。
+    """
+    pal_idx = [PALACE_ORDER_CANONICAL.index(p) for p in palaces]
+    hit = ft["tensor"][:, :, pal_idx, HUA_TYPES.index(hua)].any(axis=2)  # [L, P]
+    want = set(layers) if layers else set(ft["layers"])
+    out = []
+    for li, pi in zip(*np.nonzero(hit)):
+        name = ft["layers"][li]
+        if name in want:
+            out.append((name, ft["periods"][li][pi]))
+    return out
 
-    return "\n".join(lines)
+def tensor_layer_counts(ft: dict):
+    """各層在整段期間內，每宮各四化被打到的次數：int [層, 12 宮, 4 四化]。"""
+    return ft["tensor"].sum(axis=1)
+
+# ======================= 多人命盤交互矩陣（NumPy） =======================
+# A 的某宮宮干四化，星曜落在 B 盤的哪一宮：
+#   hits[a, b, 來源宮, 落入宮, 四化] = B 的每天干落點表[A 該宮的天干, 落入宮, 四化]
+# 每張盤只需「12 宮宮干」與「每天干落點表」（get_stem_placement_array，以指紋快取），
+# 整個 N×N 矩陣一次 fancy indexing 算完，不必跑 N² 次引擎。
+
+CROSS_KEY_PALACES = ("命", "財", "官", "遷")
+CROSS_PROFILE_CACHE_MAX = 4096
+
+_CROSS_PROFILES = OrderedDict()
+_CROSS_PROFILES_LOCK = threading.Lock()
+
+def chart_cross_profile(input_text: str):
+    """命盤文字 → (12 宮宮干索引 int8[12]（命=0…父=11，-1 = 缺）, 每天干落點表 bool[10, 12, 4])。"""
+    _require_numpy()
+    fp, chart = get_cached_chart(input_text)
+    with _CROSS_PROFILES_LOCK:
+        hit = _CROSS_PROFILES.get(fp)
+        if hit is not None:
+            _CROSS_PROFILES.move_to_end(fp)
+            return hit
+    cols = chart_cols(chart["data"], chart["col_order"])
+    if len(cols) != 12:
+        raise ValueError(f"命盤需有 12 宮才能計算交互矩陣（目前 {len(cols)} 欄）")
+    try:
+        placement = get_stem_placement_array(chart["data"], cols).copy()
+    finally:
+        clear_chart_memo()
+    stems = np.array([STEMS.index(get_stem_from_col(c)) if get_stem_from_col(c) in STEMS else -1 for c in cols],
+                     dtype=np.int8)
+    profile = (stems, placement)
+    with _CROSS_PROFILES_LOCK:
+        _lru_put(_CROSS_PROFILES, fp, profile, CROSS_PROFILE_CACHE_MAX)
+    return profile
+
+def cross_hua_matrix(charts: list, src_palaces=CROSS_KEY_PALACES, dst_palaces=CROSS_KEY_PALACES,
+                     huas=("祿", "忌")) -> dict:
+    """
+    N 張命盤兩兩之間：a 的 src_palaces 宮干四化（huas）落入 b 的 dst_palaces。
+    charts：[{'id', 'raw'}] 或命盤文字 list。回傳 {
+      'ids', 'src_palaces', 'dst_palaces', 'huas',
+      'counts': uint8 [N, N, 四化]（a→b 命中次數；對角線為 0）,
+      'masks' : uint16 [N, N, 來源宮, 四化]（第 k 位元 = 落入 dst_palaces[k]）,
+      'stems' : int8 [N, 來源宮]（各來源宮天干索引）}
+    """
+    _require_numpy()
+    ids, stems, placements = [], [], []
+    for i, item in enumerate(charts):
+        raw = item["raw"] if isinstance(item, dict) else item
+        ids.append(item.get("id", i) if isinstance(item, dict) else i)
+        st, pl = chart_cross_profile(raw)
+        stems.append(st)
+        placements.append(pl)
+
+    n = len(ids)
+    src_idx = [PALACE_ORDER_CANONICAL.index(p) for p in src_palaces]
+    dst_idx = [PALACE_ORDER_CANONICAL.index(p) for p in dst_palaces]
+    hua_idx = [HUA_TYPES.index(h) for h in huas]
+    if len(dst_idx) > 16:
+        raise ValueError("落入宮最多 16 個")
+
+    src_stems = np.stack(stems)[:, src_idx]                              # [N, S]
+    valid = src_stems >= 0
+    table = np.stack(placements)[:, :, dst_idx][:, :, :, hua_idx]        # [N, 10, D, H]
+    hits = table[np.arange(n)[None, :, None], np.where(valid, src_stems, 0)[:, None, :]]  # [a, b, S, D, H]
+    hits &= valid[:, None, :, None, None]
+    hits[np.arange(n), np.arange(n)] = False
+
+    weights = (1 << np.arange(len(dst_idx), dtype=np.uint16))[:, None]
+    return {
+        "ids": ids,
+        "src_palaces": tuple(src_palaces),
+        "dst_palaces": tuple(dst_palaces),
+        "huas": tuple(huas),
+        "counts": hits.sum(axis=(2, 3), dtype=np.uint8),
+        "masks": (hits * weights).sum(axis=3, dtype=np.uint16),
+        "stems": src_stems,
+    }
 
+def describe_cross_hits(matrix: dict, a: int, b: int) -> list:
+    """矩陣裡 a→b 的命中逐條寫出，例如『命（庚）祿 → 財』。"""
+    out = []
+    for si, src in enumerate(matrix["src_palaces"]):
+        stem = STEMS[matrix["stems"][a, si]] if matrix["stems"][a, si] >= 0 else "?"
+        for hi, hua in enumerate(matrix["huas"]):
+            mask = int(matrix["masks"][a, b, si, hi])
+            for di, dst in enumerate(matrix["dst_palaces"]):
+                if mask >> di & 1:
+                    out.append(f"{src}（{stem}）{hua} → {dst}")
+    return out
 
 # ======================= 主程式：命盤計算入口 =======================
 
-def run_chart_from_text(input_text: str, target_year: int = 2026) -> str:
+def resolve_target_year(target_year) -> int:
+    """農曆表範圍內（1900–2100）的目標年照用，其餘退回今年。"""
+    if isinstance(target_year, int) and lunar_year_supported(target_year):
+        return target_year
+    return current_year()
+
+def check_target_year(target_year) -> int:
+    """新 API 用：目標年需為農曆表範圍內（1900–2100）的整數，否則 ValueError（不偷換成今年）。"""
+    if isinstance(target_year, bool) or not isinstance(target_year, int) or not lunar_year_supported(target_year):
+        raise ValueError(f"不支援的目標年：{target_year!r}（需為 {LUNAR_MIN_YEAR}~{LUNAR_MAX_YEAR} 的整數）")
+    return target_year
+
+def prepare_chart(input_text: str) -> dict:
+    """解析一次命盤文字，回傳與流年無關、可跨年份共用的內容。"""
+    with trace.span("stage.parse"):
+        data, col_order, year_stem = parse_chart(input_text)
+    return {"raw": input_text, "data": data, "col_order": col_order, "year_stem": year_stem}
+
+def require_complete_chart(chart: dict) -> dict:
     """
-    接收一整段命盤文字（RAW 格式），跑完所有計算，
-    回傳整段輸出（包含表格 + 摘要）。
+    已解析命盤需有 12 宮與生年干，否則 ValueError。
+    解析不出來的盤算出來的運勢碼全是 0，擇日、行事曆會把它當成「不差」，所以先擋掉。
+    """
+    if len(chart["col_order"]) != 12 or not chart["year_stem"]:
+        raise ValueError(f"命盤不完整（{len(chart['col_order'])} 宮，生年干={chart['year_stem'] or '無'}）")
+    return chart
+
+def render_chart_year(chart: dict, target_year: int) -> str:
+    """
+    對已解析的命盤跑某一目標年的全部計算，回傳整段輸出（包含表格 + 摘要）。
+    與年份無關的結構（欄位重排、各天干四化落點、流日運勢表、各大限層）
+    透過 chart_memo 在多個年份間共用。
     """
     global CYEAR, OUTPUT_SWITCH
 
+    RAW = chart["raw"]
+    data, col_order, year_stem = chart["data"], chart["col_order"], chart["year_stem"]
+
     buf = io.StringIO()
-    with contextlib.redirect_stdout(buf):
-        RAW = input_text
-
-        data, col_order, year_stem = parse_chart(RAW)
-
-        TARGET_YEAR = target_year
-        CYEAR = TARGET_YEAR if TARGET_YEAR in (2025, 2026) else current_year()
-
-        OUTPUT_SWITCH = {
-            "DA_FOUR_HUA": {lbl: True for lbl in PALACE_ORDER_CANONICAL},
-            "LIU_MING_FOUR_HUA": {
-                "YEAR_STEM_LINE": True,
-                "BRANCH_STEM_LINE": True
-            },
-            "LIU_FOUR_HUA": {lbl: True for lbl in PALACE_ORDER_CANONICAL},
-            "LIU_YUE": {
-                "MONTHS": list(range(1, 13)),
-                "SHOW_PALACE_ROW": True,
-                "SHOW_HUA_ROW": True
-            },
-            "LIU_RI": {
-                "ENABLE": True,
-                "MAX_DAYS": 0,
-                "SHOW_PALACE_ROW": True,
-                "SHOW_HUA_ROW": True
+    debug_sink = trace.add_sink(trace.PrintSink(exclude=("MEMO.", "stage."))) if DEBUG else None
+    try:
+        with contextlib.redirect_stdout(buf), trace.span("stage.year", year=target_year):
+            CYEAR = resolve_target_year(target_year)
+
+            OUTPUT_SWITCH = {
+                "DA_FOUR_HUA": {lbl: True for lbl in PALACE_ORDER_CANONICAL},
+                "LIU_MING_FOUR_HUA": {
+                    "YEAR_STEM_LINE": True,
+                    "BRANCH_STEM_LINE": True
+                },
+                "LIU_FOUR_HUA": {lbl: True for lbl in PALACE_ORDER_CANONICAL},
+                "LIU_YUE": {
+                    "MONTHS": list(range(1, 13)),
+                    "SHOW_PALACE_ROW": True,
+                    "SHOW_HUA_ROW": True
+                },
+                "LIU_RI": {
+                    "ENABLE": True,
+                    "MAX_DAYS": 0,
+                    "SHOW_PALACE_ROW": True,
+                    "SHOW_HUA_ROW": True
+                }
             }
-        }
 
-        table = render_markdown_table_v7(data, col_order, year_stem, RAW)
-        liuyue_summary = render_liuyue_ming_qian_fortunes(data, col_order, RAW)
+            with trace.span("stage.v7_table"):
+                table = render_markdown_table_v7(data, col_order, year_stem, RAW)
+            with trace.span("stage.liuyue"):
+                liuyue_summary = render_liuyue_ming_qian_fortunes(data, col_order, RAW)
 
 
-        print("\n==== 大限命/財/官/友 摘要 ====\n")
-        da_summary = render_da_summary(data, col_order, year_stem, RAW)
-        print(da_summary)
+            print("\n==== 大限命/財/官/友 摘要 ====\n")
+            with trace.span("stage.da_summary"):
+                da_summary = render_da_summary(data, col_order, year_stem, RAW)
+            print(da_summary)
 
-        print("==== 流年命/財/官/友 摘要 ====\n")
-        liu_summary = render_liu_summary(data, col_order, year_stem, RAW)
-        print(liu_summary)
-        liuri_summary = render_liuri_ming_qian_fortunes(data, col_order, RAW)
+            print("==== 流年命/財/官/友 摘要 ====\n")
+            with trace.span("stage.liu_summary"):
+                liu_summary = render_liu_summary(data, col_order, year_stem, RAW)
+            print(liu_summary)
+            with trace.span("stage.liuri"):
+                liuri_summary = render_liuri_ming_qian_fortunes(data, col_order, RAW)
 
-        print("\n==== 流月命/遷 運勢 ====\n")
-        print(liuyue_summary)
+            print("\n==== 流月命/遷 運勢 ====\n")
+            print(liuyue_summary)
 
-        print("\n==== 流日命/遷 運勢 ====\n")
-        print(liuri_summary)
+            print("\n==== 流日命/遷 運勢 ====\n")
+            print(liuri_summary)
 
-        #print(f"\n==== 本次輸出年份：{CYEAR} ====\n")
-        #print(table)
+            #print(f"\n==== 本次輸出年份：{CYEAR} ====\n")
+            #print(table)
+    finally:
+        if debug_sink is not None:
+            trace.remove_sink(debug_sink)
 
     result_str = buf.getvalue()
     return result_str if result_str.strip() else "沒有輸出內容，請檢查命盤格式或程式流程。"
 
+def run_chart_from_text(input_text: str, target_year: int = 2026) -> str:
+    """
+    接收一整段命盤文字（RAW 格式），跑完所有計算，
+    回傳整段輸出（包含表格 + 摘要）。
+    target_year 超出農曆表範圍（1900–2100）時改用今年。
+    """
+    clear_chart_memo()
+    try:
+        return render_chart_year(prepare_chart(input_text), target_year)
+    finally:
+        clear_chart_memo()
+
+def build_fortune_index_from_text(input_text: str, start_year: int, end_year: int = None) -> dict:
+    """命盤文字 → 流日運勢國曆索引（見 build_ri_fortune_index）。"""
+    clear_chart_memo()
+    try:
+        chart = prepare_chart(input_text)
+        return build_ri_fortune_index(chart["data"], chart["col_order"], start_year, end_year)
+    finally:
+        clear_chart_memo()
+
+def run_chart_range_from_text(input_text: str, target_years) -> dict:
+    """
+    同一張命盤、多個目標年：只解析一次，與年份無關的結構跨年共用。
+      回傳 {目標年: 該年完整輸出}（key 為呼叫端傳入的年份，順序不變）
+    任一年份不在農曆表範圍內 → ValueError（開始計算前就檢查）。
+    例：run_chart_range_from_text(raw, range(2026, 2036)) 一次排出十年。
+    """
+    target_years = [check_target_year(y) for y in target_years]
+    clear_chart_memo()
+    try:
+        chart = prepare_chart(input_text)
+        return {year: render_chart_year(chart, year) for year in target_years}
+    finally:
+        clear_chart_memo()
+
+# ======================= v7 表格欄式匯出（CSV / Parquet） =======================
+# render_markdown_table_v7 的同一份資料，改成「一期 × 一個四化來源 × 一欄」一列的長表：
+#   layer  : 本命 / 大限 / 流年 / 流月 / 流日
+#   period : 本命空白、大限區間、流年 2026、流月 2026-03、流日 2026-閏06-15
+#   source : 這組四化從哪裡來（生年、大命…大父、流年干、流年支宮干、流命…流父、流月、流日）
+#   palace : 該層在此欄的宮位（大限命列、流年命列、流月命列、流日命列；本命為本命宮位）
+#   lu / quan / ke / ji : 該天干化祿／權／科／忌落在此欄的星曜（多顆以 / 分隔）
+#   main / aux / mini / daxian : 只有本命列才填
+# 只計算 layers 指定的層；不經過 Markdown 字串，逐列 yield、分批寫出。
+
+V7_LAYERS = ("本命", "大限", "流年", "流月", "流日")
+V7_COLUMNS = ("chart_id", "year", "layer", "period", "solar_date", "source", "stem", "col", "palace",
+              "lu", "quan", "ke", "ji", "main", "aux", "mini", "daxian")
+V7_HUA_COLUMNS = ("lu", "quan", "ke", "ji")
+
+def _require_pyarrow():
+    if pa is None:
+        raise ImportError("匯出 Parquet 需要 pyarrow，請執行 pip install pyarrow")
+
+def iter_v7_rows(chart: dict, target_year: int, layers=V7_LAYERS, chart_id: str = "", with_hua: bool = True):
+    """
+    已解析命盤（prepare_chart）+ 目標年 → 逐列 yield tuple（欄位順序同 V7_COLUMNS）。
+    with_hua=False 時不定位四化（只要宮位欄時更快）。計算期間暫時切換 CYEAR。
+    """
+    global CYEAR
+    data, col_order, year_stem, raw = chart["data"], chart["col_order"], chart["year_stem"], chart["raw"]
+    want = set(layers)
+    unknown = want - set(V7_LAYERS)
+    if unknown:
+        raise ValueError(f"未知的層：{'、'.join(sorted(unknown))}")
+
+    saved_year = CYEAR
+    CYEAR = year = resolve_target_year(target_year)
+    try:
+        cols = chart_cols(data, col_order)
+        hua_by_stem = {}
+
+        def hua_cells(stem):
+            """天干 → {欄: (祿, 權, 科, 忌)}（每盤每天干只整理一次）。"""
+            hit = hua_by_stem.get(stem)
+            if hit is None:
+                cells = locate_four_hua(stem, cols, data)[0] if with_hua and stem in YEAR_HUA else {}
+                hit = hua_by_stem[stem] = {
+                    c: tuple("/".join(t.star for t in cells.get(c, []) if t.hua == h) for h in HUA_TYPES) for c in cols
+                }
+            return hit
+
+        def rows(layer, period, solar_date, source, stem, labels, natal=False):
+            cells = hua_cells(stem)
+            for i, c in enumerate(cols):
+                d = data[c]
+                extra = ("/".join(d["main"]), "/".join(d["aux"]), "/".join(d["mini"]), d["daxian"]) if natal else ("", "", "", "")
+                yield (chart_id, year, layer, period, solar_date, source, stem, c, labels[i]) + cells[c] + extra
+
+        if "本命" in want:
+            yield from rows("本命", "", None, "生年", year_stem, [data[c]["abbr"] for c in cols], natal=True)
+
+        if "大限" in want:
+            da = get_da_layer(data, col_order, raw)
+            ming_line = da["row"]
+            period = data[da["anchor_col"]]["daxian"] if da["anchor_col"] else ""
+            for label in PALACE_ORDER_CANONICAL:
+                stem = get_stem_from_col(find_col_for_label(cols, ming_line, label))
+                yield from rows("大限", period, None, f"大{label}", stem, ming_line)
+
+        need_liu = want & {"流年", "流月", "流日"}
+        liu_row = get_liu_layer(data, col_order)["row"] if need_liu else []
+        if "流年" in want:
+            period = str(year)
+            stem_year = year_stem_of_year(year)
+            yield from rows("流年", period, None, "流年干", stem_year, liu_row)
+            stem_branch = get_stem_from_col(get_col_with_branch(cols, zodiac_of_year(year)))
+            if stem_branch and stem_branch != stem_year:
+                yield from rows("流年", period, None, "流年支宮干", stem_branch, liu_row)
+            for label in PALACE_ORDER_CANONICAL:
+                stem = get_stem_from_col(find_col_for_label(cols, liu_row, label))
+                yield from rows("流年", period, None, f"流{label}", stem, liu_row)
+
+        if want & {"流月", "流日"}:
+            base_idx = liuyue_base_index(cols, data, liu_row)
+            month_stems = liuyue_month_stems(year)
+            months = lunar_year_months(year) if lunar_year_supported(year) else []
+            for m_no in range(1, 13):
+                row_labels = build_liuyue_row_by_month(cols, base_idx, m_no)
+                if "流月" in want:
+                    yield from rows("流月", f"{year}-{m_no:02d}", None, "流月", month_stems[m_no - 1], row_labels)
+                if "流日" not in want:
+                    continue
+                for cal_month, is_leap, total_days, solar_start in months:
+                    if cal_month != m_no:
+                        continue
+                    month_tag = f"閏{m_no:02d}" if is_leap else f"{m_no:02d}"
+                    for d in range(1, total_days + 1):
+                        yield from rows("流日", f"{year}-{month_tag}-{d:02d}", solar_start + timedelta(days=d - 1), "流日",
+                                        day_stem_for(year, m_no, d, is_leap), build_liuri_palace_row_for_day(cols, row_labels, d))
+    finally:
+        CYEAR = saved_year
+
+def iter_v7_export_rows(items, layers=V7_LAYERS, with_hua: bool = True):
+    """
+    多張命盤、多個目標年：items 為 [{'id', 'raw', 'years'}]（可為 generator），
+    每張只解析一次，逐列 yield；每張算完清掉每盤快取，記憶體只跟一張盤有關。
+    """
+    for item in items:
+        chart = prepare_chart(item["raw"])
+        try:
+            for year in item["years"]:
+                yield from iter_v7_rows(chart, year, layers, str(item.get("id", "")), with_hua)
+        finally:
+            clear_chart_memo()
+
+def _v7_projection(columns):
+    columns = tuple(columns or V7_COLUMNS)
+    unknown = [c for c in columns if c not in V7_COLUMNS]
+    if unknown:
+        raise ValueError(f"未知的欄位：{'、'.join(unknown)}")
+    return columns, [V7_COLUMNS.index(c) for c in columns]
+
+def write_v7_csv(rows, f, columns=None, header: bool = True) -> int:
+    """逐列寫出 CSV（f 為以 newline='' 開啟的文字檔），回傳列數。"""
+    import csv
+    columns, idx = _v7_projection(columns)
+    writer = csv.writer(f)
+    if header:
+        writer.writerow(columns)
+    n = 0
+    for row in rows:
+        writer.writerow([row[i].isoformat() if i == 4 and row[i] else row[i] for i in idx])
+        n += 1
+    return n
+
+def write_v7_parquet(rows, path: str, columns=None, batch_rows: int = 65536) -> int:
+    """分批寫出 Parquet（需 pyarrow）：year 為 int16、solar_date 為 date32，其餘為字串。回傳列數。"""
+    _require_pyarrow()
+    columns, idx = _v7_projection(columns)
+    types = {"year": pa.int16(), "solar_date": pa.date32()}
+    schema = pa.schema([(c, types.get(c, pa.string())) for c in columns])
+
+    def to_table(batch):
+        return pa.Table.from_arrays([pa.array(vals, type=field.type) for vals, field in zip(batch, schema)], schema=schema)
+
+    n = 0
+    with pq.ParquetWriter(path, schema) as writer:
+        batch = [[] for _ in columns]
+        for row in rows:
+            for k, i in enumerate(idx):
+                batch[k].append(row[i])
+            n += 1
+            if len(batch[0]) >= batch_rows:
+                writer.write_table(to_table(batch))
+                batch = [[] for _ in columns]
+        if batch[0]:
+            writer.write_table(to_table(batch))
+    return n
+
+# ======================= 批次計算（多行程） =======================
+# 引擎用了 CYEAR / OUTPUT_SWITCH 等模組全域變數，同一行程內不能平行跑，
+# 所以批次一律用行程池：每個工作單位是一張命盤 + 若干目標年（只解析一次）。
+
+def run_chart_job(job: dict) -> list:
+    """
+    行程池的工作單位：job = {'id': 識別字, 'raw': 命盤文字, 'years': [目標年, ...]}
+    回傳每個目標年一筆：
+      {'id', 'year', 'ok': True, 'output': 整段輸出, 'elapsed_ms'}
+      {'id', 'year', 'ok': False, 'error': 錯誤訊息, 'elapsed_ms'}
+    """
+    t0 = time.perf_counter()
+    years = list(job.get("years") or [current_year()])
+    try:
+        outputs = run_chart_range_from_text(job["raw"], years)
+    except Exception as e:
+        ms = round((time.perf_counter() - t0) * 1000, 1)
+        return [{"id": job.get("id"), "year": y, "ok": False, "error": f"{type(e).__name__}: {e}", "elapsed_ms": ms}
+                for y in years]
+    ms = round((time.perf_counter() - t0) * 1000 / max(len(years), 1), 1)
+    return [{"id": job.get("id"), "year": y, "ok": True, "output": outputs[y], "elapsed_ms": ms} for y in years]
+
+def default_worker_count() -> int:
+    return max(os.cpu_count() or 1, 1)
+
+def iter_chart_jobs(jobs, workers: int = None, max_pending: int = None, pool=None, fn=run_chart_job,
+                    on_broken=None):
+    """
+    依「完成順序」逐一 yield run_chart_job 的結果（每張命盤一個 list）。
+      workers    : 行程數，預設 CPU 核心數；1 表示在目前行程依序計算
+      max_pending: 同時送進行程池的工作上限（預設 workers*4），jobs 可以是很長的 generator
+      pool       : 共用既有的行程池（例如網頁服務常駐的池）；不給則自建、用完關閉
+      fn         : 工作函式（須為模組層級函式才能送進行程池），預設 run_chart_job
+      on_broken  : on_broken(job, exc) → 代替結果；子行程異常結束（例如被 OOM 砍掉）使池子壞掉時，
+                   之後每個工作都改 yield 這個值而不是拋出 BrokenProcessPool
+    """
+    workers = workers or default_worker_count()
+    if pool is None and workers <= 1:
+        for job in jobs:
+            yield fn(job)
+        return
+
+    if pool is None:
+        with ProcessPoolExecutor(max_workers=workers) as own_pool:
+            yield from _iter_pool_jobs(own_pool, jobs, max_pending or workers * 4, fn, on_broken)
+    else:
+        yield from _iter_pool_jobs(pool, jobs, max_pending or workers * 4, fn, on_broken)
+
+def _iter_pool_jobs(pool, jobs, max_pending: int, fn=run_chart_job, on_broken=None):
+    job_iter = iter(jobs)
+    pending = {}  # future → job
+    exhausted = False
+    try:
+        while True:
+            while not exhausted and len(pending) < max_pending:
+                job = next(job_iter, None)
+                if job is None:
+                    exhausted = True
+                    break
+                try:
+                    pending[pool.submit(fn, job)] = job
+                except BrokenProcessPool as e:
+                    if on_broken is None:
+                        raise
+                    yield on_broken(job, e)
+            if not pending:
+                return
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for fut in done:
+                job = pending.pop(fut)
+                try:
+                    result = fut.result()
+                except BrokenProcessPool as e:
+                    if on_broken is None:
+                        raise
+                    result = on_broken(job, e)
+                yield result
+    finally:
+        # 呼叫端中途放棄（例如網頁連線中斷）時，尚未開始的工作直接取消
+        for fut in pending:
+            fut.cancel()
+
+# ======================= 網頁快取（同一張命盤重複貼上） =======================
+# 指紋取自「解析後」的內容（欄序、各宮資料、生年干、出生年），
+# 所以多貼空白、換行方式不同、星曜分隔符號不同都會得到同一個指紋。
+#   - 原文 SHA-1 → 指紋：完全相同的貼上連解析都省掉
+#   - 指紋 → 已解析命盤：換年份只需重跑計算
+#   - (指紋, 目標年) → 整段輸出：同一張盤同一年直接回傳
+# 三者都是 LRU；輸出快取另以總字元組數設上限。
+
+CHART_CACHE_MAX_CHARTS = 256
+RESULT_CACHE_MAX_BYTES = 64 * 1024 * 1024
+
+_WEB_CACHE_LOCK = threading.Lock()
+_RAW_TO_FINGERPRINT = OrderedDict()
+_PARSED_CHARTS = OrderedDict()
+_RESULTS = OrderedDict()
+_WEB_CACHE_STATS = {"result_bytes": 0, "hits": 0, "misses": 0, "parses": 0}
+
+def chart_fingerprint(chart: dict) -> str:
+    """已解析命盤 → 正規化後的 SHA-256（與原文排版無關）。"""
+    data, col_order = chart["data"], chart["col_order"]
+    canonical = {
+        "cols": col_order,
+        "cells": [[data[c][k] for k in ("palace", "abbr", "daxian", "main", "aux", "mini")] for c in col_order],
+        "year_stem": chart["year_stem"],
+        "birth_year": parse_birth_year(chart["raw"]),
+    }
+    blob = json.dumps(canonical, ensure_ascii=False, separators=(",", ":"))
+    return hashlib.sha256(blob.encode("utf-8")).hexdigest()
+
+def _lru_put(cache: OrderedDict, key, value, max_items: int):
+    cache[key] = value
+    cache.move_to_end(key)
+    while len(cache) > max_items:
+        cache.popitem(last=False)
+
+def get_cached_chart(input_text: str):
+    """回傳 (指紋, 已解析命盤)；同一張盤只解析一次。"""
+    raw_key = hashlib.sha1(input_text.encode("utf-8")).digest()
+    with _WEB_CACHE_LOCK:
+        fp = _RAW_TO_FINGERPRINT.get(raw_key)
+        if fp is not None and fp in _PARSED_CHARTS:
+            _RAW_TO_FINGERPRINT.move_to_end(raw_key)
+            _PARSED_CHARTS.move_to_end(fp)
+            return fp, _PARSED_CHARTS[fp]
+
+    chart = prepare_chart(input_text)
+    fp = chart_fingerprint(chart)
+    with _WEB_CACHE_LOCK:
+        _WEB_CACHE_STATS["parses"] += 1
+        chart = _PARSED_CHARTS.get(fp, chart)   # 排版不同的同一張盤：沿用先前那份
+        _lru_put(_PARSED_CHARTS, fp, chart, CHART_CACHE_MAX_CHARTS)
+        _lru_put(_RAW_TO_FINGERPRINT, raw_key, fp, CHART_CACHE_MAX_CHARTS * 4)
+    return fp, chart
+
+def run_chart_cached(input_text: str, target_year: int = 2026) -> str:
+    """run_chart_from_text 的快取版：同一張盤、同一年直接回傳上次的輸出。"""
+    fp, chart = get_cached_chart(input_text)
+    key = (fp, resolve_target_year(target_year))
+    with _WEB_CACHE_LOCK:
+        hit = _RESULTS.get(key)
+        if hit is not None:
+            _RESULTS.move_to_end(key)
+            _WEB_CACHE_STATS["hits"] += 1
+            return hit
+
+    clear_chart_memo()
+    try:
+        result = render_chart_year(chart, key[1])
+    finally:
+        clear_chart_memo()
+
+    size = len(result.encode("utf-8"))
+    with _WEB_CACHE_LOCK:
+        _WEB_CACHE_STATS["misses"] += 1
+        if size <= RESULT_CACHE_MAX_BYTES and key not in _RESULTS:
+            _RESULTS[key] = result
+            _WEB_CACHE_STATS["result_bytes"] += size
+            while _WEB_CACHE_STATS["result_bytes"] > RESULT_CACHE_MAX_BYTES:
+                _, old = _RESULTS.popitem(last=False)
+                _WEB_CACHE_STATS["result_bytes"] -= len(old.encode("utf-8"))
+    return result
+
+def chart_cache_stats() -> dict:
+    with _WEB_CACHE_LOCK:
+        return {**_WEB_CACHE_STATS, "charts": len(_PARSED_CHARTS), "results": len(_RESULTS)}
+
+def clear_chart_cache():
+    with _WEB_CACHE_LOCK:
+        _RAW_TO_FINGERPRINT.clear()
+        _PARSED_CHARTS.clear()
+        _RESULTS.clear()
+        _WEB_CACHE_STATS.update(result_bytes=0, hits=0, misses=0, parses=0)
+    with _GROUP_CODES_LOCK:
+        _GROUP_CODES.clear()
+    with _CROSS_PROFILES_LOCK:
+        _CROSS_PROFILES.clear()
+
+# ======================= 群組擇日（多張命盤共同的好日子） =======================
+# 每張命盤的逐日運勢碼以 (指紋, 農曆年) 快取，同一人出現在不同群組只算一次。
+# 區間內每人的「差」「好」各轉成一個 int 點陣圖（第 i 位元 = 區間第 i 天），
+# 全員不差 = 各人 ~差 的 AND；容許 k 人差時改用逐位元計數器（幾個 int 的 XOR/AND）。
+# 只有留下來的日子才逐一看好／平人數與忌時重疊來排序。
+
+GROUP_MAX_CHARTS = 50
+GROUP_MAX_DAYS = 366 * 3
+GROUP_CODES_CACHE_MAX = 4096
+
+_GROUP_CODES = OrderedDict()
+_GROUP_CODES_LOCK = threading.Lock()
+
+# 運勢碼 → b"0" / b"1"，translate 後直接 int(..., 2) 成點陣圖
+_RI_IS_BAD = bytes(48 + ((c & 3) == 3) for c in range(256))
+_RI_IS_GOOD = bytes(48 + ((c & 3) == 1) for c in range(256))
+
+def _day_bits(codes: bytes, table: bytes) -> int:
+    """逐日碼 → 點陣圖（第 i 位元對應第 i 天）。"""
+    return int(codes.translate(table)[::-1] or b"0", 2)
+
+def _bit_positions(bits: int) -> list:
+    text = bin(bits)[:1:-1]
+    return [i for i, ch in enumerate(text) if ch == "1"]
+
+def _bit_count_add(planes: list, bits: int):
+    """逐位元計數器（planes[k] = 各天計數的第 k 個二進位位元）加上一個點陣圖。"""
+    carry = bits
+    for k in range(len(planes)):
+        if not carry:
+            return
+        planes[k], carry = planes[k] ^ carry, planes[k] & carry
+    if carry:
+        planes.append(carry)
+
+def _bit_count_at_most(planes: list, limit: int, mask: int) -> int:
+    """計數 <= limit 的日子（點陣圖）。"""
+    lt, eq = 0, mask
+    for k in range(max(len(planes), limit.bit_length()) - 1, -1, -1):
+        plane = planes[k] if k < len(planes) else 0
+        if limit >> k & 1:
+            lt |= eq & ~plane
+            eq &= plane
+        else:
+            eq &= ~plane
+    return (lt | eq) & mask
+
+def chart_day_codes(input_text: str, d1, d2) -> bytes:
+    """
+    命盤文字 → 國曆 d1 ~ d2（含）逐日運勢碼（編碼同流日運勢國曆索引）。
+    命盤需有 12 宮與生年干，否則 ValueError（見 require_complete_chart）。
+    """
+    y_lo, y_hi = solar_to_lunar(d1)[0], solar_to_lunar(d2)[0]
+    fp, chart = get_cached_chart(input_text)
+    require_complete_chart(chart)
+    parts = []
+    for year in range(y_lo, y_hi + 1):
+        key = (fp, year)
+        with _GROUP_CODES_LOCK:
+            codes = _GROUP_CODES.get(key)
+            if codes is not None:
+                _GROUP_CODES.move_to_end(key)
+        if codes is None:
+            try:
+                codes = bytes(ri_fortune_year_codes(chart["data"], chart_cols(chart["data"], chart["col_order"]), year))
+            finally:
+                clear_chart_memo()
+            with _GROUP_CODES_LOCK:
+                _lru_put(_GROUP_CODES, key, codes, GROUP_CODES_CACHE_MAX)
+        parts.append(codes)
+    offset = (d1 - lunar_year_months(y_lo)[0][3]).days
+    return b"".join(parts)[offset:offset + (d2 - d1).days + 1]
+
+def group_good_days(charts: list, d1, d2, top: int = 20, require_good: bool = False, max_bad: int = 0) -> dict:
+    """
+    找國曆 d1 ~ d2 之間「運勢差的人不超過 max_bad 個」的日子（require_good=True 則其餘人都要是好），並排序：
+      差的人數少者優先 → 好的人數多者優先 → 忌時涵蓋的時辰少者優先（大家的忌時重疊越多，可用時辰越多）
+      → 日期早者優先。
+    charts：[{'id', 'raw'}] 或命盤文字 list。
+    回傳 {'start', 'end', 'members', 'candidates': 符合的天數, 'dates': [前 top 名]}，
+    每個日子為 {'date', 'lunar', 'good', 'neutral', 'bad', 'ji_hours', 'free_hours', 'verdicts': {id: 好/平/差}}。
+    """
+    if isinstance(d1, datetime):
+        d1 = d1.date()
+    if isinstance(d2, datetime):
+        d2 = d2.date()
+    n_days = (d2 - d1).days + 1
+    if n_days <= 0:
+        raise ValueError("結束日期需晚於開始日期")
+    if n_days > GROUP_MAX_DAYS:
+        raise ValueError(f"日期區間最多 {GROUP_MAX_DAYS} 天")
+    if not charts or len(charts) > GROUP_MAX_CHARTS:
+        raise ValueError(f"需要 1~{GROUP_MAX_CHARTS} 張命盤")
+
+    ids, member_codes = [], []
+    all_days = (1 << n_days) - 1
+    ok_bits = all_days
+    bad_planes = []
+    for i, item in enumerate(charts):
+        raw = item["raw"] if isinstance(item, dict) else item
+        ids.append(item.get("id", i) if isinstance(item, dict) else i)
+        try:
+            codes = chart_day_codes(raw, d1, d2)
+        except ValueError as e:
+            raise ValueError(f"{ids[-1]}：{e}") from e
+        member_codes.append(codes)
+        bad = _day_bits(codes, _RI_IS_BAD)
+        not_good = all_days & ~_day_bits(codes, _RI_IS_GOOD) & ~bad
+        if max_bad:
+            _bit_count_add(bad_planes, bad)
+        else:
+            ok_bits &= ~bad
+        if require_good:
+            ok_bits &= ~not_good
+    if max_bad:
+        ok_bits &= _bit_count_at_most(bad_planes, max_bad, all_days)
+
+    ranked = []
+    for i in _bit_positions(ok_bits):
+        good = bad = 0
+        for codes in member_codes:
+            verdict = codes[i] & 3
+            good += verdict == 1
+            bad += verdict == 3
+        ji = {codes[i] >> 2 for codes in member_codes} - {RI_NO_HOUR}
+        ranked.append((bad, -good, len(ji), i, good, ji))
+    ranked.sort()
+
+    dates = []
+    for bad, _, _, i, good, ji in ranked[:top]:
+        d = d1 + timedelta(days=i)
+        ly, lm, ld, leap = solar_to_lunar(d)
+        dates.append({
+            "date": d.isoformat(),
+            "lunar": f"{ly}年{'閏' if leap else ''}{lm}月{ld}日",
+            "good": good,
+            "neutral": len(ids) - good - bad,
+            "bad": bad,
+            "ji_hours": [ZODIAC[h] for h in sorted(ji)],
+            "free_hours": [b for h, b in enumerate(ZODIAC) if h not in ji],
+            "verdicts": {mid: RI_FORTUNE_CODES[codes[i] & 3] for mid, codes in zip(ids, member_codes)},
+        })
+    return {"start": d1.isoformat(), "end": d2.isoformat(), "members": ids, "candidates": len(ranked), "dates": dates}
+
+# ======================= iCalendar 匯出（流日／流月運勢） =======================
+# 逐年計算、逐筆 yield，多年份匯出也只佔一年份的記憶體。
+# 內容與 render_liuri_ming_qian_fortunes / 流月運勢同一份資料、同一句文字：
+#   流日：好／差（可選平）為整天事件，另有忌時的時段事件（子時 23:00 起算到隔天 01:00，記在前一天晚上）
+#   流月：型態非平穩的月份為跨整個農曆月的事件（閏月併入同號月份）
+# 時間為不帶時區的「當地時間」，手機行事曆會照裝置時區顯示。
+
+ICS_PRODID = "-//ziwei//fortune calendar//ZH"
+ICS_MAX_DAYS = 366 * 10
+
+def _ics_escape(text: str) -> str:
+    return text.replace("\\", "\\\\").replace(";", "\\;").replace(",", "\\,").replace("\n", "\\n")
+
+def _ics_fold(line: str) -> str:
+    """RFC 5545：每行最多 75 octets，續行以空白開頭（不切斷 UTF-8 字元）。"""
+    if len(line.encode("utf-8")) <= 75:
+        return line
+    parts, cur, size = [], "", 0
+    for ch in line:
+        n = len(ch.encode("utf-8"))
+        if size + n > (75 if not parts else 74):
+            parts.append(cur)
+            cur, size = "", 0
+        cur += ch
+        size += n
+    parts.append(cur)
+    return "\r\n ".join(parts)
+
+def _ics_event(uid: str, stamp: str, start: str, end: str, summary: str, description: str, all_day: bool) -> str:
+    kind = ";VALUE=DATE" if all_day else ""
+    lines = [
+        "BEGIN:VEVENT",
+        f"UID:{uid}",
+        f"DTSTAMP:{stamp}",
+        f"DTSTART{kind}:{start}",
+        f"DTEND{kind}:{end}",
+        f"SUMMARY:{_ics_escape(summary)}",
+        f"DESCRIPTION:{_ics_escape(description)}",
+        "TRANSP:TRANSPARENT",
+        "END:VEVENT",
+    ]
+    return "".join(_ics_fold(l) + "\r\n" for l in lines)
+
+def _ji_hour_span(d, hour_branch: str):
+    """忌時地支 → (開始, 結束) datetime；子時從前一天 23:00 開始。"""
+    k = ZODIAC.index(hour_branch)
+    start = datetime(d.year, d.month, d.day) + timedelta(hours=2 * k - 1)
+    return start, start + timedelta(hours=2)
+
+def iter_fortune_ics(input_text: str, d1, d2, fortunes=("好", "差"), ji_hours: bool = True,
+                     months: bool = True, name: str = "紫微運勢"):
+    """
+    命盤文字 + 國曆區間 → 逐段 yield iCalendar 文字（CRLF 換行，可直接串流寫出）。
+      fortunes : 要建整天事件的流日運勢（預設 好、差）
+      ji_hours : 非「差」的日子另建忌時時段事件
+      months   : 建流月事件（本月運勢平穩的月份略過）
+    命盤不完整（見 require_complete_chart）或日期區間錯誤 → 第一次取值時 ValueError。
+    """
+    if isinstance(d1, datetime):
+        d1 = d1.date()
+    if isinstance(d2, datetime):
+        d2 = d2.date()
+    if d2 < d1:
+        raise ValueError("結束日期需晚於開始日期")
+    if (d2 - d1).days + 1 > ICS_MAX_DAYS:
+        raise ValueError(f"日期區間最多 {ICS_MAX_DAYS} 天")
+    y_lo, y_hi = solar_to_lunar(d1)[0], solar_to_lunar(d2)[0]
+    fp, chart = get_cached_chart(input_text)
+    require_complete_chart(chart)
+    data = chart["data"]
+    uid_base = fp[:16]
+    stamp = time.strftime("%Y%m%dT%H%M%SZ", time.gmtime())
+
+    yield "".join(_ics_fold(l) + "\r\n" for l in (
+        "BEGIN:VCALENDAR", "VERSION:2.0", f"PRODID:{ICS_PRODID}", "CALSCALE:GREGORIAN", "METHOD:PUBLISH",
+        f"X-WR-CALNAME:{_ics_escape(name)}",
+    ))
+    for year in range(y_lo, y_hi + 1):
+        try:
+            cols = chart_cols(data, chart["col_order"])
+            codes = ri_fortune_year_codes(data, cols, year)
+            verdicts = yue_fortune_year_verdicts(data, cols, year) if months else []
+        finally:
+            clear_chart_memo()
+        year_months = lunar_year_months(year)
+
+        # 流月：從該月初一到下一個（非閏）月初一前一天
+        starts = [(m, start) for m, is_leap, _, start in year_months if not is_leap]
+        year_end = year_months[-1][3] + timedelta(days=year_months[-1][2])
+        for i, (month_no, start) in enumerate(starts):
+            end = starts[i + 1][1] if i + 1 < len(starts) else year_end
+            verdict = verdicts[month_no - 1] if verdicts else None
+            if not verdict or not verdict[0] or end <= d1 or start > d2:
+                continue
+            yield _ics_event(
+                f"{uid_base}-{year}{month_no:02d}-month@ziwei", stamp,
+                start.strftime("%Y%m%d"), end.strftime("%Y%m%d"),
+                f"流月 {verdict[0]}（{verdict[1]}分）", format_yue_fortune_line(year, month_no, verdict), True,
+            )
+
+        # 流日
+        offset = 0
+        for month_no, is_leap, total_days, solar_start in year_months:
+            for day_no in range(1, total_days + 1):
+                g_date = solar_start + timedelta(days=day_no - 1)
+                if not (d1 <= g_date <= d2):
+                    continue
+                fortune, hour_branch = decode_ri_fortune(codes[offset + day_no - 1])
+                line = f"{g_date.year}.{g_date.month}.{g_date.day}｜" \
+                       f"{format_ri_fortune_line(year, month_no, day_no, fortune, hour_branch, is_leap)}"
+                day_key = g_date.strftime("%Y%m%d")
+                if fortune in fortunes:
+                    yield _ics_event(f"{uid_base}-{day_key}-day@ziwei", stamp, day_key,
+                                     (g_date + timedelta(days=1)).strftime("%Y%m%d"), f"運勢 {fortune}", line, True)
+                if ji_hours and hour_branch and fortune != "差":
+                    start, end = _ji_hour_span(g_date, hour_branch)
+                    yield _ics_event(f"{uid_base}-{day_key}-ji@ziwei", stamp, start.strftime("%Y%m%dT%H%M%S"),
+                                     end.strftime("%Y%m%dT%H%M%S"), f"忌時 {hour_branch}時", line, False)
+            offset += total_days
+    yield "END:VCALENDAR\r\n"
+
 # ======================= Flask Web 介面 =======================
 
 app = Flask(__name__)
@@ -1797,13 +3299,176 @@ def index():
 
         if raw_text.strip():
             try:
-                # 呼叫主程式進行運算
-                result = run_chart_from_text(raw_text, target_year=year)
+                # 呼叫主程式進行運算（同一張盤、同一年直接取快取）
+                result = run_chart_cached(raw_text, target_year=year)
             except Exception as e:
                 result = f"計算過程出錯：{e}"
 
     return render_template_string(HTML_PAGE, raw_text=raw_text, result=result, year=year)
 
+# ======================= 批次 API（NDJSON） =======================
+# POST /api/bulk
+#   請求：application/json  {"charts": [{"id": "...", "raw": "命盤文字", "year": 2026 或 "years": [...]}, ...]}
+#         或 application/x-ndjson，每行一個 chart 物件
+#   回應：application/x-ndjson，分段傳送；每個 (命盤, 年份) 一行，依「完成順序」，
+#         欄位同 run_chart_job（id / year / ok / output 或 error / elapsed_ms）
+# 行程池在第一次呼叫時建立，之後各請求共用。
+
+# 行程數取自環境變數 ZIWEI_BULK_WORKERS（0 或未設為 CPU 核心數），第一次建池時才讀，
+# 設錯只記一筆警告、改用預設值，不影響 import。子行程異常結束時丟掉壞掉的池，下個請求重建。
+
+BULK_MAX_CHARTS = 5000
+BULK_MAX_PAIRS = 20000     # 每個請求（命盤, 年份）組合總數上限
+
+_BULK_POOL = None
+_BULK_POOL_WORKERS = 0
+_BULK_POOL_LOCK = threading.Lock()
+
+def bulk_worker_count() -> int:
+    text = os.environ.get("ZIWEI_BULK_WORKERS", "").strip()
+    try:
+        n = int(text or "0")
+        if n < 0:
+            raise ValueError(text)
+    except ValueError:
+        logging.getLogger("ziwei.bulk").warning("ZIWEI_BULK_WORKERS=%r 不是非負整數，改用 CPU 核心數", text)
+        n = 0
+    return n or default_worker_count()
+
+def get_bulk_pool() -> tuple:
+    """回傳 (共用行程池, 行程數)。"""
+    global _BULK_POOL, _BULK_POOL_WORKERS
+    with _BULK_POOL_LOCK:
+        if _BULK_POOL is None:
+            _BULK_POOL_WORKERS = bulk_worker_count()
+            _BULK_POOL = ProcessPoolExecutor(max_workers=_BULK_POOL_WORKERS)
+        return _BULK_POOL, _BULK_POOL_WORKERS
+
+def discard_bulk_pool(pool):
+    """池子壞掉（BrokenProcessPool）時丟掉；若已被別的請求換新則不動。"""
+    global _BULK_POOL
+    with _BULK_POOL_LOCK:
+        if _BULK_POOL is pool:
+            _BULK_POOL = None
+    pool.shutdown(wait=False)
+
+def parse_bulk_request(req):
+    """請求內容 → (jobs, 錯誤訊息)。"""
+    body = req.get_data(as_text=True) or ""
+    if "ndjson" in (req.mimetype or ""):
+        try:
+            charts = [json.loads(line) for line in body.splitlines() if line.strip()]
+        except json.JSONDecodeError as e:
+            return None, f"NDJSON 格式錯誤：{e}"
+    else:
+        try:
+            payload = json.loads(body or "{}")
+        except json.JSONDecodeError as e:
+            return None, f"JSON 格式錯誤：{e}"
+        charts = payload.get("charts") if isinstance(payload, dict) else payload
+    if not isinstance(charts, list) or not charts:
+        return None, "需要 charts 陣列"
+    if len(charts) > BULK_MAX_CHARTS:
+        return None, f"一次最多 {BULK_MAX_CHARTS} 張命盤"
+
+    jobs = []
+    n_pairs = 0
+    for i, item in enumerate(charts):
+        if not isinstance(item, dict) or not str(item.get("raw", "")).strip():
+            return None, f"第 {i + 1} 筆缺少 raw"
+        years = item["years"] if "years" in item else [item.get("year", current_year())]
+        if not isinstance(years, list) or not years:
+            return None, f"第 {i + 1} 筆 years 需為非空的年份陣列"
+        try:
+            years = [check_target_year(y) for y in years]
+        except ValueError as e:
+            return None, f"第 {i + 1} 筆{e}"
+        n_pairs += len(years)
+        if n_pairs > BULK_MAX_PAIRS:
+            return None, f"一次最多 {BULK_MAX_PAIRS} 組（命盤, 年份）"
+        jobs.append({"id": item.get("id", i), "raw": str(item["raw"]), "years": years})
+    return jobs, ""
+
+@app.route("/api/bulk", methods=["POST"])
+def bulk_api():
+    jobs, err = parse_bulk_request(request)
+    if err:
+        return Response(json.dumps({"ok": False, "error": err}, ensure_ascii=False) + "\n",
+                        status=400, mimetype="application/x-ndjson")
+
+    def generate():
+        pool, workers = get_bulk_pool()
+
+        def on_broken(job, exc):
+            discard_bulk_pool(pool)
+            return [{"id": job.get("id"), "year": y, "ok": False, "error": f"{type(exc).__name__}: 計算行程異常結束",
+                     "elapsed_ms": 0} for y in job["years"]]
+
+        for records in iter_chart_jobs(jobs, workers=workers, pool=pool, on_broken=on_broken):
+            yield "".join(json.dumps(rec, ensure_ascii=False) + "\n" for rec in records)
+
+    return Response(stream_with_context(generate()), mimetype="application/x-ndjson")
+
+# ======================= 群組擇日 API =======================
+# POST /api/group-days
+#   請求：{"charts": [{"id": "...", "raw": "命盤文字"}, ...], "start": "2026-03-01", "end": "2026-06-30",
+#          "top": 20, "require_good": false, "max_bad": 0}
+#   回應：group_good_days 的結果（JSON）
+
+@app.route("/api/group-days", methods=["POST"])
+def group_days_api():
+    payload = request.get_json(silent=True)
+    if not isinstance(payload, dict):
+        return {"ok": False, "error": "需要 JSON 物件"}, 400
+    charts = payload.get("charts")
+    if not isinstance(charts, list) or not all(isinstance(c, dict) and str(c.get("raw", "")).strip() for c in charts):
+        return {"ok": False, "error": "charts 需為含 raw 的物件陣列"}, 400
+    try:
+        d1 = datetime.strptime(str(payload.get("start", "")), "%Y-%m-%d").date()
+        d2 = datetime.strptime(str(payload.get("end", "")), "%Y-%m-%d").date()
+        result = group_good_days(charts, d1, d2, int(payload.get("top", 20)), bool(payload.get("require_good")),
+                                 int(payload.get("max_bad", 0)))
+    except (TypeError, ValueError) as e:
+        return {"ok": False, "error": str(e)}, 400
+    return {"ok": True, **result}
+
+# ======================= 行事曆 API =======================
+# POST /api/calendar.ics
+#   請求：JSON 或表單 {"raw": "命盤文字", "start": "2026-01-01", "end": "2026-12-31",
+#          "fortunes": "好,差", "ji_hours": true, "months": true}
+#   回應：text/calendar，分段傳送
+
+@app.route("/api/calendar.ics", methods=["POST"])
+def calendar_api():
+    payload = request.get_json(silent=True)
+    if not isinstance(payload, dict):
+        payload = request.form.to_dict()
+    raw = str(payload.get("raw", ""))
+    if not raw.strip():
+        return {"ok": False, "error": "缺少 raw"}, 400
+
+    def flag(key):
+        value = payload.get(key, True)
+        return value if isinstance(value, bool) else str(value).lower() not in ("0", "false", "no", "")
+
+    fortunes = payload.get("fortunes", "好,差")
+    if isinstance(fortunes, str):
+        fortunes = [f.strip() for f in fortunes.split(",") if f.strip()]
+    try:
+        d1 = datetime.strptime(str(payload.get("start", "")), "%Y-%m-%d").date()
+        d2 = datetime.strptime(str(payload.get("end", "")), "%Y-%m-%d").date()
+        events = iter_fortune_ics(raw, d1, d2, tuple(fortunes), flag("ji_hours"), flag("months"))
+        first = next(events)   # 參數錯誤在這裡就丟出，還能回 400
+    except (TypeError, ValueError) as e:
+        return {"ok": False, "error": str(e)}, 400
+
+    def generate():
+        yield first
+        yield from events
+
+    return Response(stream_with_context(generate()), mimetype="text/calendar",
+                    headers={"Content-Disposition": 'attachment; filename="ziwei-fortune.ics"'})
+
 if __name__ == "__main__":
     # 啟動 Flask 伺服器
     app.run(host="0.0.0.0", port=5000, debug=True)
\ No newline at end of file
@@ -0,0 +1,101 @@
+# -*- coding: utf-8 -*-
+"""
+干支（六十甲子）推算：全部用儒略日數（JDN）算術，不查表。
+  - 日干支：JDN 每 60 天一輪（2000-01-01 為戊午）
+  - 年干支：以農曆年為界（紫微斗數流年的換年點為正月初一），1984 為甲子年
+  - 月干支：以農曆月為界，正月建寅，月干依五虎遁；閏月沿用同號月份的干支
+六十甲子索引 0~59：0 = 甲子、1 = 乙丑 … 59 = 癸亥；天干 = idx % 10，地支 = idx % 12。
+批次版（ganzhi_range）一次回傳整段日期的索引陣列，供多年份計算直接取用。
+"""
+from array import array
+from datetime import date
+
+from ziwei_calendar import lunar_new_year, lunar_year_months, lunar_year_supported, solar_to_lunar
+
+STEMS    = ["甲","乙","丙","丁","戊","己","庚","辛","壬","癸"]
+BRANCHES = ["子","丑","寅","卯","辰","巳","午","未","申","酉","戌","亥"]
+
+_JDN_OF_ORDINAL_0 = 1721425  # date(1, 1, 1).toordinal() == 1 對應 JDN 1721426
+
+def julian_day_number(d: date) -> int:
+    """國曆日期 → 儒略日數（中午起算的整數日）。"""
+    return d.toordinal() + _JDN_OF_ORDINAL_0
+
+def ganzhi_name(idx: int) -> str:
+    """六十甲子索引 → 『甲子』。"""
+    return STEMS[idx % 10] + BRANCHES[idx % 12]
+
+def stem_of(idx: int) -> str:
+    return STEMS[idx % 10]
+
+def branch_of(idx: int) -> str:
+    return BRANCHES[idx % 12]
+
+# ==================== 單筆 ====================
+
+def day_ganzhi_index(d: date) -> int:
+    return (julian_day_number(d) - 11) % 60
+
+def year_ganzhi_index(lunar_year: int) -> int:
+    return (lunar_year - 1984) % 60
+
+def month_ganzhi_index(lunar_year: int, month_no: int) -> int:
+    """農曆 lunar_year 年 month_no 月（正月 = 寅月）的干支索引；年與年之間月干支連續。"""
+    return ((lunar_year - 1984) * 12 + (month_no - 1) + 2) % 60
+
+def lunar_month_stems(lunar_year: int) -> list:
+    """整年 12 個月的月干（正月 ~ 十二月）。"""
+    return [stem_of(month_ganzhi_index(lunar_year, m)) for m in range(1, 13)]
+
+def ganzhi_of_date(d: date) -> dict:
+    """
+    某國曆日的年／月／日干支：
+      {'lunar': (年, 月, 日, 閏), 'year': idx, 'month': idx, 'day': idx}
+    """
+    ly, lm, ld, leap = solar_to_lunar(d)
+    return {
+        "lunar": (ly, lm, ld, leap),
+        "year": year_ganzhi_index(ly),
+        "month": month_ganzhi_index(ly, lm),
+        "day": day_ganzhi_index(d),
+    }
+
+# ==================== 批次 ====================
+
+def ganzhi_range(start: date, end: date) -> dict:
+    """
+    start ~ end（含頭尾）每天的干支索引，一次算完：
+      {'start': date, 'days': n,
+       'year': array('B'), 'month': array('B'), 'day': array('B')}
+    日干支直接由 JDN 連續遞增；年／月干支依農曆表逐月成段填入。
+    """
+    n = (end - start).days + 1
+    if n <= 0:
+        return {"start": start, "days": 0, "year": array("B"), "month": array("B"), "day": array("B")}
+
+    d0 = day_ganzhi_index(start)
+    day = array("B", ((d0 + i) % 60 for i in range(n)))
+
+    year_arr = array("B", bytes(n))
+    month_arr = array("B", bytes(n))
+    s_ord, e_ord = start.toordinal(), end.toordinal()
+    ly = solar_to_lunar(start)[0]
+    while lunar_year_supported(ly) and lunar_new_year(ly).toordinal() <= e_ord:
+        y_idx = year_ganzhi_index(ly)
+        for m, _leap, days, m_start in lunar_year_months(ly):
+            lo = max(m_start.toordinal(), s_ord)
+            hi = min(m_start.toordinal() + days - 1, e_ord)
+            if lo > hi:
+                continue
+            m_idx = month_ganzhi_index(ly, m)
+            a, b = lo - s_ord, hi - s_ord + 1
+            year_arr[a:b] = array("B", [y_idx]) * (b - a)
+            month_arr[a:b] = array("B", [m_idx]) * (b - a)
+        ly += 1
+
+    return {"start": start, "days": n, "year": year_arr, "month": month_arr, "day": day}
+
+def day_stems_range(start: date, days: int) -> list:
+    """從 start 起連續 days 天的日干（只用 JDN 算術）。"""
+    d0 = day_ganzhi_index(start)
+    return [STEMS[(d0 + i) % 10] for i in range(days)]
@@ -0,0 +1,744 @@
+# -*- coding: utf-8 -*-
+"""
+客戶名冊與命盤存放（SQLite）
+
+  clients : 客戶（client_id、姓名、對應的 chart_key、其他欄位 JSON）
+  charts  : 命盤原始文字，一個 chart_key 只存一份（同生辰同性別的客戶共用）
+  ingest_queue : 待抓取的命盤與進度（pending / done / failed），即匯入的檢查點
+
+命盤特徵索引（store_chart 時由 parse_chart 結果建立，查詢不需重新解析）：
+  chart_meta    : 生年干、命宮干支、索引版本
+  chart_palaces : 每宮的宮干、地支、大限起訖、主星數（主星數 0 = 空宮）
+  chart_stars   : 每宮的星曜（主/輔/小星）
+
+  query_charts(conn, [star_filter("武曲", "財帛"), empty_palace_filter("命")])
+
+運勢日期反向索引（configure_date_index 設定農曆年份範圍，update_date_index 增量補算）：
+  date_index_members : 每張命盤一個固定的位元序號
+  date_index_days    : 國曆某天 × 流日運勢（好/平/差） → 命盤點陣圖
+  date_index_months  : 農曆某年某月 × 流月運勢型態     → 命盤點陣圖
+  點陣圖為 Python int（第 n 位元 = 序號 n 的命盤），以 zlib 壓縮後存 BLOB；
+  查某天只讀一列、解壓一次，多條件用 & / | 直接運算。
+
+預先計算（precompute_roster，由 ziwei_cli.py schedule 每晚執行）：
+  precomputed_years     : 每張命盤每個目標年的完整輸出（zlib 壓縮）
+  precomputed_timelines : 每張命盤的日／月運勢時間軸（格式同 .zwtl 檔）
+  兩者都記下 ENGINE_RULES_VERSION 與命盤指紋，規則或命盤改變即視為過期、下次重算。
+
+chart_key 由「國曆生日 + 時辰 + 性別」組成，例如 1992-09-25-h04-F：
+  時辰以小時換算（1~2 點 = 丑 = 01 …），23 點記為 h12（晚子時），與 0 點的早子時分開。
+"""
+import re
+import json
+import time
+import zlib
+import sqlite3
+from datetime import datetime, date
+
+import ziwei_core as engine
+
+ROSTER_SCHEMA = """
+CREATE TABLE IF NOT EXISTS charts (
+    chart_key   TEXT PRIMARY KEY,
+    birth_date  TEXT NOT NULL,
+    hour        INTEGER NOT NULL,
+    gender      TEXT NOT NULL,
+    raw         TEXT NOT NULL,
+    fingerprint TEXT NOT NULL,
+    source      TEXT NOT NULL DEFAULT '',
+    fetched_at  TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS clients (
+    client_id   TEXT PRIMARY KEY,
+    name        TEXT NOT NULL DEFAULT '',
+    chart_key   TEXT NOT NULL,
+    extra       TEXT NOT NULL DEFAULT '{}',
+    updated_at  TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_clients_chart ON clients(chart_key);
+CREATE TABLE IF NOT EXISTS ingest_queue (
+    chart_key   TEXT PRIMARY KEY,
+    birth_date  TEXT NOT NULL,
+    hour        INTEGER NOT NULL,
+    gender      TEXT NOT NULL,
+    status      TEXT NOT NULL DEFAULT 'pending',
+    attempts    INTEGER NOT NULL DEFAULT 0,
+    last_error  TEXT NOT NULL DEFAULT '',
+    updated_at  TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_queue_status ON ingest_queue(status);
+CREATE TABLE IF NOT EXISTS chart_meta (
+    chart_key     TEXT PRIMARY KEY,
+    year_stem     TEXT NOT NULL,
+    ming_col      TEXT NOT NULL,
+    index_version INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_meta_year_stem ON chart_meta(year_stem);
+CREATE TABLE IF NOT EXISTS chart_palaces (
+    chart_key TEXT NOT NULL,
+    abbr      TEXT NOT NULL,
+    stem      TEXT NOT NULL,
+    branch    TEXT NOT NULL,
+    da_start  INTEGER,
+    da_end    INTEGER,
+    n_main    INTEGER NOT NULL,
+    PRIMARY KEY (chart_key, abbr)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS idx_palaces_main ON chart_palaces(abbr, n_main);
+CREATE INDEX IF NOT EXISTS idx_palaces_stem ON chart_palaces(abbr, stem);
+CREATE INDEX IF NOT EXISTS idx_palaces_daxian ON chart_palaces(da_start, da_end, abbr);
+CREATE TABLE IF NOT EXISTS chart_stars (
+    star      TEXT NOT NULL,
+    abbr      TEXT NOT NULL,
+    chart_key TEXT NOT NULL,
+    kind      TEXT NOT NULL,
+    PRIMARY KEY (star, abbr, chart_key)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS idx_stars_chart ON chart_stars(chart_key);
+CREATE TABLE IF NOT EXISTS date_index_meta (
+    key   TEXT PRIMARY KEY,
+    value TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS date_index_members (
+    bit         INTEGER PRIMARY KEY,
+    chart_key   TEXT NOT NULL UNIQUE,
+    fingerprint TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS date_index_days (
+    day     INTEGER NOT NULL,
+    verdict INTEGER NOT NULL,
+    bitmap  BLOB NOT NULL,
+    PRIMARY KEY (day, verdict)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS date_index_months (
+    year    INTEGER NOT NULL,
+    month   INTEGER NOT NULL,
+    pattern INTEGER NOT NULL,
+    bitmap  BLOB NOT NULL,
+    PRIMARY KEY (year, month, pattern)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS precomputed_years (
+    chart_key     TEXT NOT NULL,
+    year          INTEGER NOT NULL,
+    rules_version INTEGER NOT NULL,
+    fingerprint   TEXT NOT NULL,
+    output        BLOB NOT NULL,
+    computed_at   TEXT NOT NULL,
+    PRIMARY KEY (chart_key, year)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS precomputed_timelines (
+    chart_key     TEXT PRIMARY KEY,
+    start_year    INTEGER NOT NULL,
+    end_year      INTEGER NOT NULL,
+    rules_version INTEGER NOT NULL,
+    fingerprint   TEXT NOT NULL,
+    timeline      BLOB NOT NULL,
+    computed_at   TEXT NOT NULL
+);
+"""
+
+# 索引內容或解析規則改變時加一，reindex_charts 會重建舊版本的索引
+INDEX_VERSION = 1
+
+# 查詢時可用的宮名寫法（宮名全稱、去掉「宮」、縮寫都可以）
+PALACE_QUERY_ALIASES = {"官祿": "官", "官祿宮": "官", "僕役": "僕", "僕役宮": "僕", "奴僕": "僕", "奴僕宮": "僕"}
+for _full, _ab in engine.PALACE_ABBR.items():
+    PALACE_QUERY_ALIASES[_full] = PALACE_QUERY_ALIASES[_full[:-1]] = PALACE_QUERY_ALIASES[_ab] = _ab
+
+GENDER_ALIASES = {
+    "1": "M", "m": "M", "male": "M", "男": "M",
+    "0": "F", "f": "F", "female": "F", "女": "F",
+}
+
+
+def _now() -> str:
+    return datetime.now().isoformat(timespec="seconds")
+
+
+def open_roster(path: str) -> sqlite3.Connection:
+    """開啟（必要時建立）名冊資料庫。"""
+    conn = sqlite3.connect(path)
+    conn.row_factory = sqlite3.Row
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.executescript(ROSTER_SCHEMA)
+    return conn
+
+
+# ==================== chart_key ====================
+
+def normalize_gender(value) -> str:
+    g = GENDER_ALIASES.get(str(value).strip().lower())
+    if not g:
+        raise ValueError(f"無法辨識的性別：{value}")
+    return g
+
+
+def hour_slot(hour: int) -> int:
+    """0~23 點 → 時辰序（子=0 … 亥=11），23 點為晚子時 12。"""
+    if not 0 <= hour <= 23:
+        raise ValueError(f"小時需在 0~23：{hour}")
+    return 12 if hour == 23 else (hour + 1) // 2
+
+
+def chart_key(year: int, month: int, day: int, hour: int, gender) -> str:
+    """生辰 → 正規化的命盤鍵；日期不合法會丟 ValueError。"""
+    d = date(int(year), int(month), int(day))
+    return f"{d.isoformat()}-h{hour_slot(int(hour)):02d}-{normalize_gender(gender)}"
+
+
+# ==================== 客戶與命盤 ====================
+
+def upsert_client(conn, client_id: str, name: str, key: str, extra: dict = None):
+    conn.execute(
+        "INSERT INTO clients(client_id, name, chart_key, extra, updated_at) VALUES (?,?,?,?,?) "
+        "ON CONFLICT(client_id) DO UPDATE SET name=excluded.name, chart_key=excluded.chart_key, "
+        "extra=excluded.extra, updated_at=excluded.updated_at",
+        (client_id, name, key, json.dumps(extra or {}, ensure_ascii=False), _now()),
+    )
+
+
+def has_chart(conn, key: str) -> bool:
+    return conn.execute("SELECT 1 FROM charts WHERE chart_key=?", (key,)).fetchone() is not None
+
+
+def get_chart_raw(conn, key: str) -> str:
+    row = conn.execute("SELECT raw FROM charts WHERE chart_key=?", (key,)).fetchone()
+    return row["raw"] if row else ""
+
+
+def store_chart(conn, key: str, birth_date: str, hour: int, gender: str, raw: str, fingerprint: str, source: str = "",
+                parsed=None):
+    """存命盤原文並同時更新特徵索引（parsed：已有的 parse_chart 結果，省一次解析）。"""
+    conn.execute(
+        "INSERT OR REPLACE INTO charts(chart_key, birth_date, hour, gender, raw, fingerprint, source, fetched_at) "
+        "VALUES (?,?,?,?,?,?,?,?)",
+        (key, birth_date, hour, gender, raw, fingerprint, source, _now()),
+    )
+    index_chart(conn, key, raw, parsed)
+
+
+def iter_charts(conn):
+    """逐張回傳 (chart_key, raw)。"""
+    for row in conn.execute("SELECT chart_key, raw FROM charts ORDER BY chart_key"):
+        yield row["chart_key"], row["raw"]
+
+
+# ==================== 命盤特徵索引 ====================
+
+_DAXIAN_PAT = re.compile(r"(\d+)~(\d+)")
+
+
+def index_chart(conn, key: str, raw: str, parsed=None):
+    """parse_chart 結果 → chart_meta / chart_palaces / chart_stars（先清掉舊的）。"""
+    data, col_order, year_stem = parsed or engine.parse_chart(raw)
+    conn.execute("DELETE FROM chart_stars WHERE chart_key=?", (key,))
+    conn.execute("DELETE FROM chart_palaces WHERE chart_key=?", (key,))
+
+    palace_rows, star_rows, ming_col = [], set(), ""
+    for col in col_order:
+        cell = data[col]
+        abbr = cell["abbr"]
+        if not abbr:
+            continue
+        if abbr == "命":
+            ming_col = col
+        m = _DAXIAN_PAT.match(cell["daxian"])
+        da_start, da_end = (int(m.group(1)), int(m.group(2))) if m else (None, None)
+        palace_rows.append((key, abbr, col[:1], col[1:], da_start, da_end, len(cell["main"])))
+        for kind in ("main", "aux", "mini"):
+            for star in cell[kind]:
+                star_rows.add((star, abbr, key, kind))
+
+    conn.executemany("INSERT OR REPLACE INTO chart_palaces VALUES (?,?,?,?,?,?,?)", palace_rows)
+    conn.executemany("INSERT OR IGNORE INTO chart_stars VALUES (?,?,?,?)", star_rows)
+    conn.execute("INSERT OR REPLACE INTO chart_meta VALUES (?,?,?,?)", (key, year_stem, ming_col, INDEX_VERSION))
+
+
+def reindex_charts(conn, force: bool = False, batch: int = 500) -> int:
+    """補建缺少或版本過舊的索引；force=True 全部重建。回傳處理張數。"""
+    if force:
+        sql = "SELECT chart_key, raw FROM charts"
+        params = ()
+    else:
+        sql = ("SELECT c.chart_key, c.raw FROM charts c LEFT JOIN chart_meta m ON m.chart_key = c.chart_key "
+               "WHERE m.chart_key IS NULL OR m.index_version < ?")
+        params = (INDEX_VERSION,)
+    todo = conn.execute(sql, params).fetchall()
+    for i, row in enumerate(todo, 1):
+        index_chart(conn, row["chart_key"], row["raw"])
+        if i % batch == 0:
+            conn.commit()
+    conn.commit()
+    return len(todo)
+
+
+def normalize_palace(name: str) -> str:
+    ab = PALACE_QUERY_ALIASES.get(str(name).strip())
+    if not ab:
+        raise ValueError(f"無法辨識的宮位：{name}")
+    return ab
+
+
+# 每個 filter 為 (SQL, 參數)，SQL 查出符合條件的 chart_key；query_charts 取交集。
+
+def star_filter(star: str, palace: str = None):
+    """某星曜（在某宮）。"""
+    star = engine.ALIASES.get(star, star)
+    if palace:
+        return "SELECT chart_key FROM chart_stars WHERE star=? AND abbr=?", (star, normalize_palace(palace))
+    return "SELECT DISTINCT chart_key FROM chart_stars WHERE star=?", (star,)
+
+
+def empty_palace_filter(palace: str):
+    """某宮無主星（空宮）。"""
+    return "SELECT chart_key FROM chart_palaces WHERE abbr=? AND n_main=0", (normalize_palace(palace),)
+
+
+def palace_stem_filter(palace: str, stem: str):
+    """某宮宮干。"""
+    return "SELECT chart_key FROM chart_palaces WHERE abbr=? AND stem=?", (normalize_palace(palace), stem)
+
+
+def year_stem_filter(stem: str):
+    """生年天干。"""
+    return "SELECT chart_key FROM chart_meta WHERE year_stem=?", (stem,)
+
+
+def daxian_filter(age: int, palace: str = None):
+    """虛歲 age 時走的大限（在某宮）。"""
+    sql = "SELECT chart_key FROM chart_palaces WHERE da_start<=? AND da_end>=?"
+    params = (int(age), int(age))
+    if palace:
+        sql += " AND abbr=?"
+        params += (normalize_palace(palace),)
+    return sql, params
+
+
+def query_charts(conn, filters: list, limit: int = None) -> list:
+    """所有條件都成立的 chart_key（排序後回傳）。"""
+    if not filters:
+        sql, params = "SELECT chart_key FROM chart_meta", []
+    else:
+        sql = " INTERSECT ".join(f for f, _ in filters)
+        params = [p for _, ps in filters for p in ps]
+    sql += " ORDER BY chart_key"
+    if limit:
+        sql += " LIMIT ?"
+        params.append(limit)
+    return [row[0] for row in conn.execute(sql, params)]
+
+
+def query_clients(conn, filters: list, limit: int = None) -> list:
+    """符合條件的客戶：[{'client_id','name','chart_key'}...]。"""
+    if filters:
+        sub = " INTERSECT ".join(f for f, _ in filters)
+        params = [p for _, ps in filters for p in ps]
+        sql = f"SELECT client_id, name, chart_key FROM clients WHERE chart_key IN ({sub}) ORDER BY client_id"
+    else:
+        sql, params = "SELECT client_id, name, chart_key FROM clients ORDER BY client_id", []
+    if limit:
+        sql += " LIMIT ?"
+        params.append(limit)
+    return [dict(r) for r in conn.execute(sql, params)]
+
+
+# ==================== 運勢日期反向索引（壓縮點陣圖） ====================
+
+# 流月「好／壞」的型態（YUE_PATTERNS 名稱）；平穩月為 ""
+MONTH_GOOD_PATTERNS = ("科", "祿", "權")
+MONTH_BAD_PATTERNS = ("忌", "科+忌", "權+忌", "祿+忌")
+
+# byte 值 → 其中為 1 的位元位置
+_BYTE_BITS = [tuple(i for i in range(8) if b >> i & 1) for b in range(256)]
+
+
+def bitmap_to_blob(bitmap: int) -> bytes:
+    return zlib.compress(bitmap.to_bytes((bitmap.bit_length() + 7) // 8, "little"))
+
+
+def blob_to_bitmap(blob) -> int:
+    return int.from_bytes(zlib.decompress(blob), "little") if blob else 0
+
+
+def bitmap_count(bitmap: int) -> int:
+    return bin(bitmap).count("1")
+
+
+def bitmap_positions(bitmap: int) -> list:
+    """點陣圖 → 由小到大的位元序號。"""
+    out = []
+    for i, b in enumerate(bitmap.to_bytes((bitmap.bit_length() + 7) // 8, "little")):
+        if b:
+            base = i << 3
+            out.extend(base + k for k in _BYTE_BITS[b])
+    return out
+
+
+def date_index_range(conn):
+    """已設定的 (起, 迄) 農曆年；未設定回傳 None。"""
+    meta = dict(conn.execute("SELECT key, value FROM date_index_meta").fetchall())
+    if "start_year" not in meta:
+        return None
+    return int(meta["start_year"]), int(meta["end_year"])
+
+
+def clear_date_index(conn):
+    for table in ("date_index_members", "date_index_days", "date_index_months"):
+        conn.execute(f"DELETE FROM {table}")
+
+
+def configure_date_index(conn, start_year: int, end_year: int) -> bool:
+    """
+    設定索引涵蓋的農曆年份。年份或運勢規則版本（ENGINE_RULES_VERSION）跟現有的不同時
+    清空全部索引（之後 update_date_index 會整批重算），回傳 True。
+    """
+    if end_year < start_year or not (engine.lunar_year_supported(start_year) and engine.lunar_year_supported(end_year)):
+        raise ValueError(f"農曆年份 {start_year}~{end_year} 不在支援範圍內")
+    meta = dict(conn.execute("SELECT key, value FROM date_index_meta").fetchall())
+    wanted = {"start_year": str(start_year), "end_year": str(end_year), "rules_version": str(engine.ENGINE_RULES_VERSION)}
+    if all(meta.get(k) == v for k, v in wanted.items()):
+        return False
+    clear_date_index(conn)
+    conn.executemany("INSERT OR REPLACE INTO date_index_meta(key, value) VALUES (?,?)", wanted.items())
+    conn.commit()
+    return True
+
+
+def chart_date_verdicts(raw: str, start_year: int, end_year: int):
+    """
+    單張命盤 → (第一天國曆序數, 每天運勢碼 bytes, {(農曆年, 月): 型態索引})。
+    日碼只取運勢位元（1 好／2 平／3 差），月型態為 YUE_PATTERNS 的索引。
+    """
+    chart = engine.prepare_chart(raw)
+    data, col_order = chart["data"], chart["col_order"]
+    try:
+        index = engine.build_ri_fortune_index(data, col_order, start_year, end_year)
+        cols = engine.chart_cols(data, col_order)
+        months = {}
+        for year in range(start_year, end_year + 1):
+            codes = engine.yue_fortune_year_codes(data, cols, year)
+            for m in range(12):
+                months[(year, m + 1)] = codes[2 * m + 1] & 0xF
+    finally:
+        engine.clear_chart_memo()
+    return index["start"].toordinal(), engine.ri_fortune_verdicts(index["codes"]), months
+
+
+def _merge_bitmaps(conn, table: str, key_cols: tuple, acc: dict, base: int):
+    """把本批的局部點陣圖（bytearray，自 base 位元起）OR 進資料表。"""
+    where = " AND ".join(f"{c}=?" for c in key_cols)
+    rows = []
+    for key, local in acc.items():
+        row = conn.execute(f"SELECT bitmap FROM {table} WHERE {where}", key).fetchone()
+        bitmap = (blob_to_bitmap(row[0]) if row else 0) | (int.from_bytes(local, "little") << base)
+        rows.append(key + (bitmap_to_blob(bitmap),))
+    marks = ",".join("?" * (len(key_cols) + 1))
+    conn.executemany(f"INSERT OR REPLACE INTO {table} VALUES ({marks})", rows)
+
+
+def _clear_member_bits(conn, bits: list):
+    """把指定序號從所有點陣圖中移除（命盤內容改變、需重算時用）。"""
+    mask = 0
+    for bit in bits:
+        mask |= 1 << bit
+    for table, key_cols in (("date_index_days", ("day", "verdict")), ("date_index_months", ("year", "month", "pattern"))):
+        cols = ", ".join(key_cols)
+        updates = []
+        for row in conn.execute(f"SELECT {cols}, bitmap FROM {table}").fetchall():
+            bitmap = blob_to_bitmap(row[-1])
+            if bitmap & mask:
+                updates.append((bitmap_to_blob(bitmap & ~mask),) + tuple(row[:-1]))
+        where = " AND ".join(f"{c}=?" for c in key_cols)
+        conn.executemany(f"UPDATE {table} SET bitmap=? WHERE {where}", updates)
+
+
+def update_date_index(conn, batch: int = 1000, on_progress=None) -> int:
+    """
+    把尚未進索引（或原文已改變）的命盤補進日期索引；每批 commit 一次，中斷後再呼叫即可接續。
+    on_progress(已處理, 總數) 可選。回傳處理張數。
+    """
+    years = date_index_range(conn)
+    if years is None:
+        raise ValueError("尚未設定日期索引的年份範圍（configure_date_index）")
+    meta_rules = conn.execute("SELECT value FROM date_index_meta WHERE key='rules_version'").fetchone()
+    if meta_rules is None or meta_rules[0] != str(engine.ENGINE_RULES_VERSION):
+        clear_date_index(conn)
+        conn.execute("INSERT OR REPLACE INTO date_index_meta(key, value) VALUES ('rules_version', ?)",
+                     (str(engine.ENGINE_RULES_VERSION),))
+    start_year, end_year = years
+
+    todo = conn.execute(
+        "SELECT c.chart_key, c.raw, c.fingerprint, m.bit FROM charts c "
+        "LEFT JOIN date_index_members m ON m.chart_key = c.chart_key "
+        "WHERE m.chart_key IS NULL OR m.fingerprint != c.fingerprint ORDER BY c.chart_key"
+    ).fetchall()
+    stale = [row["bit"] for row in todo if row["bit"] is not None]
+    if stale:
+        _clear_member_bits(conn, stale)
+    next_bit = (conn.execute("SELECT MAX(bit) FROM date_index_members").fetchone()[0] or -1) + 1
+
+    done = 0
+    for lo in range(0, len(todo), batch):
+        chunk = []
+        for row in todo[lo:lo + batch]:
+            bit = row["bit"]
+            if bit is None:
+                bit, next_bit = next_bit, next_bit + 1
+            chunk.append((bit, row))
+
+        base = min(bit for bit, _ in chunk) & ~7
+        size = (max(bit for bit, _ in chunk) - base) // 8 + 1
+        day_acc, month_acc = {}, {}
+        for bit, row in chunk:
+            pos, mask = (bit - base) >> 3, 1 << ((bit - base) & 7)
+            start, day_codes, months = chart_date_verdicts(row["raw"], start_year, end_year)
+            for i, verdict in enumerate(day_codes):
+                local = day_acc.get((start + i, verdict))
+                if local is None:
+                    local = day_acc[(start + i, verdict)] = bytearray(size)
+                local[pos] |= mask
+            for (year, month), pattern in months.items():
+                local = month_acc.get((year, month, pattern))
+                if local is None:
+                    local = month_acc[(year, month, pattern)] = bytearray(size)
+                local[pos] |= mask
+
+        _merge_bitmaps(conn, "date_index_days", ("day", "verdict"), day_acc, base)
+        _merge_bitmaps(conn, "date_index_months", ("year", "month", "pattern"), month_acc, base)
+        conn.executemany(
+            "INSERT OR REPLACE INTO date_index_members(bit, chart_key, fingerprint) VALUES (?,?,?)",
+            [(bit, row["chart_key"], row["fingerprint"]) for bit, row in chunk],
+        )
+        conn.commit()
+        done += len(chunk)
+        if on_progress:
+            on_progress(done, len(todo))
+    return done
+
+
+def day_bitmap(conn, d, fortune: str = "好") -> int:
+    """國曆 d 當天流日運勢為 fortune 的命盤點陣圖。"""
+    verdict = engine.RI_FORTUNE_CODES.index(fortune)
+    row = conn.execute("SELECT bitmap FROM date_index_days WHERE day=? AND verdict=?",
+                       (d.toordinal(), verdict)).fetchone()
+    return blob_to_bitmap(row[0]) if row else 0
+
+
+def month_bitmap(conn, lunar_year: int, month_no: int, patterns=MONTH_GOOD_PATTERNS) -> int:
+    """農曆某年某月流月型態屬於 patterns 的命盤點陣圖（閏月請用同號月份）。"""
+    codes = [engine.YUE_PATTERNS.index(p) for p in patterns]
+    marks = ",".join("?" * len(codes))
+    bitmap = 0
+    for row in conn.execute(f"SELECT bitmap FROM date_index_months WHERE year=? AND month=? AND pattern IN ({marks})",
+                            [lunar_year, month_no] + codes):
+        bitmap |= blob_to_bitmap(row[0])
+    return bitmap
+
+
+def month_bitmap_on(conn, d, patterns=MONTH_GOOD_PATTERNS) -> int:
+    """國曆 d 所在農曆月的流月點陣圖。"""
+    lunar_year, month_no, _, _ = engine.solar_to_lunar(d)
+    return month_bitmap(conn, lunar_year, month_no, patterns)
+
+
+_MEMBER_LOOKUP_CHUNK = 500   # 每次 IN (...) 的位元數（SQLite 舊版參數上限 999）
+
+
+def load_date_index_members(conn, bits=None) -> dict:
+    """
+    位元序號 → [(client_id, name, chart_key)...]。
+    bits 為 None 時載入全部（查詢端可快取重複使用）；給 bits 則只查這些位元，成本與命中數成正比。
+    """
+    sql = ("SELECT m.bit, c.client_id, c.name, c.chart_key FROM date_index_members m "
+           "JOIN clients c ON c.chart_key = m.chart_key")
+    if bits is None:
+        batches = [(sql, [])]
+    else:
+        bits = list(bits)
+        batches = []
+        for i in range(0, len(bits), _MEMBER_LOOKUP_CHUNK):
+            chunk = bits[i:i + _MEMBER_LOOKUP_CHUNK]
+            batches.append((f"{sql} WHERE m.bit IN ({','.join('?' * len(chunk))})", chunk))
+    members = {}
+    for query, params in batches:
+        for row in conn.execute(query, params):
+            members.setdefault(row[0], []).append((row[1], row[2], row[3]))
+    return members
+
+
+def bitmap_clients(conn, bitmap: int, members: dict = None) -> list:
+    """
+    點陣圖 → 客戶列表 [{'client_id','name','chart_key'}...]（依 client_id 排序）。
+    沒給 members 時只查點陣圖裡有的位元，不載入整份名冊。
+    """
+    positions = bitmap_positions(bitmap)
+    if members is None:
+        members = load_date_index_members(conn, positions)
+    out = []
+    for bit in positions:
+        out.extend({"client_id": cid, "name": name, "chart_key": key} for cid, name, key in members.get(bit, ()))
+    out.sort(key=lambda r: r["client_id"])
+    return out
+
+
+# ==================== 預先計算（夜間排程） ====================
+
+def precompute_chart_job(job: dict) -> dict:
+    """
+    行程池工作單位（給 engine.iter_chart_jobs 的 fn）：
+      job = {'id': chart_key, 'raw', 'fingerprint', 'years': [目標年...], 'timeline': (起, 迄)}
+      回傳 {'id', 'fingerprint', 'ok', 'outputs': {年: 輸出}, 'timeline': bytes, 'error', 'elapsed_ms'}
+    """
+    t0 = time.perf_counter()
+    try:
+        chart = engine.prepare_chart(job["raw"])
+        outputs = engine.run_chart_range_from_text(job["raw"], job["years"])
+        y0, y1 = job["timeline"]
+        try:
+            timeline = engine.build_fortune_timeline_bytes(chart["data"], chart["col_order"], chart["raw"], y0, y1)
+        finally:
+            engine.clear_chart_memo()
+        result = {"ok": True, "outputs": outputs, "timeline": timeline}
+    except Exception as e:
+        result = {"ok": False, "error": f"{type(e).__name__}: {e}"}
+    result.update(id=job["id"], fingerprint=job["fingerprint"], elapsed_ms=round((time.perf_counter() - t0) * 1000, 1))
+    return result
+
+
+def precompute_targets(conn, start_year: int, end_year: int) -> list:
+    """
+    需要重算的命盤：start_year~end_year 任一年沒有結果、規則版本或指紋不符，
+    或時間軸不存在／過期／涵蓋不到。回傳 [(chart_key, raw, fingerprint)]。
+    """
+    rules = engine.ENGINE_RULES_VERSION
+    rows = conn.execute(
+        "SELECT c.chart_key, c.raw, c.fingerprint FROM charts c WHERE "
+        "(SELECT COUNT(*) FROM precomputed_years p WHERE p.chart_key = c.chart_key AND p.year BETWEEN ? AND ? "
+        "   AND p.rules_version = ? AND p.fingerprint = c.fingerprint) < ? "
+        "OR NOT EXISTS (SELECT 1 FROM precomputed_timelines t WHERE t.chart_key = c.chart_key "
+        "   AND t.rules_version = ? AND t.fingerprint = c.fingerprint AND t.start_year <= ? AND t.end_year >= ?) "
+        "ORDER BY c.chart_key",
+        (start_year, end_year, rules, end_year - start_year + 1, rules, start_year, end_year),
+    ).fetchall()
+    return [(row["chart_key"], row["raw"], row["fingerprint"]) for row in rows]
+
+
+def store_precomputed(conn, result: dict, timeline_years: tuple):
+    now = _now()
+    rules = engine.ENGINE_RULES_VERSION
+    conn.executemany(
+        "INSERT OR REPLACE INTO precomputed_years(chart_key, year, rules_version, fingerprint, output, computed_at) "
+        "VALUES (?,?,?,?,?,?)",
+        [(result["id"], year, rules, result["fingerprint"], zlib.compress(out.encode("utf-8")), now)
+         for year, out in result["outputs"].items()],
+    )
+    conn.execute(
+        "INSERT OR REPLACE INTO precomputed_timelines(chart_key, start_year, end_year, rules_version, fingerprint, "
+        "timeline, computed_at) VALUES (?,?,?,?,?,?,?)",
+        (result["id"], timeline_years[0], timeline_years[1], rules, result["fingerprint"], result["timeline"], now),
+    )
+
+
+def prune_precomputed(conn, before_year: int) -> int:
+    """刪掉 before_year 之前的年度輸出（時間軸每次整段重寫，不必另外清）。"""
+    return conn.execute("DELETE FROM precomputed_years WHERE year < ?", (before_year,)).rowcount
+
+
+def precompute_roster(conn, start_year: int, end_year: int, workers: int = None, max_pending: int = None,
+                      on_result=None, commit_every: int = 50) -> dict:
+    """
+    把所有過期的命盤算好存起來：每張命盤 start_year~end_year 的完整輸出與日／月運勢時間軸。
+      workers / max_pending : 行程數與同時送出的工作上限（控制夜間負載）
+      on_result(result)     : 每張完成時呼叫（進度顯示用）
+    每 commit_every 張 commit 一次；中斷後再執行只會補算剩下的。回傳 {'total','ok','failed'}。
+    """
+    targets = precompute_targets(conn, start_year, end_year)
+    years = list(range(start_year, end_year + 1))
+    jobs = ({"id": key, "raw": raw, "fingerprint": fp, "years": years, "timeline": (start_year, end_year)}
+            for key, raw, fp in targets)
+    stats = {"total": len(targets), "ok": 0, "failed": 0}
+    pending_commit = 0
+    try:
+        for result in engine.iter_chart_jobs(jobs, workers, max_pending, fn=precompute_chart_job):
+            if result["ok"]:
+                store_precomputed(conn, result, (start_year, end_year))
+                stats["ok"] += 1
+                pending_commit += 1
+                if pending_commit >= commit_every:
+                    conn.commit()
+                    pending_commit = 0
+            else:
+                stats["failed"] += 1
+            if on_result:
+                on_result(result)
+    finally:
+        conn.commit()
+    return stats
+
+
+def get_precomputed_output(conn, key: str, year: int):
+    """預先算好的某年完整輸出；沒有或已過期（規則版本、命盤指紋不符）回傳 None。"""
+    row = conn.execute(
+        "SELECT p.output FROM precomputed_years p JOIN charts c ON c.chart_key = p.chart_key "
+        "WHERE p.chart_key=? AND p.year=? AND p.rules_version=? AND p.fingerprint = c.fingerprint",
+        (key, year, engine.ENGINE_RULES_VERSION),
+    ).fetchone()
+    return zlib.decompress(row[0]).decode("utf-8") if row else None
+
+
+def get_precomputed_timeline(conn, key: str):
+    """預先算好的日／月運勢時間軸（engine.parse_fortune_timeline 的結果）；沒有或過期回傳 None。"""
+    row = conn.execute(
+        "SELECT t.timeline FROM precomputed_timelines t JOIN charts c ON c.chart_key = t.chart_key "
+        "WHERE t.chart_key=? AND t.rules_version=? AND t.fingerprint = c.fingerprint",
+        (key, engine.ENGINE_RULES_VERSION),
+    ).fetchone()
+    return engine.parse_fortune_timeline(bytes(row[0])) if row else None
+
+
+# ==================== 匯入佇列（檢查點） ====================
+
+def enqueue_chart(conn, key: str, birth_date: str, hour: int, gender: str) -> bool:
+    """尚未抓過也不在佇列中才加入；回傳是否新加入。"""
+    if has_chart(conn, key):
+        return False
+    cur = conn.execute(
+        "INSERT OR IGNORE INTO ingest_queue(chart_key, birth_date, hour, gender, updated_at) VALUES (?,?,?,?,?)",
+        (key, birth_date, hour, gender, _now()),
+    )
+    return cur.rowcount > 0
+
+
+def pending_items(conn, max_attempts: int, limit: int = None) -> list:
+    """待處理：pending，或 failed 但次數未達上限；依加入順序。"""
+    sql = ("SELECT * FROM ingest_queue WHERE status='pending' OR (status='failed' AND attempts < ?) "
+           "ORDER BY rowid")
+    params = [max_attempts]
+    if limit:
+        sql += " LIMIT ?"
+        params.append(limit)
+    return [dict(r) for r in conn.execute(sql, params)]
+
+
+def mark_done(conn, key: str):
+    conn.execute("UPDATE ingest_queue SET status='done', attempts=attempts+1, last_error='', updated_at=? "
+                 "WHERE chart_key=?", (_now(), key))
+
+
+def mark_failed(conn, key: str, error: str):
+    conn.execute("UPDATE ingest_queue SET status='failed', attempts=attempts+1, last_error=?, updated_at=? "
+                 "WHERE chart_key=?", (error[:500], _now(), key))
+
+
+def roster_stats(conn) -> dict:
+    stats = {
+        "clients": conn.execute("SELECT COUNT(*) FROM clients").fetchone()[0],
+        "charts": conn.execute("SELECT COUNT(*) FROM charts").fetchone()[0],
+        "indexed": conn.execute("SELECT COUNT(*) FROM chart_meta WHERE index_version=?", (INDEX_VERSION,)).fetchone()[0],
+    }
+    stats["date_indexed"] = conn.execute("SELECT COUNT(*) FROM date_index_members").fetchone()[0]
+    stats["precomputed"] = conn.execute("SELECT COUNT(*) FROM precomputed_timelines WHERE rules_version=?",
+                                        (engine.ENGINE_RULES_VERSION,)).fetchone()[0]
+    for row in conn.execute("SELECT status, COUNT(*) AS n FROM ingest_queue GROUP BY status"):
+        stats[f"queue_{row['status']}"] = row["n"]
+    return stats
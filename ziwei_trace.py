@@ -0,0 +1,182 @@
+# -*- coding: utf-8 -*-
+"""
+引擎追蹤事件（取代散落各處的 if DEBUG: print）
+
+  import ziwei_trace as trace
+  counter = trace.CounterSink()
+  trace.add_sink(counter)
+  ...跑命盤...
+  print(counter.summary())
+  trace.remove_sink(counter)
+
+呼叫端一律寫成
+  if trace.enabled:
+      trace.emit("HUA.locate", "{tag}（{stem}）", tag=tag, stem=stem)
+沒有任何 sink 時 enabled 為 False，整段只多一次屬性讀取；
+訊息模板只在需要文字的 sink（LogSink / format_event）才格式化。
+
+計時用 span()：
+  with trace.span("render.da_summary"):
+      ...
+關閉時回傳共用的空 context，不取時間、不建事件。
+"""
+import time
+import logging
+import threading
+from collections import namedtuple, deque
+
+# name   : 事件名稱，「群組.細項」，例如 HUA.locate、DAXIAN.nearest、render.v7_table
+# msg    : str.format 模板（可為空字串），fields 為其參數
+# ts     : time.perf_counter() 時間點
+# elapsed: span 的耗時（秒）；一般事件為 None
+TraceEvent = namedtuple("TraceEvent", ["name", "msg", "fields", "ts", "elapsed"])
+
+enabled = False
+_SINKS = []
+_SINKS_LOCK = threading.Lock()
+
+
+def add_sink(sink):
+    """sink 為可呼叫物件：sink(TraceEvent)。"""
+    global enabled
+    with _SINKS_LOCK:
+        if sink not in _SINKS:
+            _SINKS.append(sink)
+        enabled = True
+    return sink
+
+
+def remove_sink(sink):
+    global enabled
+    with _SINKS_LOCK:
+        if sink in _SINKS:
+            _SINKS.remove(sink)
+        enabled = bool(_SINKS)
+
+
+def clear_sinks():
+    global enabled
+    with _SINKS_LOCK:
+        _SINKS.clear()
+        enabled = False
+
+
+def emit(name: str, msg: str = "", elapsed: float = None, **fields):
+    if not enabled:
+        return
+    event = TraceEvent(name, msg, fields, time.perf_counter(), elapsed)
+    for sink in tuple(_SINKS):
+        sink(event)
+
+
+def format_event(event: TraceEvent) -> str:
+    """事件 → 一行文字，例如『DEBUG[HUA] 流月01四化（甲）｜祿:廉貞->甲申』。"""
+    group = event.name.split(".", 1)[0]
+    text = event.msg.format(**event.fields) if event.msg else event.name
+    if event.elapsed is not None:
+        text += f"（{event.elapsed * 1000:.2f} ms）"
+    return f"DEBUG[{group}] {text}"
+
+
+# ==================== 計時 ====================
+
+class _NullSpan:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_NULL_SPAN = _NullSpan()
+
+
+class _Span:
+    __slots__ = ("name", "fields", "t0")
+
+    def __init__(self, name, fields):
+        self.name, self.fields = name, fields
+
+    def __enter__(self):
+        self.t0 = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        emit(self.name, "", time.perf_counter() - self.t0, **self.fields)
+        return False
+
+
+def span(name: str, **fields):
+    """計時區段；結束時送出一個帶 elapsed 的事件。追蹤關閉時為空操作。"""
+    return _Span(name, fields) if enabled else _NULL_SPAN
+
+
+# ==================== 內建 sink ====================
+
+class LogSink:
+    """寫到 logging（預設 logger 名稱 ziwei.trace，層級 DEBUG）。"""
+
+    def __init__(self, logger=None, level=logging.DEBUG):
+        self.logger = logger or logging.getLogger("ziwei.trace")
+        self.level = level
+
+    def __call__(self, event):
+        if self.logger.isEnabledFor(self.level):
+            self.logger.log(self.level, format_event(event))
+
+
+class PrintSink:
+    """直接 print（舊版 DEBUG=True 的行為；會混進 redirect 的輸出）。exclude：不印的事件名稱前綴。"""
+
+    def __init__(self, exclude=()):
+        self.exclude = tuple(exclude)
+
+    def __call__(self, event):
+        if not (self.exclude and event.name.startswith(self.exclude)):
+            print(format_event(event))
+
+
+class CollectorSink:
+    """收在記憶體裡（最多 maxlen 筆），方便測試或事後檢視。"""
+
+    def __init__(self, maxlen=100000, names=None):
+        self.events = deque(maxlen=maxlen)
+        self.names = tuple(names) if names else None
+
+    def __call__(self, event):
+        if self.names is None or event.name.startswith(self.names):
+            self.events.append(event)
+
+    def clear(self):
+        self.events.clear()
+
+
+class CounterSink:
+    """依事件名稱累計次數與總耗時（只有 span 事件才有耗時）。"""
+
+    def __init__(self):
+        self.counts = {}
+        self.totals = {}
+        self._lock = threading.Lock()
+
+    def __call__(self, event):
+        with self._lock:
+            self.counts[event.name] = self.counts.get(event.name, 0) + 1
+            if event.elapsed is not None:
+                self.totals[event.name] = self.totals.get(event.name, 0.0) + event.elapsed
+
+    def summary(self) -> str:
+        lines = []
+        for name in sorted(self.counts):
+            line = f"{name:<28} {self.counts[name]:>8} 次"
+            if name in self.totals:
+                line += f"  {self.totals[name] * 1000:>10.2f} ms"
+            lines.append(line)
+        return "\n".join(lines)
+
+    def reset(self):
+        with self._lock:
+            self.counts.clear()
+            self.totals.clear()